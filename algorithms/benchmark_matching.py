@@ -0,0 +1,336 @@
+"""
+Scaling benchmark for FingerprintMatcher.
+Run: python algorithms/benchmark_matching.py [results.json] [max_cells]
+     python algorithms/benchmark_matching.py compare old.json new.json
+
+Builds synthetic radio maps the way synthetic_radio_map_final.py does (log-distance
+path loss, 2-3 dB std) for every cell count x beacon count in MAP_SIZES x
+BEACON_COUNTS, compiles each to a .rmap artifact like the gateway loads, and
+measures per match mode:
+  - load time and peak traced memory (tracemalloc, matcher load + queries)
+  - locate_miner latency percentiles and single-reading throughput
+  - locate_miners_batch throughput
+  - mean location error against the cell each reading was simulated in
+Readings with fewer than 2 audible beacons are rejected by the matcher and
+still timed, as on the gateway; 'located' counts the ones that got a fix.
+Results are written as JSON tagged with the git commit, so runs on different
+commits (or gateway hardware) can be compared with the compare command.
+"""
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+if __name__ == "__main__":
+    # Run as python algorithms/benchmark_matching.py: put the repo root on the path
+    # (imported as a module, sys.path is left alone)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from algorithms.compile_radio_map import compile_radio_map
+from algorithms.fingerprint_matching import FingerprintMatcher, MATCH_MODES
+
+# Configuration
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "benchmark_results")
+MAP_SIZES = [100, 1000, 10000, 100000]
+BEACON_COUNTS = [3, 8, 16, 32]
+MODES = list(MATCH_MODES)
+
+N_QUERIES = 200         # Timed locate_miner calls per configuration
+N_WARMUP = 20           # Untimed calls first (lazy tables, caches)
+N_MEMORY_QUERIES = 20   # Calls made while tracemalloc is on
+BATCH_SIZE = 50         # Readings per locate_miners_batch call
+PERCENTILES = [50, 90, 99]
+
+# Path loss as in synthetic_radio_map_final.rssi_from_distance
+TX_POWER = -50.0
+PATH_LOSS = 2.5
+MIN_DISTANCE = 0.5
+HEARING_THRESHOLD = -95.0   # Beacons weaker than this are not in a cell's stats
+MIN_HEARD = 3               # Every cell keeps at least its strongest beacons
+
+SEED = 42
+
+
+def git_commit():
+    """Current commit hash (with '-dirty' for uncommitted changes), or None outside git."""
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo, text=True,
+                                         stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        cwd=repo, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def synthetic_map_arrays(n_cells, n_beacons, rng):
+    """
+    Square-ish grid of n_cells with n_beacons spread evenly over it.
+
+    Returns:
+    (cell_xy, beacon_xy, mean, std, valid) arrays; valid drops beacons below
+    HEARING_THRESHOLD except each cell's MIN_HEARD strongest.
+    """
+    width = int(math.ceil(math.sqrt(n_cells)))
+    height = int(math.ceil(n_cells / width))
+    cell_xy = np.column_stack((np.arange(n_cells) % width, np.arange(n_cells) // width))
+
+    # Beacons on a jittered lattice so coverage stays even as counts grow
+    columns = int(math.ceil(math.sqrt(n_beacons * width / height)))
+    rows = int(math.ceil(n_beacons / columns))
+    slot = np.arange(n_beacons)
+    beacon_xy = np.column_stack((
+        (slot % columns + rng.uniform(0.25, 0.75, n_beacons)) * width / columns,
+        (slot // columns + rng.uniform(0.25, 0.75, n_beacons)) * height / rows
+    ))
+
+    distance = np.hypot(cell_xy[:, np.newaxis, 0] - beacon_xy[np.newaxis, :, 0],
+                        cell_xy[:, np.newaxis, 1] - beacon_xy[np.newaxis, :, 1])
+    mean = TX_POWER - 10 * PATH_LOSS * np.log10(np.maximum(distance, MIN_DISTANCE))
+    std = 2.0 + rng.uniform(0, 1, mean.shape)
+
+    strongest = np.argsort(-mean, axis=1)[:, :min(MIN_HEARD, n_beacons)]
+    valid = mean >= HEARING_THRESHOLD
+    np.put_along_axis(valid, strongest, True, axis=1)
+
+    return cell_xy, beacon_xy, mean, std, valid
+
+
+def write_radio_map(path, cell_xy, beacon_xy, mean, std, valid):
+    """Write the arrays as a FingerprintMatcher JSON radio map."""
+    beacon_ids = [f"B{i + 1}" for i in range(len(beacon_xy))]
+    mean = np.round(mean, 2).tolist()
+    std = np.round(std, 2).tolist()
+
+    cells = {}
+    for row, (x, y) in enumerate(cell_xy.tolist()):
+        cells[f"{x},{y}"] = {
+            "x": x,
+            "y": y,
+            "beacon_stats": {
+                beacon_ids[col]: {"mean": mean[row][col], "std": std[row][col], "samples": 30}
+                for col in np.flatnonzero(valid[row])
+            }
+        }
+
+    radio_map = {
+        "cells": cells,
+        "beacon_positions": {b: [round(float(x), 2), round(float(y), 2)] for b, (x, y) in zip(beacon_ids, beacon_xy)},
+        "grid_resolution": 1.0,
+        "coordinate_system": "cartesian",
+        "metadata": {"type": "benchmark", "total_cells": len(cells), "beacon_ids": beacon_ids}
+    }
+    with open(path, 'w') as f:
+        json.dump(radio_map, f)
+    return beacon_ids
+
+
+def simulated_readings(n_readings, beacon_ids, mean, std, valid, rng):
+    """Noisy readings from random cells: (true rows, list of RSSI dicts)."""
+    rows = rng.integers(0, len(mean), n_readings)
+    noisy = np.round(rng.normal(mean[rows], std[rows]), 1)
+
+    readings = []
+    for i, row in enumerate(rows):
+        heard = valid[row] & (noisy[i] > -100.0)
+        readings.append({beacon_ids[col]: float(noisy[i, col]) for col in np.flatnonzero(heard)})
+    return rows, readings
+
+
+def _location_error(result, cell_xy, row):
+    location = result.get('location')
+    if location is None:
+        return None
+    return math.hypot(location['x'] - cell_xy[row, 0], location['y'] - cell_xy[row, 1])
+
+
+def benchmark_mode(artifact_path, mode, readings, true_rows, cell_xy, n_queries=N_QUERIES):
+    """
+    Time and memory profile of one match mode on one compiled map.
+
+    Returns:
+    Result dict (see module docstring), or {'mode', 'error'} if the matcher
+    refuses the map (e.g. lookup table over its memory limit).
+    """
+    # Memory pass: everything the matcher allocates to load and answer readings
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        matcher = FingerprintMatcher(artifact_path, match_mode=mode)
+        load_seconds = time.perf_counter() - start
+        for processed_rssi in readings[:N_MEMORY_QUERIES]:
+            matcher.locate_miner(processed_rssi)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    except ValueError as e:
+        return {'mode': mode, 'error': str(e)}
+    finally:
+        tracemalloc.stop()
+
+    engine = matcher.engine
+    table_bytes = engine.table_nbytes()
+
+    for processed_rssi in readings[:N_WARMUP]:
+        matcher.locate_miner(processed_rssi)
+
+    # Latency pass without tracemalloc overhead
+    latencies = np.empty(n_queries)
+    errors = []
+    for i in range(n_queries):
+        processed_rssi = readings[i % len(readings)]
+        start = time.perf_counter()
+        result = matcher.locate_miner(processed_rssi)
+        latencies[i] = time.perf_counter() - start
+        error = _location_error(result, cell_xy, true_rows[i % len(readings)])
+        if error is not None:
+            errors.append(error)
+
+    batch = readings[:BATCH_SIZE]
+    start = time.perf_counter()
+    matcher.locate_miners_batch(batch)
+    batch_seconds = time.perf_counter() - start
+
+    latencies_ms = latencies * 1000.0
+    return {
+        'mode': mode,
+        'load_ms': round(load_seconds * 1000.0, 3),
+        'latency_ms': {f"p{p}": round(float(np.percentile(latencies_ms, p)), 4) for p in PERCENTILES},
+        'latency_ms_mean': round(float(latencies_ms.mean()), 4),
+        'latency_ms_max': round(float(latencies_ms.max()), 4),
+        'throughput_per_s': round(n_queries / float(latencies.sum()), 1),
+        'batch_throughput_per_s': round(len(batch) / batch_seconds, 1),
+        'peak_memory_mib': round(peak_bytes / 2 ** 20, 3),
+        'table_memory_mib': round(table_bytes / 2 ** 20, 3),
+        'mean_error': round(float(np.mean(errors)), 3) if errors else None,
+        'located': len(errors),
+        'queries': n_queries
+    }
+
+
+def run_benchmark(map_sizes=MAP_SIZES, beacon_counts=BEACON_COUNTS, modes=MODES,
+                  n_queries=N_QUERIES, seed=SEED, verbose=True):
+    """
+    Benchmark every map size x beacon count x mode.
+
+    Parameters:
+    - map_sizes: Cell counts to generate
+    - beacon_counts: Beacon counts to generate
+    - modes: FingerprintMatcher match modes to measure
+    - n_queries: Timed locate_miner calls per configuration
+    - seed: RNG seed (same maps and readings on every commit)
+    - verbose: Print a line per configuration
+
+    Returns:
+    Dict with environment info and a 'results' list, ready for json.dump.
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    workdir = tempfile.mkdtemp(prefix='radio_map_benchmark_')
+
+    try:
+        for n_cells in map_sizes:
+            for n_beacons in beacon_counts:
+                cell_xy, beacon_xy, mean, std, valid = synthetic_map_arrays(n_cells, n_beacons, rng)
+                json_path = os.path.join(workdir, f"map_{n_cells}_{n_beacons}.json")
+                artifact_path = json_path[:-len('.json')] + '.rmap'
+
+                beacon_ids = write_radio_map(json_path, cell_xy, beacon_xy, mean, std, valid)
+                compile_radio_map(json_path, artifact_path)
+                os.remove(json_path)
+
+                true_rows, readings = simulated_readings(max(n_queries, BATCH_SIZE), beacon_ids, mean, std, valid, rng)
+
+                for mode in modes:
+                    result = benchmark_mode(artifact_path, mode, readings, true_rows, cell_xy, n_queries)
+                    result.update({'cells': n_cells, 'beacons': n_beacons,
+                                   'mean_heard': round(float(valid.sum(axis=1).mean()), 2)})
+                    results.append(result)
+
+                    if verbose:
+                        if 'error' in result:
+                            print(f"   {n_cells:>7} cells {n_beacons:>2} beacons {mode:<13} skipped: {result['error']}")
+                        else:
+                            print(f"   {n_cells:>7} cells {n_beacons:>2} beacons {mode:<13} "
+                                  f"p50 {result['latency_ms']['p50']:8.3f} ms  p99 {result['latency_ms']['p99']:8.3f} ms  "
+                                  f"{result['throughput_per_s']:>9.1f}/s  peak {result['peak_memory_mib']:8.2f} MiB  "
+                                  f"err {result['mean_error']}  located {result['located']}/{result['queries']}")
+                os.remove(artifact_path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'git_commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'results': results
+    }
+
+
+def compare_results(old, new, threshold=1.2):
+    """
+    Compare two benchmark result dicts configuration by configuration.
+
+    Parameters:
+    - old, new: Dicts from run_benchmark (or the JSON files they were saved to)
+    - threshold: p50 latency ratio (new / old) reported as a regression
+
+    Returns:
+    List of (cells, beacons, mode, old_p50, new_p50, ratio) for configurations in both.
+    """
+    def key(result):
+        return result['cells'], result['beacons'], result['mode']
+
+    previous = {key(r): r for r in old['results'] if 'error' not in r}
+    rows = []
+    for result in new['results']:
+        before = previous.get(key(result))
+        if before is None or 'error' in result:
+            continue
+        old_p50, new_p50 = before['latency_ms']['p50'], result['latency_ms']['p50']
+        ratio = new_p50 / old_p50 if old_p50 > 0 else float('inf')
+        rows.append(key(result) + (old_p50, new_p50, ratio))
+
+    print(f"Comparing {old.get('git_commit')} -> {new.get('git_commit')}")
+    for cells, beacons, mode, old_p50, new_p50, ratio in rows:
+        flag = "  ⚠️ regression" if ratio > threshold else ""
+        print(f"   {cells:>7} cells {beacons:>2} beacons {mode:<13} p50 {old_p50:8.3f} -> {new_p50:8.3f} ms "
+              f"(x{ratio:.2f}){flag}")
+    return rows
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        if len(sys.argv) != 4:
+            print("Usage: python algorithms/benchmark_matching.py compare old.json new.json")
+            sys.exit(1)
+        with open(sys.argv[2], 'r') as f:
+            old_results = json.load(f)
+        with open(sys.argv[3], 'r') as f:
+            new_results = json.load(f)
+        compare_results(old_results, new_results)
+        sys.exit(0)
+
+    commit = git_commit()
+    output = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        RESULTS_DIR, f"benchmark_{(commit or 'nogit')[:12]}.json")
+    max_cells = int(sys.argv[2]) if len(sys.argv) > 2 else max(MAP_SIZES)
+
+    print(f"Benchmarking FingerprintMatcher at {commit or 'unknown commit'}...")
+    report = run_benchmark(map_sizes=[n for n in MAP_SIZES if n <= max_cells])
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ {len(report['results'])} results written to {output}")
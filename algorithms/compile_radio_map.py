@@ -0,0 +1,293 @@
+"""
+Compiles radio_map.json into a compact binary artifact for the gateway.
+Run after convert_radio_map.py or any recalibration:
+    python algorithms/compile_radio_map.py [radio_map.json] [radio_map.rmap]
+
+Artifact layout (little-endian):
+    magic      4 bytes   b'RMAP'
+    version    uint16
+    reserved   uint16
+    header_len uint32
+    header     JSON (beacon IDs, array offsets, scales, source hash, map metadata)
+    arrays     8-byte aligned raw arrays, located by the header offsets:
+               mean   int16 (cells x beacons), RSSI in 0.01 dB, INVALID_VALUE = no stats
+               std    int16 (cells x beacons), 0.01 dB
+               coords int32 (cells x 2), cell (x, y) multiplied by coordinate_scale
+
+FingerprintMatcher memory-maps the arrays instead of parsing JSON, so cold
+start no longer depends on the JSON size. In 'naive_bayes' mode it scores
+the int16 tables in place, so the map stays in (reclaimable) page cache
+rather than process memory; 'lut', 'knn' and 'hierarchical' build dense
+float32 tables from it for their search structures.
+"""
+import hashlib
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+# Configuration
+RADIO_MAP_FILE = os.path.join(os.path.dirname(__file__), "radio_map.json")
+ARTIFACT_FILE = os.path.join(os.path.dirname(__file__), "radio_map.rmap")
+
+ARTIFACT_MAGIC = b'RMAP'
+ARTIFACT_VERSION = 1
+ARTIFACT_EXTENSION = '.rmap'
+
+RSSI_SCALE = 0.01           # dB per int16 step
+INVALID_VALUE = -32768      # int16 sentinel for "no stats for this beacon"
+COORDINATE_SCALE = 1000     # Used only when cell coordinates are fractional
+
+_PREAMBLE = struct.Struct('<4sHHI')
+_ALIGNMENT = 8
+
+
+def file_sha256(path):
+    """SHA-256 of a file's bytes, used to tie an artifact to its source JSON."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def radio_map_beacon_ids(radio_map):
+    """Beacon column order: metadata beacon_ids, else every beacon seen in the cells."""
+    beacon_ids = radio_map.get('metadata', {}).get('beacon_ids')
+    if beacon_ids:
+        return list(beacon_ids)
+
+    seen = set()
+    for cell_data in radio_map['cells'].values():
+        seen.update(cell_data.get('beacon_stats', {}).keys())
+    return sorted(seen)
+
+
+def format_cell_id(x, y):
+    """Cell ID in the radio map's "x,y" convention."""
+    return f"{x},{y}"
+
+
+def _quantize(values, valid):
+    quantized = np.round(np.asarray(values, dtype=float) / RSSI_SCALE)
+    quantized = np.clip(quantized, INVALID_VALUE + 1, np.iinfo(np.int16).max)
+    return np.where(valid, quantized, INVALID_VALUE).astype('<i2')
+
+
+def compile_radio_map(radio_map_path=RADIO_MAP_FILE, artifact_path=ARTIFACT_FILE):
+    """
+    Compile a JSON radio map into a versioned binary artifact.
+
+    Returns: header dict written to the artifact
+    """
+    with open(radio_map_path, 'r') as f:
+        radio_map = json.load(f)
+
+    if "cells" not in radio_map:
+        raise ValueError("Radio map not in FingerprintMatcher format, run convert_radio_map.py first")
+
+    cells = radio_map['cells']
+    beacon_ids = radio_map_beacon_ids(radio_map)
+    n_cells, n_beacons = len(cells), len(beacon_ids)
+
+    mean = np.zeros((n_cells, n_beacons))
+    std = np.zeros((n_cells, n_beacons))
+    valid = np.zeros((n_cells, n_beacons), dtype=bool)
+    coords = np.zeros((n_cells, 2))
+
+    for row, cell_data in enumerate(cells.values()):
+        coords[row] = (cell_data['x'], cell_data['y'])
+        beacon_stats = cell_data.get('beacon_stats', {})
+        for col, beacon_id in enumerate(beacon_ids):
+            stats = beacon_stats.get(beacon_id)
+            if not stats or stats.get('mean') is None or stats.get('std') is None or stats['std'] <= 0:
+                continue
+            mean[row, col] = stats['mean']
+            std[row, col] = stats['std']
+            valid[row, col] = True
+
+    # Integer grids store coordinates as-is; fractional grids are fixed-point
+    integer_grid = np.all(coords == np.round(coords))
+    coordinate_scale = 1 if integer_grid else COORDINATE_SCALE
+
+    header = {
+        'version': ARTIFACT_VERSION,
+        'n_cells': n_cells,
+        'n_beacons': n_beacons,
+        'beacon_ids': beacon_ids,
+        'rssi_scale': RSSI_SCALE,
+        'invalid_value': INVALID_VALUE,
+        'coordinate_scale': coordinate_scale,
+        'source_sha256': file_sha256(radio_map_path),
+        'beacon_positions': radio_map['beacon_positions'],
+        'grid_resolution': radio_map['grid_resolution'],
+        'coordinate_system': radio_map['coordinate_system'],
+        'metadata': radio_map.get('metadata', {}),
+    }
+
+    # Only keep an explicit ID table if IDs can't be rebuilt from coordinates
+    if integer_grid:
+        derived_ids = [format_cell_id(int(x), int(y)) for x, y in coords]
+    else:
+        derived_ids = [format_cell_id(float(x), float(y)) for x, y in coords]
+    if derived_ids != list(cells.keys()):
+        header['cell_ids'] = list(cells.keys())
+
+    arrays = [
+        ('mean', _quantize(mean, valid)),
+        ('std', _quantize(std, valid)),
+        ('coords', np.round(coords * coordinate_scale).astype('<i4')),
+    ]
+
+    # Offsets depend on header length, so iterate until the header fits
+    header['arrays'] = {}
+    header_bytes = b''
+    while True:
+        offset = _aligned(_PREAMBLE.size + len(header_bytes))
+        for name, array in arrays:
+            header['arrays'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            offset = _aligned(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode('utf-8')
+        if _PREAMBLE.size + len(header_bytes) <= header['arrays']['mean']['offset']:
+            break
+
+    with open(artifact_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(ARTIFACT_MAGIC, ARTIFACT_VERSION, 0, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays:
+            f.seek(header['arrays'][name]['offset'])
+            f.write(array.tobytes())
+
+    return header
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def read_artifact_header(artifact_path):
+    """Read and validate the artifact header without touching the arrays."""
+    with open(artifact_path, 'rb') as f:
+        preamble = f.read(_PREAMBLE.size)
+        if len(preamble) < _PREAMBLE.size:
+            raise ValueError(f"Radio map artifact truncated: {artifact_path}")
+
+        magic, version, _, header_len = _PREAMBLE.unpack(preamble)
+        if magic != ARTIFACT_MAGIC:
+            raise ValueError(f"Not a radio map artifact: {artifact_path}")
+        if version != ARTIFACT_VERSION:
+            raise ValueError(f"Unsupported radio map artifact version {version} (expected {ARTIFACT_VERSION})")
+
+        return json.loads(f.read(header_len).decode('utf-8'))
+
+
+def is_artifact_path(path):
+    return str(path).endswith(ARTIFACT_EXTENSION)
+
+
+def artifact_is_current(artifact_path, radio_map_path):
+    """True if the artifact exists and was compiled from the current JSON."""
+    if not os.path.exists(artifact_path) or not os.path.exists(radio_map_path):
+        return False
+    try:
+        header = read_artifact_header(artifact_path)
+    except ValueError:
+        return False
+    return header.get('source_sha256') == file_sha256(radio_map_path)
+
+
+class RadioMapArtifact:
+    def __init__(self, artifact_path):
+        """
+        Lazily memory-mapped view of a compiled radio map.
+
+        Only the header is read here. The int16/int32 arrays are mapped on first
+        access, so pages are faulted in by the OS as scoring touches them.
+        """
+        self.path = artifact_path
+        self.header = read_artifact_header(artifact_path)
+        self._arrays = {}
+
+    def _array(self, name):
+        if name not in self._arrays:
+            spec = self.header['arrays'][name]
+            self._arrays[name] = np.memmap(
+                self.path, dtype=np.dtype(spec['dtype']), mode='r',
+                offset=spec['offset'], shape=tuple(spec['shape'])
+            )
+        return self._arrays[name]
+
+    @property
+    def beacon_ids(self):
+        return self.header['beacon_ids']
+
+    @property
+    def n_cells(self):
+        return self.header['n_cells']
+
+    @property
+    def mean_q(self):
+        return self._array('mean')
+
+    @property
+    def std_q(self):
+        return self._array('std')
+
+    @property
+    def valid(self):
+        return self.mean_q != self.header['invalid_value']
+
+    @property
+    def cell_xy(self):
+        coords = self._array('coords')
+        scale = self.header['coordinate_scale']
+        return coords if scale == 1 else coords / scale
+
+    @property
+    def cell_ids(self):
+        """Cell IDs as a sequence, formatted from coordinates on access."""
+        cell_ids = self.header.get('cell_ids')
+        if cell_ids is not None:
+            return cell_ids
+        return ArtifactCellIds(self.cell_xy)
+
+    def radio_map_stub(self):
+        """Radio map dict without cells, for code that reads map-level keys."""
+        return {
+            'beacon_positions': self.header['beacon_positions'],
+            'grid_resolution': self.header['grid_resolution'],
+            'coordinate_system': self.header['coordinate_system'],
+            'metadata': self.header.get('metadata', {}),
+        }
+
+
+class ArtifactCellIds:
+    def __init__(self, cell_xy):
+        """Read-only "x,y" ID sequence that avoids storing one string per cell."""
+        self._cell_xy = cell_xy
+
+    def __len__(self):
+        return len(self._cell_xy)
+
+    def __getitem__(self, row):
+        x, y = self._cell_xy[row]
+        return format_cell_id(x.item(), y.item())
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else RADIO_MAP_FILE
+    target = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(source)[0] + ARTIFACT_EXTENSION
+
+    if not os.path.exists(source):
+        print(f"❌ {source} not found")
+        sys.exit(1)
+
+    header = compile_radio_map(source, target)
+    print(f"✅ Compiled {header['n_cells']} cells x {header['n_beacons']} beacons -> {target}")
+    print(f"   Source SHA-256: {header['source_sha256']}")
@@ -46,7 +46,11 @@ def convert():
         "cells": cells,
         "beacon_positions": BEACON_POSITIONS,
         "grid_resolution": 1.0,
-        "coordinate_system": "cartesian"
+        "coordinate_system": "cartesian",
+        "metadata": {
+            "total_cells": len(cells),
+            "beacon_ids": list(BEACON_POSITIONS.keys())
+        }
     }
 
     with open(RADIO_MAP_FILE, 'w') as f:
@@ -0,0 +1,324 @@
+"""
+Equivalence checks for the optimized matching and preprocessing paths.
+
+Each check runs an optimized path (vectorized, batched, incremental,
+sharded, hierarchical, lazy results) and the straightforward one on the
+same synthetic radio map and readings, and prints OK or FAIL per check.
+Run: python algorithms/equivalence_test.py
+"""
+import copy
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+# Repo root on the path, so the script also runs as python algorithms/equivalence_test.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from algorithms.benchmark_matching import simulated_readings, synthetic_map_arrays, write_radio_map
+from algorithms.compile_radio_map import compile_radio_map
+from algorithms.fingerprint_matching import FingerprintMatcher
+from algorithms.lazy_result import LazyResult
+from algorithms.rssi_preprocessing import RSSIPreprocessor
+from algorithms.sharded_matching import ShardedMatcher
+
+# Synthetic map and readings shared by the checks
+N_CELLS = 1600
+N_BEACONS = 16
+N_READINGS = 200
+SEED = 7
+
+# Confidence may differ by rounding only (results are rounded to 3 decimals)
+CONFIDENCE_TOLERANCE = 1e-3
+
+# Log-likelihoods: vectorized vs per-cell product, float rounding only
+LOG_LIKELIHOOD_TOLERANCE = 1e-9
+
+# Readings scored cell by cell in pure Python (slow path)
+N_BASELINE_READINGS = 20
+
+# Preprocessing: miners per cycle, cycles, samples per beacon
+N_MINERS = 12
+N_CYCLES = 3
+SAMPLES_PER_BEACON = 10
+
+# Incremental scoring: fixes along one drifting reading
+N_DRIFT_STEPS = 150
+
+# Default hierarchical search scores only part of the map
+HIERARCHICAL_MIN_AGREEMENT = 0.9
+HIERARCHICAL_MAX_CONFIDENCE_GAP = 0.025
+
+
+def report(name, passed, detail=""):
+    print(f"{'OK  ' if passed else 'FAIL'} {name}{': ' + detail if detail else ''}")
+    return passed
+
+
+def same_fix(result, expected, tolerance=CONFIDENCE_TOLERANCE):
+    """Same location and confidence within tolerance."""
+    return (result['location'] == expected['location']
+            and abs(result['confidence'] - expected['confidence']) <= tolerance)
+
+
+def close_values(a, b, tolerance):
+    """Dicts with the same keys whose values agree within tolerance (None only matches None)."""
+    if a.keys() != b.keys():
+        return False
+    for key, value in a.items():
+        other = b[key]
+        if value is None or other is None:
+            if value is not other:
+                return False
+        elif abs(value - other) > tolerance:
+            return False
+    return True
+
+
+def check_vectorized_scoring(map_path, readings):
+    """Vectorized and batch Naive Bayes scoring against the per-cell baseline."""
+    matcher = FingerprintMatcher(map_path)
+    engine = matcher.engine
+    cells = list(matcher.radio_map['cells'].values())
+
+    # Engine log-likelihood == log of the original per-cell product
+    worst = 0.0
+    for reading in readings[:N_BASELINE_READINGS]:
+        expected = np.log([matcher._calculate_cell_probability(reading, cell_data) for cell_data in cells])
+        worst = max(worst, float(np.abs(engine.log_likelihood(engine.rssi_array(reading)) - expected).max()))
+    passed = report("vectorized log-likelihood == per-cell baseline", worst <= LOG_LIKELIHOOD_TOLERANCE,
+                    f"max difference {worst:.2e}")
+
+    # Particle-style (reading, cell) pairs == the same cells from the full scoring
+    rng = np.random.default_rng(SEED)
+    rssi_matrix = np.array([engine.rssi_array(reading) for reading in readings])
+    rows = rng.integers(0, engine.n_cells, len(readings))
+    full = engine.log_likelihood(rssi_matrix)[np.arange(len(readings)), rows]
+    worst = float(np.abs(engine.pair_log_likelihood(rssi_matrix, rows) - full).max())
+    passed &= report("pair log-likelihood == full scoring", worst <= LOG_LIKELIHOOD_TOLERANCE,
+                     f"max difference {worst:.2e}")
+
+    # One batch call == one locate_miner per miner
+    miner_ids = [f"M{i:03d}" for i in range(len(readings))]
+    batch = matcher.locate_miners_batch(readings, miner_ids)
+    single = [matcher.locate_miner(reading, miner_id) for reading, miner_id in zip(readings, miner_ids)]
+    mismatches = sum(result != expected for result, expected in zip(batch, single))
+    passed &= report("locate_miners_batch == locate_miner", mismatches == 0,
+                     f"{mismatches} of {len(readings)} differ")
+    return passed
+
+
+def check_artifact_scoring(map_path, readings):
+    """Compiled artifact scored from its int16 tables against the JSON map."""
+    artifact_path = os.path.splitext(map_path)[0] + ".rmap"
+    compile_radio_map(map_path, artifact_path)
+
+    # Stats are quantized to 0.01 dB, so fixes agree to confidence rounding
+    expected = FingerprintMatcher(map_path).locate_miners_batch(readings)
+    artifact = FingerprintMatcher(artifact_path)
+    mismatches = sum(not same_fix(artifact.locate_miner(reading), reference)
+                     for reading, reference in zip(readings, expected))
+    passed = report("artifact == JSON map", mismatches == 0, f"{mismatches} of {len(readings)} differ")
+
+    # Batches score in row chunks too; Naive Bayes never expands the artifact into dense tables
+    mismatches = sum(not same_fix(result, reference)
+                     for result, reference in zip(artifact.locate_miners_batch(readings), expected))
+    passed &= report("artifact batch == JSON map", mismatches == 0, f"{mismatches} of {len(readings)} differ")
+    passed &= report("artifact scored in place (no dense tables)", artifact.engine.table_nbytes() == 0)
+    return passed
+
+
+def check_preprocessing_batch(beacon_ids, rng):
+    """RSSIPreprocessor.process_batch against process_miner_rssi, cycle after cycle."""
+    per_miner = RSSIPreprocessor(beacon_ids=beacon_ids)
+    batched = RSSIPreprocessor(beacon_ids=beacon_ids)
+    miner_ids = [f"M{i:02d}" for i in range(N_MINERS)]
+    levels = rng.uniform(-90, -50, (N_MINERS, len(beacon_ids)))
+
+    previous = {miner_id: None for miner_id in miner_ids}
+    mismatches = 0
+    for _ in range(N_CYCLES):
+        raw_samples_by_miner = {}
+        for row, miner_id in enumerate(miner_ids):
+            raw_samples = {}
+            for col, beacon_id in enumerate(beacon_ids):
+                # Some beacons unheard or short of min_samples, a few outliers
+                count = int(rng.choice([0, 2, SAMPLES_PER_BEACON]))
+                values = np.round(rng.normal(levels[row, col], 3.0, count), 1)
+                values[rng.random(count) < 0.1] += 30
+                raw_samples[beacon_id] = values.tolist()
+            raw_samples_by_miner[miner_id] = raw_samples
+
+        previous_smoothed = np.array([
+            [np.nan if previous[miner_id] is None or previous[miner_id].get(beacon_id) is None
+             else previous[miner_id][beacon_id] for beacon_id in beacon_ids]
+            for miner_id in miner_ids
+        ])
+        packed_ids, samples, mask = batched.pack_samples(raw_samples_by_miner)
+        batch = batched.process_batch(packed_ids, samples, mask, previous_smoothed)
+
+        for row, miner_id in enumerate(packed_ids):
+            expected = per_miner.process_miner_rssi(miner_id, raw_samples_by_miner[miner_id], previous[miner_id])
+            result = batched.batch_miner_result(batch, row)
+            if not (close_values(result['processed_rssi'], expected['processed_rssi'], CONFIDENCE_TOLERANCE)
+                    and close_values(result['beacon_confidence'], expected['beacon_confidence'], CONFIDENCE_TOLERANCE)
+                    and abs(result['overall_confidence'] - expected['overall_confidence']) <= CONFIDENCE_TOLERANCE
+                    and result['status'] == expected['status']):
+                mismatches += 1
+            previous[miner_id] = expected['processed_rssi']
+
+    return report("process_batch == process_miner_rssi", mismatches == 0,
+                  f"{mismatches} of {N_MINERS * N_CYCLES} differ")
+
+
+def check_incremental(map_path, beacon_ids, rng):
+    """Incremental rescoring against full scoring on a slowly drifting reading."""
+    passed = True
+    for mode in ('naive_bayes', 'lut'):
+        full = FingerprintMatcher(map_path, match_mode=mode)
+        incremental = FingerprintMatcher(map_path, match_mode=mode, incremental=True)
+
+        reading = {beacon_id: float(np.round(rng.uniform(-90, -50), 1)) for beacon_id in beacon_ids}
+        mismatches = 0
+        for step in range(N_DRIFT_STEPS):
+            # One beacon moves per cycle; now and then one drops out
+            reading = dict(reading)
+            beacon_id = rng.choice(list(reading))
+            reading[beacon_id] = float(np.round(reading[beacon_id] + rng.normal(0, 2), 1))
+            if step % 40 == 39 and len(reading) > 1:
+                reading.pop(rng.choice(list(reading)))
+
+            expected = full.locate_miner(reading, 'M01')
+            result = incremental.locate_miner(reading, 'M01')
+            result['metrics'].pop('beacons_rescored', None)
+            mismatches += result != expected
+        passed &= report(f"incremental == full scoring ({mode})", mismatches == 0,
+                         f"{mismatches} of {N_DRIFT_STEPS} differ")
+    return passed
+
+
+def check_sharded(map_path, readings):
+    """ShardedMatcher against the matcher it wraps."""
+    matcher = FingerprintMatcher(map_path)
+    sharded = ShardedMatcher(FingerprintMatcher(map_path), n_workers=2, min_shard_cells=N_CELLS // 4)
+    try:
+        miner_ids = [f"M{i:03d}" for i in range(len(readings))]
+        expected = matcher.locate_miners_batch(readings, miner_ids)
+
+        mismatches = sum(
+            not same_fix(sharded.locate_miner(reading, miner_id), reference)
+            for reading, miner_id, reference in zip(readings, miner_ids, expected)
+        )
+        passed = report("sharded locate_miner == locate_miner", mismatches == 0,
+                        f"{mismatches} of {len(readings)} differ")
+
+        mismatches = sum(
+            not same_fix(result, reference)
+            for result, reference in zip(sharded.locate_miners_batch(readings, miner_ids), expected)
+        )
+        passed &= report("sharded locate_miners_batch == locate_miners_batch", mismatches == 0,
+                         f"{mismatches} of {len(readings)} differ")
+    finally:
+        sharded.close()
+    return passed
+
+
+def check_lazy_result():
+    """LazyResult behaves like the dict with every field computed up front."""
+    calls = []
+
+    def diagnostics():
+        calls.append(1)
+        return {'samples': [1, 2, 3]}
+
+    def make():
+        result = LazyResult({'location': (1, 2), 'confidence': 0.8})
+        result.defer('diagnostics', diagnostics)
+        return result
+
+    eager = {'location': (1, 2), 'confidence': 0.8, 'diagnostics': {'samples': [1, 2, 3]}}
+
+    result = make()
+    passed = report("LazyResult field not built until read", not calls and result.is_lazy('diagnostics'))
+    passed &= report("LazyResult == eager dict", result == eager and len(result) == len(eager))
+    passed &= report("LazyResult factory runs once", result['diagnostics'] == eager['diagnostics']
+                     and len(calls) == 1)
+
+    copied = make().copy()
+    passed &= report("LazyResult copy keeps pending fields lazy",
+                     copied.is_lazy('diagnostics') and copied == eager)
+    passed &= report("LazyResult deepcopy == eager dict", copy.deepcopy(make()) == eager)
+
+    restored = pickle.loads(pickle.dumps(make()))
+    passed &= report("LazyResult pickle round-trip",
+                     isinstance(restored, LazyResult) and restored == eager
+                     and not restored.is_lazy('diagnostics'))
+    passed &= report("LazyResult json round-trip",
+                     json.loads(json.dumps(make())) == json.loads(json.dumps(eager)))
+    return passed
+
+
+def check_hierarchical(map_path, readings):
+    """Hierarchical search against full Naive Bayes scoring."""
+    full = FingerprintMatcher(map_path)
+    expected = [full.locate_miner(reading) for reading in readings]
+
+    # Refining every block scores every cell, so it must match exactly
+    exhaustive = FingerprintMatcher(map_path, match_mode='hierarchical', refine_blocks=N_CELLS)
+    mismatches = sum(not same_fix(exhaustive.locate_miner(reading), reference)
+                     for reading, reference in zip(readings, expected))
+    passed = report("hierarchical, all blocks refined == full scoring", mismatches == 0,
+                    f"{mismatches} of {len(readings)} differ")
+
+    # One cell per block: coarse scores are exact, so unrefined blocks must
+    # still count fully in the normalizer
+    single = FingerprintMatcher(map_path, match_mode='hierarchical', block_size=1, refine_blocks=2)
+    mismatches = sum(not same_fix(single.locate_miner(reading), reference)
+                     for reading, reference in zip(readings, expected))
+    passed &= report("hierarchical, one-cell blocks == full scoring", mismatches == 0,
+                     f"{mismatches} of {len(readings)} differ")
+
+    # Default refinement: same answer almost always, confidence not inflated
+    hierarchical = FingerprintMatcher(map_path, match_mode='hierarchical')
+    results = [hierarchical.locate_miner(reading) for reading in readings]
+    agreement = np.mean([r['location'] == e['location'] for r, e in zip(results, expected)])
+    gap = np.mean([r['confidence'] - e['confidence'] for r, e in zip(results, expected)])
+    passed &= report(
+        "hierarchical, default refinement ~ full scoring",
+        agreement >= HIERARCHICAL_MIN_AGREEMENT and gap <= HIERARCHICAL_MAX_CONFIDENCE_GAP,
+        f"{agreement:.1%} same location, mean confidence gap {gap:+.4f}"
+    )
+    return passed
+
+
+def main():
+    rng = np.random.default_rng(SEED)
+    cell_xy, beacon_xy, mean, std, valid = synthetic_map_arrays(N_CELLS, N_BEACONS, rng)
+    beacon_ids = [f"B{i + 1}" for i in range(N_BEACONS)]
+    _, readings = simulated_readings(N_READINGS, beacon_ids, mean, std, valid, rng)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        map_path = os.path.join(work_dir, "radio_map.json")
+        write_radio_map(map_path, cell_xy, beacon_xy, mean, std, valid)
+
+        print("=== EQUIVALENCE CHECKS ===")
+        passed = check_vectorized_scoring(map_path, readings)
+        passed &= check_artifact_scoring(map_path, readings)
+        passed &= check_preprocessing_batch(beacon_ids, rng)
+        passed &= check_incremental(map_path, beacon_ids, rng)
+        passed &= check_sharded(map_path, readings)
+        passed &= check_hierarchical(map_path, readings)
+        passed &= check_lazy_result()
+    finally:
+        shutil.rmtree(work_dir)
+
+    print("All checks passed." if passed else "Some checks FAILED.")
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
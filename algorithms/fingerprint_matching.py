@@ -1,21 +1,955 @@
 import numpy as np
 import math
 import json
+import os
+import time
+import itertools
+import threading
 import scipy
+from scipy import sparse
+from scipy.spatial import cKDTree
+from collections import deque, OrderedDict
+from datetime import datetime
 from scipy.stats import norm
 
+from algorithms.compile_radio_map import RadioMapArtifact, is_artifact_path, radio_map_beacon_ids
+from algorithms.lazy_result import LazyResult, VERBOSE_DIAGNOSTICS, VERBOSE_MINIMAL
+
+# Sentinel used by RSSIPreprocessor for a beacon that was not detected
+MISSING_RSSI = -100.0
+
+# Probability floors used by the Naive Bayes model
+MISSING_BEACON_PROB = 0.01
+MIN_BEACON_PROB = 1e-10
+
+LOG_MISSING_BEACON_PROB = math.log(MISSING_BEACON_PROB)
+LOG_MIN_BEACON_PROB = math.log(MIN_BEACON_PROB)
+LOG_SQRT_2PI = 0.5 * math.log(2 * math.pi)
+
+# Upper bound on (miners x cells x beacons) elements scored per batch chunk
+BATCH_CHUNK_ELEMENTS = 2_000_000
+
+# Matching modes supported by FingerprintMatcher
+MATCH_MODES = ('naive_bayes', 'knn', 'lut', 'hierarchical')
+
+# Modes that produce a per-cell log-likelihood (pruning, tracking, particle filter)
+LIKELIHOOD_MODES = ('naive_bayes', 'lut', 'hierarchical')
+
+# Lookup-table bins: preprocessed RSSI is 0.1 dB quantized within about -100..-30 dBm
+LUT_MIN_RSSI = -100.0
+LUT_MAX_RSSI = -30.0
+LUT_STEPS_PER_DB = 10
+LUT_BINS = int(round((LUT_MAX_RSSI - LUT_MIN_RSSI) * LUT_STEPS_PER_DB)) + 1
+
+# Refuse to build lookup tables larger than this (beacons x bins x cells x float32)
+LUT_MAX_BYTES = 256 * 2 ** 20
+
+# Floor on kNN distances (dB) so an exact fingerprint match doesn't divide by zero
+KNN_MIN_DISTANCE = 1e-3
+
+# Result cache keys use RSSI in the preprocessor's 0.1 dB steps
+CACHE_RSSI_STEPS_PER_DB = 10
+
+# Start cells whose BFS reachable set is kept for pruned searches (LRU)
+REACHABLE_CACHE_SIZE = 1024
+
+# Dense scoring tables; engines over a compiled artifact build them only on first use
+DENSE_TABLES = ('mean', 'std', 'valid', 'inv_std', 'log_norm')
+
+# Artifact engines dequantize and score this many (reading x cell x beacon)
+# entries at a time, so the float temporaries stay cache-sized
+QUANTIZED_CHUNK_ELEMENTS = 16384
+
+# Every engine gets a new version, so cached results never outlive their map
+_engine_versions = itertools.count(1)
+
+
+def reachable_cells(maze_data, start, max_distance):
+    """
+    Passable maze cells within max_distance BFS steps of start.
+
+    Parameters:
+    - maze_data: Dict from create_digitized_maze_data_cartesian (uses 'grid_cartesian')
+    - start: (x, y) Cartesian cell
+    - max_distance: Maximum number of moves through passages
+
+    Returns:
+    List of (x, y) cells including start, or [] if start is a wall/outside the grid.
+    """
+    grid = maze_data['grid_cartesian']
+    H, W = grid.shape
+    start_x, start_y = start
+
+    if not (0 <= start_x < W and 0 <= start_y < H) or grid[start_y, start_x] == 1:
+        return []
+
+    distance = {(start_x, start_y): 0}
+    queue = deque([(start_x, start_y)])
+
+    while queue:
+        cx, cy = queue.popleft()
+        if distance[(cx, cy)] >= max_distance:
+            continue
+
+        for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]:
+            nx, ny = cx + dx, cy + dy
+            if 0 <= nx < W and 0 <= ny < H:
+                if grid[ny, nx] != 1 and (nx, ny) not in distance:
+                    distance[(nx, ny)] = distance[(cx, cy)] + 1
+                    queue.append((nx, ny))
+
+    return list(distance.keys())
+
+
+def grid_transition_matrix(maze_data, cell_rows, n_cells, stay_probability):
+    """
+    One-step motion model over radio map rows for the tracking filter.
+
+    A miner stays in its maze cell with stay_probability and otherwise moves to
+    one of the passable 4-neighbours with equal probability. Mass entering a
+    maze cell is split evenly across the radio map rows inside it.
+
+    Parameters:
+    - maze_data: Dict from create_digitized_maze_data_cartesian (uses 'grid_cartesian')
+    - cell_rows: Maze cell (x, y) -> engine rows, from RadioMapEngine.maze_cell_rows()
+    - n_cells: Number of engine rows
+    - stay_probability: Probability of not changing maze cell in one step
+
+    Returns:
+    (track_rows, transition_T): engine rows that lie in passable cells, and the
+    transposed CSR transition matrix over them, so prior = transition_T @ posterior.
+    """
+    grid = maze_data['grid_cartesian']
+    H, W = grid.shape
+
+    def passable(cell):
+        x, y = cell
+        return 0 <= x < W and 0 <= y < H and grid[y, x] != 1 and cell in cell_rows
+
+    cells = [cell for cell in cell_rows if passable(cell)]
+    if not cells:
+        return np.array([], dtype=int), sparse.csr_matrix((0, 0))
+
+    track_rows = np.sort(np.concatenate([cell_rows[cell] for cell in cells]))
+    local = np.full(n_cells, -1, dtype=int)
+    local[track_rows] = np.arange(len(track_rows))
+
+    sources, targets, weights = [], [], []
+    for x, y in cells:
+        neighbours = [(x + dx, y + dy) for dx, dy in [(0, 1), (1, 0), (0, -1), (-1, 0)]
+                      if passable((x + dx, y + dy))]
+        moves = [((x, y), stay_probability if neighbours else 1.0)]
+        moves += [(cell, (1.0 - stay_probability) / len(neighbours)) for cell in neighbours]
+
+        src = local[cell_rows[(x, y)]]
+        for cell, probability in moves:
+            dst = local[cell_rows[cell]]
+            sources.append(np.repeat(src, len(dst)))
+            targets.append(np.tile(dst, len(src)))
+            weights.append(np.full(len(src) * len(dst), probability / len(dst)))
+
+    n = len(track_rows)
+    transition = sparse.csr_matrix(
+        (np.concatenate(weights), (np.concatenate(sources), np.concatenate(targets))),
+        shape=(n, n)
+    )
+    return track_rows, transition.T.tocsr()
+
+
+def _to_epoch_seconds(timestamp):
+    """Accept epoch seconds, datetime, or ISO string (as stored by the gateway)."""
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, datetime):
+        return timestamp.timestamp()
+    if isinstance(timestamp, str):
+        try:
+            return datetime.fromisoformat(timestamp).timestamp()
+        except ValueError:
+            return None
+    return float(timestamp)
+
+
+def _file_signature(path):
+    """(mtime_ns, size) of a file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _copy_result(result, miner_id):
+    """Copy of a result dict (nested dicts included) tagged with miner_id."""
+    copied = dict(result, miner_id=miner_id)
+    if result['location'] is not None:
+        copied['location'] = dict(result['location'])
+    metrics = result['metrics'].copy()
+    if not (isinstance(metrics, LazyResult) and metrics.is_lazy('top_candidates')):
+        metrics['top_candidates'] = [dict(candidate) for candidate in metrics['top_candidates']]
+    copied['metrics'] = metrics
+    return copied
+
+
+def _fill_cell_stats(beacon_stats, beacon_ids, mean_row, std_row, valid_row):
+    """Write one cell's beacon_stats into its engine row (entries without usable stats stay invalid)."""
+    for col, beacon_id in enumerate(beacon_ids):
+        stats = beacon_stats.get(beacon_id)
+        if not stats:
+            continue
+
+        mean_value = stats.get('mean')
+        std_value = stats.get('std')
+        if mean_value is None or std_value is None or std_value <= 0:
+            continue
+
+        mean_row[col] = mean_value
+        std_row[col] = std_value
+        valid_row[col] = True
+
+
+class RadioMapEngine:
+    def __init__(self, beacon_ids, cell_ids, cell_xy, mean, std, valid,
+                 inv_std=None, log_norm=None, changed_rows=None, quantized=None):
+        """
+        Dense, precomputed view of a radio map for vectorized scoring.
+
+        The nested cell dicts are flattened once into (cells x beacons) arrays so
+        that scoring a reading is a single NumPy expression instead of a Python
+        loop over every cell. Build with from_radio_map() or from_artifact().
+
+        An engine over a compiled artifact (quantized) keeps no dense tables:
+        log_likelihood() and pair_log_likelihood() gather the heard columns
+        straight from the memory-mapped int16 data and dequantize only those.
+        The dense tables are built on first access, which only the whole-table
+        builders need (k-d tree, super-cells, lookup tables, sharding).
+
+        Parameters:
+        - beacon_ids: Ordered list of beacon IDs, defines the column order
+        - cell_ids: Sequence of cell IDs, defines the row order
+        - cell_xy: (cells x 2) array of cell coordinates
+        - mean, std: (cells x beacons) RSSI statistics
+        - valid: (cells x beacons) mask of entries with usable statistics
+        - inv_std, log_norm: Precomputed Gaussian constants (computed if None)
+        - changed_rows: Rows rebuilt relative to the previous engine (None = all)
+        - quantized: (mean_q, std_q, scale, invalid_value) int16 tables in
+          place of mean/std/valid (those are then None)
+        """
+        self.version = next(_engine_versions)
+        self.changed_rows = changed_rows
+        self.beacon_ids = list(beacon_ids)
+        self.beacon_index = {beacon_id: i for i, beacon_id in enumerate(self.beacon_ids)}
+
+        self.cell_ids = cell_ids
+        self.cell_xy = cell_xy
+        self._cell_index = None
+        self._maze_cell_rows = None
+        self._kd_tree = None
+        self._lut = None
+        self._super_cells = {}
+
+        self._quantized = quantized
+        if quantized is not None:
+            self._dense_lock = threading.Lock()
+            return
+
+        # Column-major, so gathering the few audible beacons reads contiguous memory
+        self.mean = np.asfortranarray(mean)
+        self.std = np.asfortranarray(std)
+        self.valid = np.asfortranarray(valid)
+
+        # Per-entry Gaussian constants, so scoring never touches log/sqrt
+        self.inv_std = np.asfortranarray(inv_std) if inv_std is not None else 1.0 / self.std
+        self.log_norm = np.asfortranarray(log_norm) if log_norm is not None else -np.log(self.std) - LOG_SQRT_2PI
+
+    @classmethod
+    def from_radio_map(cls, radio_map, beacon_ids):
+        """Flatten a validated JSON radio map dict."""
+        cells = radio_map['cells']
+        n_cells = len(cells)
+        n_beacons = len(beacon_ids)
+
+        mean = np.zeros((n_cells, n_beacons), dtype=float)
+        std = np.ones((n_cells, n_beacons), dtype=float)
+        valid = np.zeros((n_cells, n_beacons), dtype=bool)
+
+        # Keep the map's own coordinate type (ints for surveyed grids)
+        cell_xy = np.array(
+            [(cell_data['x'], cell_data['y']) for cell_data in cells.values()]
+        ).reshape(n_cells, 2)
+
+        for row, cell_data in enumerate(cells.values()):
+            _fill_cell_stats(cell_data.get('beacon_stats', {}), beacon_ids, mean[row], std[row], valid[row])
+
+        return cls(beacon_ids, list(cells.keys()), cell_xy, mean, std, valid)
+
+    def rebuilt(self, radio_map, beacon_ids, previous_cells):
+        """
+        New engine for an updated radio map, reusing this engine's rows for
+        cells whose JSON is unchanged. Only added or recalibrated cells are
+        parsed and get their Gaussian constants recomputed.
+
+        Parameters:
+        - radio_map: Validated new radio map dict
+        - beacon_ids: Beacon column order of the new map
+        - previous_cells: The 'cells' dict this engine was built from
+
+        Returns:
+        RadioMapEngine whose changed_rows lists the rebuilt rows.
+        """
+        if list(beacon_ids) != self.beacon_ids or not previous_cells:
+            return RadioMapEngine.from_radio_map(radio_map, beacon_ids)
+
+        cells = radio_map['cells']
+        n_cells = len(cells)
+        n_beacons = len(beacon_ids)
+
+        new_rows, old_rows, changed = [], [], []
+        for row, (cell_id, cell_data) in enumerate(cells.items()):
+            old_row = self.cell_index.get(cell_id)
+            if old_row is not None and previous_cells.get(cell_id) == cell_data:
+                new_rows.append(row)
+                old_rows.append(old_row)
+            else:
+                changed.append((row, cell_data))
+
+        cell_xy = np.array(
+            [(cell_data['x'], cell_data['y']) for cell_data in cells.values()]
+        ).reshape(n_cells, 2)
+
+        tables = {}
+        for name, fill in (('mean', 0.0), ('std', 1.0), ('valid', False), ('inv_std', 1.0), ('log_norm', 0.0)):
+            old_table = getattr(self, name)
+            table = np.full((n_cells, n_beacons), fill, dtype=old_table.dtype, order='F')
+            table[new_rows] = old_table[old_rows]
+            tables[name] = table
+
+        for row, cell_data in changed:
+            _fill_cell_stats(
+                cell_data.get('beacon_stats', {}), beacon_ids,
+                tables['mean'][row], tables['std'][row], tables['valid'][row]
+            )
+
+        changed_rows = np.array([row for row, _ in changed], dtype=int)
+        std = tables['std'][changed_rows]
+        tables['inv_std'][changed_rows] = 1.0 / std
+        tables['log_norm'][changed_rows] = -np.log(std) - LOG_SQRT_2PI
+
+        engine = RadioMapEngine(
+            beacon_ids, list(cells.keys()), cell_xy,
+            tables['mean'], tables['std'], tables['valid'],
+            inv_std=tables['inv_std'], log_norm=tables['log_norm'],
+            changed_rows=changed_rows
+        )
+
+        # Lookup tables follow the same row reuse (a map grown past the
+        # size limit is left without, for _prepare_engine to fall back)
+        if self._lut is not None and engine._lut_nbytes() <= LUT_MAX_BYTES:
+            lut = np.empty((n_beacons, LUT_BINS, n_cells), dtype=np.float32)
+            lut[:, :, new_rows] = self._lut[:, :, old_rows]
+            lut[:, :, changed_rows] = engine._lut_columns(changed_rows)
+            engine._lut = lut
+
+        return engine
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        """
+        Engine over a memory-mapped RadioMapArtifact (no JSON, no per-cell dicts).
+        Scoring reads the int16 tables in place, so the mapped pages stay
+        file-backed and nothing proportional to the map is allocated at load.
+        """
+        # Plain ndarray views of the maps: np.memmap subclass overhead on every gather
+        quantized = (np.asarray(artifact.mean_q), np.asarray(artifact.std_q), artifact.header['rssi_scale'],
+                     artifact.header['invalid_value'])
+        return cls(artifact.beacon_ids, artifact.cell_ids, artifact.cell_xy, None, None, None,
+                   quantized=quantized)
+
+    def __getattr__(self, name):
+        # Only reached for attributes not set yet: a quantized engine's dense tables
+        if name in DENSE_TABLES and self.__dict__.get('_quantized') is not None:
+            self._dequantize()
+            return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def _dequantize(self):
+        """
+        Build the dense tables of a quantized engine (float32: the artifact
+        already rounds RSSI to its scale). Only the whole-table builders get
+        here; plain Naive Bayes scoring never does.
+        """
+        with self._dense_lock:
+            if 'log_norm' in self.__dict__:
+                return
+            valid, mean, std = self._dequantized(slice(None))
+
+            self.mean = np.asfortranarray(mean)
+            self.std = np.asfortranarray(std)
+            self.valid = np.asfortranarray(valid)
+            self.inv_std = np.asfortranarray(1.0 / std)
+            self.log_norm = np.asfortranarray(-np.log(std) - LOG_SQRT_2PI)
+
+    def _dequantized(self, index):
+        """(valid, mean, std) float32 of the int16 entries selected by index."""
+        mean_q, std_q, scale, invalid_value = self._quantized
+        mean_q, std_q = mean_q[index], std_q[index]
+        scale = np.float32(scale)
+
+        valid = mean_q != invalid_value
+        mean = np.where(valid, mean_q * scale, np.float32(0.0))
+        std = np.where(valid, std_q * scale, np.float32(1.0))
+        return valid, mean, std
+
+    def _scores_quantized(self):
+        """True while scoring reads the int16 artifact data (no dense copy built)."""
+        return self._quantized is not None and 'log_norm' not in self.__dict__
+
+    def _scoring_tables(self, index):
+        """
+        (valid, mean, inv_std, log_norm) entries selected by index, read from
+        the quantized data when there is no dense copy.
+        """
+        if self._scores_quantized():
+            # Same float32 arithmetic as _dequantize(), on the gathered entries only
+            valid, mean, std = self._dequantized(index)
+            return valid, mean, 1.0 / std, -np.log(std) - LOG_SQRT_2PI
+        return self.valid[index], self.mean[index], self.inv_std[index], self.log_norm[index]
+
+    @staticmethod
+    def _summed_log_pdf(rssi_values, observed, valid, mean, inv_std, log_norm):
+        """Floored Gaussian log-probabilities summed over the last (beacon) axis."""
+        log_pdf = np.where(
+            valid & observed,
+            np.maximum(
+                log_norm - 0.5 * ((rssi_values - mean) * inv_std) ** 2,
+                LOG_MIN_BEACON_PROB
+            ),
+            LOG_MISSING_BEACON_PROB
+        )
+        return log_pdf.sum(axis=-1)
+
+    def cell_stats(self, row):
+        """(valid, mean, std) arrays of one engine row, in beacon column order."""
+        if self._scores_quantized():
+            return self._dequantized(row)
+        return self.valid[row], self.mean[row], self.std[row]
+
+    def table_nbytes(self):
+        """Bytes held in scoring tables (a quantized engine's mapped data is not counted)."""
+        return sum(self.__dict__[name].nbytes for name in DENSE_TABLES if name in self.__dict__)
+
+    def has_cells(self, cell_xy):
+        """True if cell_xy holds this engine's cells in row order (e.g. a reload that only changed stats)."""
+        return cell_xy is self.cell_xy or np.array_equal(cell_xy, self.cell_xy)
+
+    @property
+    def cell_index(self):
+        """cell_id -> row, built on first use."""
+        if self._cell_index is None:
+            self._cell_index = {cell_id: i for i, cell_id in enumerate(self.cell_ids)}
+        return self._cell_index
+
+    def kd_tree(self):
+        """
+        cKDTree over the cell mean-RSSI vectors, built on first use. Beacons
+        without stats in a cell sit at MISSING_RSSI, like an undetected reading.
+        """
+        if self._kd_tree is None:
+            fingerprints = np.where(self.valid, self.mean, MISSING_RSSI)
+            self._kd_tree = cKDTree(np.ascontiguousarray(fingerprints))
+        return self._kd_tree
+
+    def maze_cell_rows(self):
+        """
+        Maze cell (x, y) -> array of engine rows inside it, built on first use.
+        Cells are binned by rounding, so finer-than-grid maps group correctly.
+        """
+        if self._maze_cell_rows is None:
+            maze_xy = np.floor(np.asarray(self.cell_xy, dtype=float) + 0.5).astype(int)
+            groups = {}
+            for row, maze_cell in enumerate(map(tuple, maze_xy.tolist())):
+                groups.setdefault(maze_cell, []).append(row)
+            self._maze_cell_rows = {cell: np.array(rows) for cell, rows in groups.items()}
+        return self._maze_cell_rows
+
+    def super_cells(self, block_size):
+        """
+        Coarse level for hierarchical search, built on first use per block size.
+
+        Cells are grouped into block_size x block_size blocks of (x, y). Each
+        block gets pooled beacon stats: the mean and variance of the mixture of
+        its cells' Gaussians (cells without stats for a beacon are left out).
+
+        Returns:
+        (block_engine, block_rows): a RadioMapEngine with one row per block and
+        a list with the array of fine engine rows in each block.
+        """
+        if block_size not in self._super_cells:
+            cell_xy = np.asarray(self.cell_xy, dtype=float)
+            blocks, block_of_row = np.unique(
+                np.floor(cell_xy / block_size).astype(int), axis=0, return_inverse=True
+            )
+            block_of_row = block_of_row.reshape(-1)
+            n_blocks = len(blocks)
+
+            # (blocks x cells) membership matrix turns pooling into sparse products
+            membership = sparse.csr_matrix(
+                (np.ones(self.n_cells), (block_of_row, np.arange(self.n_cells))),
+                shape=(n_blocks, self.n_cells)
+            )
+            valid = self.valid.astype(float)
+            n_valid = membership @ valid
+            sum_mean = membership @ (valid * self.mean)
+            sum_square = membership @ (valid * (self.std ** 2 + self.mean ** 2))
+
+            pooled_valid = n_valid > 0
+            count = np.maximum(n_valid, 1.0)
+            pooled_mean = np.where(pooled_valid, sum_mean / count, 0.0)
+            pooled_var = sum_square / count - pooled_mean ** 2
+            pooled_std = np.where(pooled_valid, np.sqrt(np.maximum(pooled_var, 1e-6)), 1.0)
+
+            block_xy = (membership @ cell_xy) / np.bincount(block_of_row, minlength=n_blocks)[:, np.newaxis]
+            block_ids = [f"{bx},{by}" for bx, by in blocks.tolist()]
+            block_engine = RadioMapEngine(
+                self.beacon_ids, block_ids, block_xy, pooled_mean, pooled_std, pooled_valid
+            )
+
+            order = np.argsort(block_of_row, kind='stable')
+            boundaries = np.cumsum(np.bincount(block_of_row, minlength=n_blocks))[:-1]
+            self._super_cells[block_size] = (block_engine, np.split(order, boundaries))
+        return self._super_cells[block_size]
+
+    def lut(self):
+        """
+        Quantized log-likelihood lookup table, built on first use.
+
+        lut[beacon, bin, cell] is the floored Gaussian log-probability of the
+        RSSI at that 0.1 dB bin (MISSING_BEACON_PROB where the cell has no stats
+        for the beacon), so scoring is a gather plus a sum with no exp/log per fix.
+        """
+        if self._lut is None:
+            self._check_lut_size()
+            self._lut = self._lut_columns(np.arange(self.n_cells))
+        return self._lut
+
+    def _lut_nbytes(self):
+        return len(self.beacon_ids) * LUT_BINS * self.n_cells * np.dtype(np.float32).itemsize
+
+    def _check_lut_size(self):
+        nbytes = self._lut_nbytes()
+        if nbytes > LUT_MAX_BYTES:
+            raise ValueError(
+                f"Lookup table would need {nbytes / 2 ** 20:.0f} MiB "
+                f"(limit {LUT_MAX_BYTES / 2 ** 20:.0f} MiB), use match_mode 'naive_bayes'"
+            )
+
+    def _lut_columns(self, rows):
+        """Lookup table entries (beacons x bins x len(rows)) for the given engine rows."""
+        bin_rssi = (LUT_MIN_RSSI + np.arange(LUT_BINS) / LUT_STEPS_PER_DB)[:, np.newaxis]
+        table = np.empty((len(self.beacon_ids), LUT_BINS, len(rows)), dtype=np.float32)
+
+        for col in range(len(self.beacon_ids)):
+            mean = self.mean[rows, col]
+            inv_std = self.inv_std[rows, col]
+            log_norm = self.log_norm[rows, col]
+            log_pdf = np.maximum(log_norm - 0.5 * ((bin_rssi - mean) * inv_std) ** 2, LOG_MIN_BEACON_PROB)
+
+            table[col] = np.where(self.valid[rows, col], log_pdf, LOG_MISSING_BEACON_PROB)
+        return table
+
+    @property
+    def n_cells(self):
+        return len(self.cell_ids)
+
+    def rssi_array(self, rssi_vector):
+        """Convert an RSSI dict into an array in beacon column order (unknown IDs ignored)."""
+        rssi_values = np.full(len(self.beacon_ids), MISSING_RSSI)
+        for beacon_id, rssi_value in rssi_vector.items():
+            col = self.beacon_index.get(beacon_id)
+            if col is not None:
+                rssi_values[col] = rssi_value
+        return rssi_values
+
+    def log_likelihood(self, rssi_values, rows=None):
+        """
+        Naive Bayes log-likelihood of one reading for every cell.
+
+        Equivalent to log(_calculate_cell_probability) evaluated per cell: a
+        Gaussian per beacon, floored at MIN_BEACON_PROB, with MISSING_BEACON_PROB
+        for undetected beacons and cells without stats.
+
+        Parameters:
+        - rssi_values: Array of RSSI values in beacon column order, either a
+          single reading (beacons,) or a batch (miners, beacons)
+        - rows: Optional array of engine rows to score (default: every cell)
+
+        Returns:
+        Array of shape (cells,) or (miners, cells) with summed log-probabilities.
+        """
+        rssi_values = np.asarray(rssi_values, dtype=float)
+        observed = rssi_values != MISSING_RSSI
+
+        # Sparse scoring: only beacons heard in this reading (or anywhere in the
+        # batch) have a cell-dependent term, the rest add a constant penalty
+        heard = observed if observed.ndim == 1 else observed.any(axis=0)
+        cols = np.flatnonzero(heard)
+        unheard_penalty = LOG_MISSING_BEACON_PROB * (len(self.beacon_ids) - len(cols))
+
+        # (..., 1, heard) broadcasts against the (cells, heard) tables
+        rssi_values = rssi_values[..., cols][..., np.newaxis, :]
+        observed = observed[..., cols][..., np.newaxis, :]
+
+        if not self._scores_quantized():
+            index = (slice(None), cols) if rows is None else np.ix_(rows, cols)
+            return self._summed_log_pdf(rssi_values, observed, *self._scoring_tables(index)) + unheard_penalty
+
+        # Artifact: dequantize a block of rows at a time
+        n_rows = self.n_cells if rows is None else len(rows)
+        n_readings = 1 if rssi_values.ndim == 2 else len(rssi_values)
+        chunk_rows = max(1, QUANTIZED_CHUNK_ELEMENTS // max(1, n_readings * len(cols)))
+
+        summed = np.empty(rssi_values.shape[:-2] + (n_rows,))
+        for start in range(0, n_rows, chunk_rows):
+            stop = min(start + chunk_rows, n_rows)
+            index = (slice(start, stop), cols) if rows is None else np.ix_(rows[start:stop], cols)
+            summed[..., start:stop] = self._summed_log_pdf(rssi_values, observed, *self._scoring_tables(index))
+        return summed + unheard_penalty
+
+    def pair_log_likelihood(self, rssi_values, rows):
+        """
+        log_likelihood() for many (reading, cell) pairs at once: row i of
+        rssi_values scored at engine row rows[i] only. Lets callers that need
+        a few different cells per reading (e.g. the cells each miner's
+        particles occupy) score a whole batch in one call.
+
+        Parameters:
+        - rssi_values: (pairs, beacons) array, one reading per pair
+        - rows: (pairs,) array of engine rows
+
+        Returns:
+        Array of shape (pairs,) with summed log-probabilities.
+        """
+        rssi_values = np.asarray(rssi_values, dtype=float)
+        observed = rssi_values != MISSING_RSSI
+
+        cols = np.flatnonzero(observed.any(axis=0))
+        unheard_penalty = LOG_MISSING_BEACON_PROB * (len(self.beacon_ids) - len(cols))
+
+        tables = self._scoring_tables(np.ix_(rows, cols))
+        return self._summed_log_pdf(rssi_values[:, cols], observed[:, cols], *tables) + unheard_penalty
+
+    def lut_pair_log_likelihood(self, rssi_values, rows):
+        """pair_log_likelihood() read from the quantized lookup table (see lut_log_likelihood)."""
+        rssi_values = np.asarray(rssi_values, dtype=float)
+        observed = rssi_values != MISSING_RSSI
+
+        cols = np.flatnonzero(observed.any(axis=0))
+        unheard_penalty = LOG_MISSING_BEACON_PROB * (len(self.beacon_ids) - observed.sum(axis=-1))
+
+        bins = np.round((rssi_values[:, cols] - LUT_MIN_RSSI) * LUT_STEPS_PER_DB)
+        bins = np.clip(bins, 0, LUT_BINS - 1).astype(np.intp)
+
+        gathered = self.lut()[cols, bins, rows[:, np.newaxis]]
+        gathered = np.where(observed[:, cols], gathered, np.float32(0.0))
+        return gathered.sum(axis=-1, dtype=float) + unheard_penalty
+
+    def lut_log_likelihood(self, rssi_values, rows=None):
+        """
+        Same model as log_likelihood(), read from the quantized lookup table.
+
+        Readings are snapped to 0.1 dB bins and clamped to LUT_MIN_RSSI..LUT_MAX_RSSI.
+        Undetected beacons add the missing-beacon penalty once per reading, as an
+        exact count, so batched and single readings score identically.
+        Takes the same arguments and returns the same shapes as log_likelihood().
+        """
+        rssi_values = np.asarray(rssi_values, dtype=float)
+        observed = rssi_values != MISSING_RSSI
+
+        heard = observed if observed.ndim == 1 else observed.any(axis=0)
+        cols = np.flatnonzero(heard)
+        unheard_penalty = LOG_MISSING_BEACON_PROB * (len(self.beacon_ids) - observed.sum(axis=-1))
+
+        bins = np.round((rssi_values[..., cols] - LUT_MIN_RSSI) * LUT_STEPS_PER_DB)
+        bins = np.clip(bins, 0, LUT_BINS - 1).astype(np.intp)
+
+        # Gather one table row per heard beacon: (..., heard, cells)
+        table = self.lut()
+        if rows is None:
+            gathered = table[cols, bins]
+        else:
+            gathered = table[cols[:, np.newaxis], bins[..., np.newaxis], rows]
+
+        # In a batch, drop the rows of beacons this particular reading missed
+        if observed.ndim > 1:
+            gathered = np.where(observed[:, cols, np.newaxis], gathered, np.float32(0.0))
+        return gathered.sum(axis=-2, dtype=float) + unheard_penalty[..., np.newaxis]
+
+
 class FingerprintMatcher:
-    def __init__(self, radio_map_path, confidence_threshold=0.7):
+    def __init__(self, radio_map_path, confidence_threshold=0.7, top_k=3,
+                 maze_data=None, search_radius=3, stale_after=30.0, widen_confidence=0.5,
+                 match_mode='naive_bayes', knn_k=4, knn_power=2.0, cache_size=0,
+                 track_stay_probability=0.6, track_recovery=0.01,
+                 block_size=4, refine_blocks=2, incremental=False, incremental_refresh=50,
+                 verbose=VERBOSE_MINIMAL):
         """
         Production fingerprint matcher for single miner localization.
 
         Parameters:
-        - radio_map_path: Path to JSON radio map file
+        - radio_map_path: Path to JSON radio map file, or a compiled .rmap
+          artifact from compile_radio_map.py (memory-mapped; 'naive_bayes'
+          scores the int16 tables in place, the other modes build dense
+          float32 tables for their search structures)
         - confidence_threshold: Minimum confidence to accept location (0.0-1.0)
+        - top_k: Number of candidate cells reported in metrics['top_candidates']
+        - maze_data: Optional dict from create_digitized_maze_data_cartesian; enables
+          pruned search around the miner's previous fix (see locate_miner)
+        - search_radius: Max BFS moves through passages between two fixes
+        - stale_after: Seconds after which a previous fix is too old to prune around
+        - widen_confidence: Below this confidence the search widens to the full map
+        - match_mode: 'naive_bayes' (Gaussian likelihood over every cell), 'knn'
+          (KD-tree k-nearest fingerprints with inverse-distance weighting,
+          sub-linear in map size; pruning does not apply) or 'lut' (Naive Bayes
+          read from per-cell, per-beacon tables over 0.1 dB RSSI bins; a fix is
+          a gather plus a sum, at beacons x 701 x cells x 4 bytes of memory) or
+          'hierarchical' (score block_size x block_size super-cells, then refine
+          only the best blocks; honours a per-call deadline)
+        - knn_k: Neighbours per query in 'knn' mode (at least top_k are used)
+        - knn_power: Inverse-distance weighting exponent in 'knn' mode
+        - cache_size: Max results kept in an LRU keyed on the 0.1 dB-quantized
+          reading and map version (0 disables). Stationary miners repeat the
+          same vector cycle after cycle, so most of their fixes become hits.
+        - track_stay_probability: Chance a miner stays in its maze cell between
+          two track_miner cycles (rest is split across passable neighbours)
+        - track_recovery: Share of the predicted posterior spread uniformly over
+          the map each cycle, so a lost track can recover
+        - block_size: Super-cell edge in grid units for 'hierarchical' mode
+        - refine_blocks: Best-scoring super-cells refined at cell level per fix
+        - incremental: Keep each miner's full-map log-likelihood vector between
+          calls and rescore only beacons whose 0.1 dB-quantized RSSI changed
+          ('naive_bayes' and 'lut' full scans, when miner_id is given)
+        - incremental_refresh: Incremental updates before a full recompute, which
+          bounds floating-point drift
+        - verbose: VERBOSE_MINIMAL builds metrics['top_candidates'] only when
+          read; VERBOSE_DIAGNOSTICS builds it with every result
         """
-        self.radio_map = self._load_radio_map(radio_map_path)
+        if match_mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match_mode '{match_mode}', expected one of {MATCH_MODES}")
+
         self.confidence_threshold = confidence_threshold
-        self.beacon_ids = ['B1', 'B2', 'B3']
+        self.top_k = top_k
+        self.verbose = verbose
+        self.match_mode = match_mode
+        self.mode_fallback = None
+        self.knn_k = knn_k
+        self.knn_power = knn_power
+        self.block_size = block_size
+        self.refine_blocks = refine_blocks
+
+        # Bounded LRU of localization results
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        # Reachability pruning (only active when a maze is supplied)
+        self.maze_data = maze_data
+        self.search_radius = search_radius
+        self.stale_after = stale_after
+        self.widen_confidence = widen_confidence
+        self._reachable_cache = OrderedDict()
+        self._reachable_lock = threading.Lock()
+
+        # Per-miner log-likelihood vectors for incremental rescoring
+        self.incremental = incremental
+        self.incremental_refresh = incremental_refresh
+        self._incremental_state = {}
+        self._incremental_lock = threading.Lock()
+
+        # Grid Bayes filter state (track_miner), per miner
+        self.track_stay_probability = track_stay_probability
+        self.track_recovery = track_recovery
+        self._tracks = {}
+        self._track_lock = threading.Lock()
+        self._tracking_model = None
+
+        # Hot reload: readers grab self.engine once, reloads swap it whole
+        self.radio_map_path = radio_map_path
+        self._reload_lock = threading.Lock()
+        self._watch_thread = None
+        self._watch_stop = threading.Event()
+        self.last_reload = None
+
+        self._artifact = None
+        self._engine = None
+
+        if is_artifact_path(radio_map_path):
+            self._artifact = RadioMapArtifact(radio_map_path)
+            self.radio_map = self._artifact.radio_map_stub()
+            self.beacon_ids = list(self._artifact.beacon_ids)
+
+            # Modes with precomputed tables build them now, so failures show at startup
+            if self.match_mode != 'naive_bayes':
+                self._engine = self._prepare_engine(RadioMapEngine.from_artifact(self._artifact))
+        else:
+            self.radio_map = self._load_radio_map(radio_map_path)
+            self.beacon_ids = radio_map_beacon_ids(self.radio_map)
+
+            # Dense arrays built once here; locate_miner only does array math
+            self._engine = self._prepare_engine(
+                RadioMapEngine.from_radio_map(self.radio_map, self.beacon_ids)
+            )
+
+    @property
+    def engine(self):
+        """Precomputed scoring arrays (built lazily for compiled artifacts)."""
+        if self._engine is None:
+            self._engine = self._prepare_engine(RadioMapEngine.from_artifact(self._artifact))
+        return self._engine
+
+    def _prepare_engine(self, engine):
+        """
+        Build the mode-specific search structures up front, not on the first locate.
+        A map too large for 'lut' tables switches the matcher to 'naive_bayes'
+        (same likelihoods, computed per fix) and records why in mode_fallback.
+        """
+        if self.match_mode == 'knn':
+            engine.kd_tree()
+        elif self.match_mode == 'lut':
+            try:
+                engine.lut()
+            except ValueError as e:
+                self.mode_fallback = str(e)
+                self.match_mode = 'naive_bayes'
+        elif self.match_mode == 'hierarchical':
+            engine.super_cells(self.block_size)
+        return engine
+
+    def _log_likelihood(self, engine, rssi_values, rows=None):
+        """Per-cell log-likelihood from the configured likelihood mode."""
+        if self.match_mode == 'lut':
+            return engine.lut_log_likelihood(rssi_values, rows=rows)
+        return engine.log_likelihood(rssi_values, rows=rows)
+
+    def _pair_log_likelihood(self, engine, rssi_values, rows):
+        """Per-(reading, cell) log-likelihood from the configured likelihood mode."""
+        if self.match_mode == 'lut':
+            return engine.lut_pair_log_likelihood(rssi_values, rows)
+        return engine.pair_log_likelihood(rssi_values, rows)
+
+    def reload_radio_map(self, radio_map_path=None):
+        """
+        Reload the radio map and atomically swap it in.
+
+        For JSON maps only cells whose entries changed are re-parsed; every
+        other row is copied from the current engine. The new engine, including
+        mode-specific structures, is fully built before the swap, so a
+        concurrent locate_miner uses either the old map or the new one, never
+        a mix. Cached results are dropped.
+
+        Parameters:
+        - radio_map_path: Map to load (default: the current path). May switch
+          between JSON and a compiled .rmap artifact.
+
+        Returns:
+        Dict with path, changed_cells, total_cells, duration and timestamp.
+        Raises the loader's exception (and keeps the old map) on failure.
+        """
+        path = radio_map_path or self.radio_map_path
+
+        with self._reload_lock:
+            started = time.time()
+            previous_engine = self._engine
+            previous_cells = self.radio_map.get('cells')
+
+            if is_artifact_path(path):
+                artifact = RadioMapArtifact(path)
+                radio_map = artifact.radio_map_stub()
+                engine = RadioMapEngine.from_artifact(artifact)
+            else:
+                artifact = None
+                radio_map = self._load_radio_map(path)
+                beacon_ids = radio_map_beacon_ids(radio_map)
+                if previous_engine is not None and previous_cells:
+                    engine = previous_engine.rebuilt(radio_map, beacon_ids, previous_cells)
+                else:
+                    engine = RadioMapEngine.from_radio_map(radio_map, beacon_ids)
+
+            engine = self._prepare_engine(engine)
+
+            # Swap: the engine reference goes last, it is all locate_miner reads
+            self._artifact = artifact
+            self.radio_map = radio_map
+            self.radio_map_path = path
+            self.beacon_ids = list(engine.beacon_ids)
+            self._engine = engine
+            self.clear_cache()
+
+            changed = engine.n_cells if engine.changed_rows is None else len(engine.changed_rows)
+            self.last_reload = {
+                'path': path,
+                'changed_cells': changed,
+                'total_cells': engine.n_cells,
+                'duration': round(time.time() - started, 4),
+                'timestamp': started
+            }
+            return self.last_reload
+
+    def start_watching(self, interval=2.0, radio_map_path=None, on_reload=None):
+        """
+        Poll the radio map file and hot-reload it when it changes.
+
+        A change is applied once the file's mtime and size have been stable for
+        one interval, so half-written files from dictionary.py or
+        convert_radio_map.py are not picked up. Failed loads keep the old map.
+
+        Parameters:
+        - interval: Seconds between polls
+        - radio_map_path: File to watch and load from (default: current path)
+        - on_reload: Optional callback(info) with reload_radio_map's dict, or
+          {'path', 'error', 'timestamp'} if the load failed
+        """
+        if self._watch_thread is not None:
+            return
+
+        path = radio_map_path or self.radio_map_path
+        self._watch_stop.clear()
+        self._watch_thread = threading.Thread(
+            target=self._watch_loop, args=(path, interval, on_reload), daemon=True
+        )
+        self._watch_thread.start()
+
+    def stop_watching(self):
+        """Stop the file watcher thread, if running."""
+        if self._watch_thread is None:
+            return
+        self._watch_stop.set()
+        self._watch_thread.join()
+        self._watch_thread = None
+
+    def _watch_loop(self, path, interval, on_reload):
+        last_seen = _file_signature(path)
+        pending = None
+
+        while not self._watch_stop.wait(interval):
+            signature = _file_signature(path)
+            if signature is None or signature == last_seen:
+                pending = None
+                continue
+
+            # Wait one more interval for the writer to finish
+            if signature != pending:
+                pending = signature
+                continue
+
+            last_seen, pending = signature, None
+            try:
+                info = self.reload_radio_map(path)
+            except (OSError, ValueError) as e:
+                info = {'path': path, 'error': str(e), 'timestamp': time.time()}
+
+            if on_reload:
+                on_reload(info)
 
     def _load_radio_map(self, path):
         """Load and validate radio map from JSON."""
@@ -28,6 +962,9 @@ class FingerprintMatcher:
             if key not in radio_map:
                 raise ValueError(f"Radio map missing required key: {key}")
 
+        if not radio_map_beacon_ids(radio_map):
+            raise ValueError("Radio map defines no beacons")
+
         return radio_map
 
     def _gaussian_pdf(self, x, mean, std):
@@ -74,79 +1011,553 @@ class FingerprintMatcher:
 
         return probability
 
-    def locate_miner(self, processed_rssi, miner_id=None):
+    def locate_miner(self, processed_rssi, miner_id=None, previous_state=None, now=None,
+                     deadline=None):
         """
         Main localization function for single miner.
 
         Parameters:
         - processed_rssi: Dict from RSSIPreprocessor {'B1': -65.0, 'B2': -71.5, 'B3': -68.2}
         - miner_id: Optional miner ID for logging
+        - previous_state: Optional MinerStateManager state for this miner. With
+          maze_data set, only cells reachable from its current_location are
+          scored, unless the fix is stale or low confidence.
+        - now: Current time for the staleness check (default: time.time())
+        - deadline: Optional time.time() value; 'hierarchical' mode stops
+          refining blocks once it passes and returns the best answer so far
 
         Returns:
         Dict with location estimate and confidence metrics.
         """
+        # One engine for the whole call, even if a reload swaps it meanwhile
+        engine = self.engine
+
         # Validate input
+        valid_beacons, error = self._validate_rssi_input(processed_rssi, engine)
+        if error:
+            return error
+
+        rssi_values = engine.rssi_array(processed_rssi)
+        start = self._pruning_start(previous_state, now)
+
+        # Identical quantized readings around the same fix give identical results
+        cache_key = self._cache_key(engine, rssi_values, start)
+        cached = self._cache_get(cache_key, miner_id)
+        if cached is not None:
+            return cached
+
+        result = self._locate_single(engine, rssi_values, valid_beacons, miner_id, start, deadline)
+        if not result['metrics'].get('deadline_hit'):
+            self._cache_put(cache_key, result)
+        return result
+
+    def _locate_single(self, engine, rssi_values, valid_beacons, miner_id, start=None, deadline=None):
+        """Score one reading with the configured mode (pruned around start if given)."""
+        if self.match_mode == 'knn':
+            return self._locate_knn(engine, rssi_values[np.newaxis], [valid_beacons], [miner_id])[0]
+
+        # Try the neighbourhood of the last fix first
+        rows = self._pruned_rows(engine, start)
+        if rows is not None:
+            log_likelihood = self._log_likelihood(engine, rssi_values, rows=rows)
+            result = self._build_result(engine, log_likelihood, valid_beacons, miner_id, rows=rows)
+            if result['valid'] and result['confidence'] >= self.widen_confidence:
+                result['metrics']['search'] = 'pruned'
+                result['metrics']['cells_scored'] = len(rows)
+                return result
+
+        if self.match_mode == 'hierarchical':
+            return self._locate_hierarchical(engine, rssi_values, valid_beacons, miner_id, deadline)
+
+        # Score every cell at once in log space
+        if self.incremental and miner_id is not None and self.match_mode in ('naive_bayes', 'lut'):
+            log_likelihood, rescored = self._incremental_log_likelihood(engine, rssi_values, miner_id)
+            result = self._build_result(engine, log_likelihood, valid_beacons, miner_id)
+            if result['location'] is not None:
+                result['metrics']['beacons_rescored'] = rescored
+        else:
+            log_likelihood = self._log_likelihood(engine, rssi_values)
+            result = self._build_result(engine, log_likelihood, valid_beacons, miner_id)
+
+        if self.maze_data is not None and result['location'] is not None:
+            result['metrics']['search'] = 'global'
+            result['metrics']['cells_scored'] = engine.n_cells
+        return result
+
+    def _incremental_log_likelihood(self, engine, rssi_values, miner_id):
+        """
+        Full-map log-likelihood for miner_id, updated from the miner's previous
+        vector in only the beacon columns whose quantized RSSI changed.
+
+        The Naive Bayes sum is separable per beacon, so the update is
+        new_terms - old_terms for the changed beacons (both scored in one
+        two-row call); beacons that stayed put cost nothing.
+
+        Returns: (log_likelihood, number of beacons rescored)
+        """
+        quantized = np.round(rssi_values * CACHE_RSSI_STEPS_PER_DB)
+        with self._incremental_lock:
+            state = self._incremental_state.get(miner_id)
+
+        if (state is None or state['version'] != engine.version
+                or state['updates'] >= self.incremental_refresh):
+            log_likelihood = self._log_likelihood(engine, rssi_values)
+            scored_rssi, updates, rescored = rssi_values.copy(), 0, len(rssi_values)
+        else:
+            changed = quantized != state['quantized']
+            rescored = int(changed.sum())
+            log_likelihood = state['log_likelihood']
+            scored_rssi, updates = state['rssi'], state['updates']
+
+            if rescored:
+                # Row 0: new values, row 1: values the vector was scored with
+                pair = np.full((2, len(rssi_values)), MISSING_RSSI)
+                pair[0, changed] = rssi_values[changed]
+                pair[1, changed] = scored_rssi[changed]
+                new_terms, old_terms = self._log_likelihood(engine, pair)
+
+                log_likelihood = log_likelihood + (new_terms - old_terms)
+                scored_rssi = np.where(changed, rssi_values, scored_rssi)
+                updates += 1
+
+        with self._incremental_lock:
+            self._incremental_state[miner_id] = {
+                'version': engine.version,
+                'quantized': np.round(scored_rssi * CACHE_RSSI_STEPS_PER_DB),
+                'rssi': scored_rssi,
+                'log_likelihood': log_likelihood,
+                'updates': updates
+            }
+        return log_likelihood, rescored
+
+    def _locate_hierarchical(self, engine, rssi_values, valid_beacons, miner_id, deadline=None):
+        """
+        Coarse-to-fine search: score super-cells, then refine the best blocks
+        one at a time until refine_blocks are done or the deadline passes. The
+        best block is always refined, so there is always a cell-level answer.
+
+        Blocks left unrefined still count in the normalizer, each as its cells
+        at the block's coarse log-likelihood, so confidence is not inflated by
+        the cells that were never scored.
+        """
+        block_engine, block_rows = engine.super_cells(self.block_size)
+        if block_engine.n_cells == 0:
+            return self._error_result("No matching cells found")
+
+        coarse = block_engine.log_likelihood(rssi_values)
+        order = self._top_k_indices(coarse, min(self.refine_blocks, len(coarse)))
+
+        deadline_hit = False
+        if deadline is None:
+            # No deadline: refine every chosen block in one call
+            blocks_refined = len(order)
+            rows = np.concatenate([block_rows[block] for block in order])
+            log_likelihood = engine.log_likelihood(rssi_values, rows=rows)
+        else:
+            row_parts, score_parts = [], []
+            for block in order:
+                if row_parts and time.time() >= deadline:
+                    deadline_hit = True
+                    break
+                row_parts.append(block_rows[block])
+                score_parts.append(engine.log_likelihood(rssi_values, rows=block_rows[block]))
+            blocks_refined = len(row_parts)
+            rows = np.concatenate(row_parts)
+            log_likelihood = np.concatenate(score_parts)
+
+        unrefined = np.setdiff1d(np.arange(block_engine.n_cells), order[:blocks_refined])
+        block_sizes = np.array([len(block_rows[block]) for block in unrefined], dtype=float)
+        result = self._build_result(
+            engine, log_likelihood, valid_beacons, miner_id, rows=rows,
+            unscored=(coarse[unrefined], block_sizes)
+        )
+        if result['location'] is not None:
+            result['metrics']['search'] = 'hierarchical'
+            result['metrics']['blocks_refined'] = blocks_refined
+            result['metrics']['cells_scored'] = len(rows) + block_engine.n_cells
+            result['metrics']['deadline_hit'] = deadline_hit
+            # Unrefined blocks enter the normalizer only at their coarse score
+            result['metrics']['approximate'] = len(unrefined) > 0
+        return result
+
+    def _cache_key(self, engine, rssi_values, start=None):
+        """LRU key: map version, pruning start and the quantized reading (None if disabled)."""
+        if not self.cache_size:
+            return None
+        quantized = np.round(rssi_values * CACHE_RSSI_STEPS_PER_DB).astype(np.int32)
+        return (engine.version, start, quantized.tobytes())
+
+    def _cache_get(self, key, miner_id):
+        if key is None:
+            return None
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is None:
+                self.cache_stats['misses'] += 1
+                return None
+            self._cache.move_to_end(key)
+            self.cache_stats['hits'] += 1
+        return _copy_result(result, miner_id)
+
+    def _cache_put(self, key, result):
+        if key is None or result['location'] is None:
+            return
+        with self._cache_lock:
+            self._cache[key] = _copy_result(result, None)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.cache_stats['evictions'] += 1
+
+    def clear_cache(self):
+        """Drop every cached result (counters are kept)."""
+        with self._cache_lock:
+            self._cache.clear()
+
+    def get_cache_stats(self):
+        """Hit/miss/eviction counters plus current size and hit rate."""
+        with self._cache_lock:
+            stats = dict(self.cache_stats)
+            stats['size'] = len(self._cache)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def _locate_knn(self, engine, rssi_matrix, valid_beacons_list, miner_ids):
+        """
+        Weighted kNN over the KD-tree for one or more readings.
+
+        Neighbour weights are 1 / distance^knn_power, normalized to sum to 1, and
+        reported exactly like Naive Bayes probabilities. Uncertainty is the
+        weight entropy relative to its maximum for k neighbours.
+        """
+        if engine.n_cells == 0:
+            return [self._error_result("No matching cells found") for _ in miner_ids]
+
+        k = min(max(self.knn_k, self.top_k, 2), engine.n_cells)
+        distances, indices = engine.kd_tree().query(rssi_matrix, k=k)
+        distances = distances.reshape(len(rssi_matrix), k)
+        indices = indices.reshape(len(rssi_matrix), k)
+
+        weights = 1.0 / np.maximum(distances, KNN_MIN_DISTANCE) ** self.knn_power
+        probs = weights / weights.sum(axis=1, keepdims=True)
+
+        max_entropy = math.log2(k)
+        results = []
+        for row_indices, row_probs, valid_beacons, miner_id in zip(indices, probs, valid_beacons_list, miner_ids):
+            nonzero = row_probs[row_probs > 0]
+            entropy = float(-(nonzero * np.log2(nonzero)).sum())
+            uncertainty = entropy / max_entropy if max_entropy > 0 else 0.0
+            results.append(
+                self._format_result(engine, row_indices, row_probs, uncertainty, valid_beacons, miner_id)
+            )
+        return results
+
+    def _pruning_start(self, previous_state, now=None):
+        """Maze cell of the previous fix to prune around, or None for a global search."""
+        if self.maze_data is None or self.match_mode == 'knn' or not previous_state:
+            return None
+
+        location = previous_state.get('current_location')
+        if location is None:
+            return None
+
+        # Widen when the last fix was weak or too old to bound movement
+        if previous_state.get('last_confidence', 0.0) < self.widen_confidence:
+            return None
+
+        last_update = _to_epoch_seconds(previous_state.get('last_update_timestamp'))
+        current_time = _to_epoch_seconds(now) if now is not None else time.time()
+        if last_update is None or current_time - last_update > self.stale_after:
+            return None
+
+        return (int(round(location[0])), int(round(location[1])))
+
+    def _pruned_rows(self, engine, start):
+        """Engine rows reachable from start, or None for a global search."""
+        if start is None:
+            return None
+
+        with self._reachable_lock:
+            reachable = self._reachable_cache.get(start)
+            if reachable is not None:
+                self._reachable_cache.move_to_end(start)
+        if reachable is None:
+            reachable = reachable_cells(self.maze_data, start, self.search_radius)
+            with self._reachable_lock:
+                self._reachable_cache[start] = reachable
+                while len(self._reachable_cache) > REACHABLE_CACHE_SIZE:
+                    self._reachable_cache.popitem(last=False)
+
+        cell_rows = engine.maze_cell_rows()
+        rows = [cell_rows[cell] for cell in reachable if cell in cell_rows]
+        if not rows:
+            return None
+
+        return np.concatenate(rows)
+
+    def track_miner(self, processed_rssi, miner_id, now=None):
+        """
+        Grid Bayes filter (HMM forward step) for one miner.
+
+        Keeps a posterior over radio map cells in passable maze cells. Each call
+        propagates it one step through the sparse maze transition matrix, then
+        multiplies in the fingerprint likelihood, so evidence accumulates across
+        cycles instead of being thrown away. Cost is O(cells) per call.
+
+        The posterior restarts uniform for a new miner, after stale_after
+        seconds without an update, and after a radio map reload that changed
+        the set of cells (a reload of beacon stats only keeps it). Requires
+        maze_data and a likelihood mode ('naive_bayes' or 'lut').
+
+        Parameters:
+        - processed_rssi: Dict from RSSIPreprocessor
+        - miner_id: Miner whose posterior is updated
+        - now: Current time for the staleness check (default: time.time())
+
+        Returns:
+        Result dict like locate_miner, with metrics['search'] = 'tracked'.
+        """
+        if self.maze_data is None:
+            raise ValueError("track_miner requires maze_data")
+        if self.match_mode not in LIKELIHOOD_MODES:
+            raise ValueError(f"track_miner requires match_mode in {LIKELIHOOD_MODES}")
+
+        engine = self.engine
+        valid_beacons, error = self._validate_rssi_input(processed_rssi, engine)
+        if error:
+            return error
+
+        track_rows, transition_T = self._tracking_matrices(engine)
+        if len(track_rows) == 0:
+            return self._error_result("No radio map cells in passable maze cells")
+
+        current_time = _to_epoch_seconds(now) if now is not None else time.time()
+        with self._track_lock:
+            track = self._tracks.get(miner_id)
+
+        n = len(track_rows)
+        if (track is None or current_time - track['timestamp'] > self.stale_after
+                or (track['version'] != engine.version and not engine.has_cells(track['cell_xy']))):
+            prior = np.full(n, 1.0 / n)
+        else:
+            # Predict: one motion step, plus a little uniform mass for recovery
+            prior = transition_T @ track['posterior']
+            prior = (1.0 - self.track_recovery) * prior + self.track_recovery / n
+
+        # Update: log prior + log likelihood, normalized with log-sum-exp
+        log_likelihood = self._log_likelihood(engine, engine.rssi_array(processed_rssi), rows=track_rows)
+        log_posterior = np.log(np.maximum(prior, np.finfo(float).tiny)) + log_likelihood
+
+        result = self._build_result(engine, log_posterior, valid_beacons, miner_id, rows=track_rows)
+        if result['location'] is None:
+            return result
+
+        posterior = np.exp(log_posterior - log_posterior.max())
+        posterior /= posterior.sum()
+        with self._track_lock:
+            self._tracks[miner_id] = {
+                'posterior': posterior,
+                'timestamp': current_time,
+                'version': engine.version,
+                'cell_xy': engine.cell_xy
+            }
+
+        result['metrics']['search'] = 'tracked'
+        result['metrics']['cells_scored'] = n
+        return result
+
+    def reset_track(self, miner_id=None):
+        """Forget the tracking posterior of one miner (or of all miners if None)."""
+        with self._track_lock:
+            if miner_id is None:
+                self._tracks.clear()
+            else:
+                self._tracks.pop(miner_id, None)
+
+    def forget_miner(self, miner_id):
+        """Drop all per-miner state (tracking posterior, incremental scores), e.g. on eviction."""
+        self.reset_track(miner_id)
+        with self._incremental_lock:
+            self._incremental_state.pop(miner_id, None)
+
+    def _tracking_matrices(self, engine):
+        """Transition matrix for the current engine, rebuilt after a reload."""
+        model = self._tracking_model
+        if model is None or model[0] != engine.version:
+            track_rows, transition_T = grid_transition_matrix(
+                self.maze_data, engine.maze_cell_rows(), engine.n_cells, self.track_stay_probability
+            )
+            model = (engine.version, track_rows, transition_T)
+            self._tracking_model = model
+        return model[1], model[2]
+
+    def locate_miners_batch(self, rssi_list, miner_ids=None, deadline=None):
+        """
+        Localize several miners with one (miners x cells) computation.
+
+        Parameters:
+        - rssi_list: List of processed RSSI dicts, one per miner
+        - miner_ids: Optional list of miner IDs, same order as rssi_list
+        - deadline: Optional time.time() value shared by the whole batch
+          ('hierarchical' mode; later miners get fewer refined blocks)
+
+        Returns:
+        List of result dicts, identical to calling locate_miner on each entry.
+        """
+        if miner_ids is None:
+            miner_ids = [None] * len(rssi_list)
+
+        engine = self.engine
+        results = [None] * len(rssi_list)
+        pending = []
+
+        # Validate every reading first; only valid ones enter the matrix
+        for i, processed_rssi in enumerate(rssi_list):
+            valid_beacons, error = self._validate_rssi_input(processed_rssi, engine)
+            if error:
+                results[i] = error
+            else:
+                pending.append((i, valid_beacons))
+
+        if not pending:
+            return results
+
+        # Serve repeated readings from the cache, score only the rest
+        uncached = []
+        for i, valid_beacons in pending:
+            rssi_values = engine.rssi_array(rssi_list[i])
+            cache_key = self._cache_key(engine, rssi_values)
+            cached = self._cache_get(cache_key, miner_ids[i])
+            if cached is not None:
+                results[i] = cached
+            else:
+                uncached.append((i, valid_beacons, rssi_values, cache_key))
+
+        if not uncached:
+            return results
+
+        pending = [(i, valid_beacons) for i, valid_beacons, _, _ in uncached]
+        rssi_matrix = np.array([rssi_values for _, _, rssi_values, _ in uncached])
+
+        if self.match_mode == 'knn':
+            knn_results = self._locate_knn(
+                engine, rssi_matrix,
+                [valid_beacons for _, valid_beacons in pending],
+                [miner_ids[i] for i, _ in pending]
+            )
+            for (i, _, _, cache_key), result in zip(uncached, knn_results):
+                results[i] = result
+                self._cache_put(cache_key, result)
+            return results
+
+        if self.match_mode == 'hierarchical':
+            for i, valid_beacons, rssi_values, cache_key in uncached:
+                results[i] = self._locate_hierarchical(
+                    engine, rssi_values, valid_beacons, miner_ids[i], deadline
+                )
+                if not results[i]['metrics'].get('deadline_hit'):
+                    self._cache_put(cache_key, results[i])
+            return results
+
+        # Bound the (miners x cells x beacons) intermediate for large maps
+        cells_x_beacons = max(1, engine.n_cells * len(engine.beacon_ids))
+        chunk_size = max(1, BATCH_CHUNK_ELEMENTS // cells_x_beacons)
+
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            log_likelihoods = self._log_likelihood(engine, rssi_matrix[start:start + chunk_size])
+
+            for (i, valid_beacons), log_likelihood in zip(chunk, log_likelihoods):
+                results[i] = self._build_result(engine, log_likelihood, valid_beacons, miner_ids[i])
+
+        for i, _, _, cache_key in uncached:
+            self._cache_put(cache_key, results[i])
+
+        return results
+
+    def _validate_rssi_input(self, processed_rssi, engine):
+        """
+        Check an RSSI dict before scoring.
+        Returns: (valid_beacons, error_result or None)
+        """
         if not processed_rssi or not isinstance(processed_rssi, dict):
-            return self._error_result("Invalid RSSI input")
+            return [], self._error_result("Invalid RSSI input")
 
-        # Check if we have any valid beacon readings
-        valid_beacons = [b for b in self.beacon_ids if processed_rssi.get(b, -100.0) > -100.0]
+        # Check if we have any valid beacon readings (only the audible ones are visited)
+        beacon_index = engine.beacon_index
+        valid_beacons = [b for b, v in processed_rssi.items() if b in beacon_index and v > -100.0]
         if len(valid_beacons) < 2:
-            return self._error_result(f"Insufficient beacons: {len(valid_beacons)}")
-
-        # Initialize tracking
-        cell_probabilities = []
-        cell_data_list = []
-
-        # Calculate probability for each cell
-        for cell_id, cell_data in self.radio_map['cells'].items():
-            probability = self._calculate_cell_probability(processed_rssi, cell_data)
-
-            cell_probabilities.append(probability)
-            cell_data_list.append({
-                'cell_id': cell_id,
-                'x': cell_data['x'],
-                'y': cell_data['y'],
-                'probability': probability
-            })
+            return valid_beacons, self._error_result(f"Insufficient beacons: {len(valid_beacons)}")
 
-        # Handle case where all probabilities are zero
-        total_probability = sum(cell_probabilities)
-        if total_probability <= 0:
+        return valid_beacons, None
+
+    def _build_result(self, engine, log_likelihood, valid_beacons, miner_id, rows=None, unscored=None):
+        """
+        Turn a per-cell log-likelihood vector into the standard result dict.
+        If rows is given, log_likelihood covers only those engine rows.
+        unscored is an optional (log_likelihood, counts) pair for groups of
+        cells scored only approximately: they add counts cells each to the
+        normalizer and entropy, but are never candidates.
+        """
+        # Handle case where no cell has a finite likelihood
+        if engine.n_cells == 0 or not np.isfinite(log_likelihood).any():
             return self._error_result("No matching cells found")
 
-        # Normalize probabilities
-        for cell_info in cell_data_list:
-            cell_info['normalized_prob'] = cell_info['probability'] / total_probability
+        n_cells = len(log_likelihood)
+
+        # Normalize in log space (log-sum-exp keeps large maps from underflowing)
+        peak = log_likelihood.max()
+        if unscored is not None and len(unscored[0]):
+            peak = max(peak, unscored[0].max())
+        shifted = log_likelihood - peak
+        weights = np.exp(shifted)
+        total = float(weights.sum())
+        weighted_log = float(np.dot(weights, shifted))
+
+        if unscored is not None and len(unscored[0]):
+            unscored_shifted = unscored[0] - peak
+            unscored_weights = unscored[1] * np.exp(unscored_shifted)
+            total += float(unscored_weights.sum())
+            weighted_log += float(np.dot(unscored_weights, unscored_shifted))
+            n_cells += int(unscored[1].sum())
+        log_total = math.log(total)
+
+        # Partial selection: only the top-k cells are ever ordered
+        ranked = self._top_k_indices(shifted, max(self.top_k, 2))
+        top_probs = weights[ranked] / total
+        if rows is not None:
+            ranked = rows[ranked]
 
-        # Sort by probability (descending)
-        cell_data_list.sort(key=lambda x: x['normalized_prob'], reverse=True)
+        # Calculate uncertainty (entropy-based): H = log(Z) - E[log w], in bits
+        entropy = (log_total - weighted_log / total) / math.log(2)
+        entropy = max(entropy, 0.0)
 
+        # Maximum entropy for N cells
+        max_entropy = math.log2(n_cells)
+        uncertainty = entropy / max_entropy if max_entropy > 0 else 0.0
+
+        return self._format_result(engine, ranked, top_probs, uncertainty, valid_beacons, miner_id)
+
+    def _format_result(self, engine, ranked, top_probs, uncertainty, valid_beacons, miner_id):
+        """
+        Standard result dict from ranked engine rows (best first) and their
+        normalized probabilities. Shared by every matching mode.
+        """
         # Get best match
-        best_cell = cell_data_list[0]
-        best_prob = best_cell['normalized_prob']
+        best_index = ranked[0]
+        best_prob = float(top_probs[0])
 
         # Calculate confidence metrics
         confidence_score = best_prob
 
         # Calculate discrimination ratio (best vs second best)
-        if len(cell_data_list) > 1:
-            second_best_prob = cell_data_list[1]['normalized_prob']
+        if len(ranked) > 1:
+            second_best_prob = float(top_probs[1])
             discrimination_ratio = best_prob / second_best_prob if second_best_prob > 0 else float('inf')
         else:
             discrimination_ratio = float('inf')
 
-        # Calculate uncertainty (entropy-based)
-        entropy = 0.0
-        for cell_info in cell_data_list:
-            p = cell_info['normalized_prob']
-            if p > 0:
-                entropy -= p * math.log2(p)
-
-        # Maximum entropy for N cells
-        max_entropy = math.log2(len(cell_data_list))
-        uncertainty = entropy / max_entropy if max_entropy > 0 else 0.0
-
         # Determine quality status
         if confidence_score >= self.confidence_threshold and discrimination_ratio >= 2.0:
             status = "HIGH_CONFIDENCE"
@@ -157,36 +1568,65 @@ class FingerprintMatcher:
         else:
             status = "UNCERTAIN"
 
-        # Return result
-        result = {
+        # Return result; top-k candidates (debugging) are built on access
+        return {
             'miner_id': miner_id,
-            'location': {
-                'x': best_cell['x'],
-                'y': best_cell['y'],
-                'cell_id': best_cell['cell_id']
-            },
+            'location': self._cell_location(engine, best_index),
             'confidence': round(confidence_score, 3),
-            'metrics': {
-                'discrimination_ratio': round(discrimination_ratio, 2),
-                'uncertainty': round(uncertainty, 3),
-                'valid_beacons': len(valid_beacons),
-                'top_candidates': []
-            },
+            'metrics': LazyResult(
+                {
+                    'discrimination_ratio': round(discrimination_ratio, 2),
+                    'uncertainty': round(uncertainty, 3),
+                    'valid_beacons': len(valid_beacons)
+                },
+                lazy={'top_candidates': (
+                    VERBOSE_DIAGNOSTICS,
+                    lambda: self._top_candidates(engine, ranked[:self.top_k], top_probs)
+                )},
+                verbose=self.verbose
+            ),
             'status': status,
             'valid': confidence_score >= 0.3  # Minimum threshold
         }
 
-        # Add top 3 candidates for debugging
-        for i in range(min(3, len(cell_data_list))):
-            cell = cell_data_list[i]
-            result['metrics']['top_candidates'].append({
-                'cell_id': cell['cell_id'],
-                'x': cell['x'],
-                'y': cell['y'],
-                'confidence': round(cell['normalized_prob'], 3)
+    def _top_candidates(self, engine, ranked, top_probs):
+        """metrics['top_candidates'] entries for ranked engine rows."""
+        top_candidates = []
+        for cell_index, prob in zip(ranked, top_probs):
+            location = self._cell_location(engine, cell_index)
+            top_candidates.append({
+                'cell_id': location['cell_id'],
+                'x': location['x'],
+                'y': location['y'],
+                'confidence': round(float(prob), 3)
             })
+        return top_candidates
 
-        return result
+    def _top_k_indices(self, scores, k):
+        """
+        Indices of the k highest scores, best first, without a full sort.
+        Ties keep map order, matching a stable descending sort.
+        """
+        k = min(k, len(scores))
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+            # argpartition may split a tie at the k-th place arbitrarily
+            kth_score = scores[candidates].min()
+            candidates = np.flatnonzero(scores >= kth_score)
+        else:
+            candidates = np.arange(len(scores))
+
+        order = np.lexsort((candidates, -scores[candidates]))
+        return candidates[order][:k]
+
+    def _cell_location(self, engine, cell_index):
+        """Location dict for an engine row."""
+        x, y = engine.cell_xy[cell_index]
+        return {
+            'x': x.item(),
+            'y': y.item(),
+            'cell_id': engine.cell_ids[cell_index]
+        }
 
     def _error_result(self, error_message):
         """Return standardized error result."""
@@ -205,6 +1645,9 @@ class FingerprintMatcher:
 
     def get_cell_coverage(self, cell_id):
         """Get beacon coverage statistics for a specific cell."""
+        if 'cells' not in self.radio_map:
+            return self._artifact_cell_coverage(cell_id)
+
         if cell_id not in self.radio_map['cells']:
             return None
 
@@ -231,6 +1674,35 @@ class FingerprintMatcher:
 
         return coverage
 
+    def _artifact_cell_coverage(self, cell_id):
+        """get_cell_coverage for compiled artifacts (no per-cell dicts, no sample counts)."""
+        engine = self.engine
+        if cell_id not in engine.cell_index:
+            return None
+
+        row = engine.cell_index[cell_id]
+        location = self._cell_location(engine, row)
+        coverage = {
+            'cell_id': cell_id,
+            'x': location['x'],
+            'y': location['y'],
+            'beacons': {}
+        }
+
+        valid, mean, std = engine.cell_stats(row)
+        for beacon_id in self.beacon_ids:
+            col = engine.beacon_index[beacon_id]
+            if valid[col]:
+                coverage['beacons'][beacon_id] = {
+                    'mean': round(float(mean[col]), 2),
+                    'std': round(float(std[col]), 2),
+                    'samples': None
+                }
+            else:
+                coverage['beacons'][beacon_id] = None
+
+        return coverage
+
     def validate_rssi_range(self, rssi_vector):
         """Check if RSSI values are within reasonable range."""
         warnings = []
@@ -0,0 +1,145 @@
+"""
+Result dicts whose diagnostic fields are built only when read.
+
+RSSIPreprocessor and FingerprintMatcher return LazyResult instances: the
+fields the gateway reads on every message (processed_rssi,
+overall_confidence, location, confidence, ...) are stored eagerly, while
+diagnostics (beacon_diagnostics, metrics['top_candidates']) are stored as
+factories and built on first access. A LazyResult is a dict, so indexing,
+get, in, iteration, comparison, copy and json.dumps all behave as if every
+field had been computed up front.
+
+Verbose levels decide which tiers are built eagerly anyway:
+    VERBOSE_MINIMAL      hot-path fields only, diagnostics on access (default)
+    VERBOSE_DIAGNOSTICS  per-beacon / per-candidate diagnostics built at once
+"""
+
+VERBOSE_MINIMAL = 0
+VERBOSE_DIAGNOSTICS = 1
+
+
+class LazyResult(dict):
+    __slots__ = ('_pending',)
+
+    def __init__(self, fields=(), lazy=None, verbose=VERBOSE_MINIMAL):
+        """
+        Dict with some fields computed on first access.
+
+        Parameters:
+        - fields: Eager fields (mapping or key/value pairs)
+        - lazy: Dict {key: (level, factory)}; factory() builds the value.
+          Levels up to verbose are built immediately.
+        - verbose: Verbose level of the caller
+        """
+        dict.__init__(self, fields)
+        self._pending = {}
+        for key, (level, factory) in (lazy or {}).items():
+            self.defer(key, factory, level, verbose)
+
+    def defer(self, key, factory, level=VERBOSE_DIAGNOSTICS, verbose=VERBOSE_MINIMAL):
+        """Set key to factory() on first access, or now if level <= verbose."""
+        if level <= verbose:
+            self[key] = factory()
+        else:
+            dict.pop(self, key, None)
+            self._pending[key] = factory
+
+    def is_lazy(self, key):
+        """True while key is a factory that has not been built yet."""
+        return key in self._pending
+
+    def _materialize(self):
+        for key in list(self._pending):
+            self[key]
+
+    def __missing__(self, key):
+        # dict.__getitem__ lands here for keys not stored yet
+        factory = self._pending.pop(key, None)
+        if factory is None:
+            raise KeyError(key)
+        value = factory()
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if self._pending.pop(key, None) is None:
+            dict.__delitem__(self, key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._pending
+
+    def get(self, key, default=None):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if key in self._pending:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        dict.__setitem__(self, key, default)
+        return default
+
+    def pop(self, key, *default):
+        if key in self._pending:
+            self[key]
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        self._materialize()
+        return dict.popitem(self)
+
+    def update(self, *args, **kwargs):
+        for key in dict(*args, **kwargs):
+            self._pending.pop(key, None)
+        dict.update(self, *args, **kwargs)
+
+    def __len__(self):
+        return dict.__len__(self) + len(self._pending)
+
+    def __iter__(self):
+        self._materialize()
+        return dict.__iter__(self)
+
+    def keys(self):
+        self._materialize()
+        return dict.keys(self)
+
+    def values(self):
+        self._materialize()
+        return dict.values(self)
+
+    def items(self):
+        self._materialize()
+        return dict.items(self)
+
+    def __eq__(self, other):
+        self._materialize()
+        if isinstance(other, LazyResult):
+            other._materialize()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._materialize()
+        return dict.__repr__(self)
+
+    def copy(self):
+        """Shallow copy; fields still pending stay lazy in the copy."""
+        copied = LazyResult(dict.items(self))
+        copied._pending.update(self._pending)
+        return copied
+
+    def __reduce__(self):
+        self._materialize()
+        return (LazyResult, (dict(dict.items(self)),))
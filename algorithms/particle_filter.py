@@ -0,0 +1,323 @@
+import math
+import threading
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from algorithms.fingerprint_matching import LIKELIHOOD_MODES, _to_epoch_seconds
+
+# Largest move (in cells) a particle makes per wall check, so it can't jump a wall
+MAX_SUBSTEP = 0.5
+
+
+class ParticleFilterLocalizer:
+    def __init__(self, matcher, maze_data=None, n_particles=500, max_speed=2.0,
+                 velocity_decay=0.95, accel_noise=0.3, position_noise=0.15,
+                 resample_threshold=0.5, stale_after=30.0, max_dt=5.0, seed=None):
+        """
+        Particle filter localizer: IMU dead reckoning between scans, fingerprint
+        likelihood at each scan, particles confined to maze passages.
+
+        Each miner has a fixed budget of particles stored as NumPy arrays
+        (x, y, vx, vy, log weight). Propagation integrates the IMU deltas,
+        reweighting scores only the radio map cells the particles occupy, so a
+        cycle never pays for a full map scan.
+
+        IMU convention follows the simulators: accel_x/accel_y are horizontal
+        accelerations in map axes (m/s^2, one grid cell = 1 m) and gyro_z turns
+        the velocity vector (rad/s).
+
+        Parameters:
+        - matcher: FingerprintMatcher providing the radio map engine ('naive_bayes' or 'lut')
+        - maze_data: Dict from create_digitized_maze_data_cartesian (default: matcher.maze_data)
+        - n_particles: Particles per miner
+        - max_speed: Speed cap in cells per second (walking pace in the simulator)
+        - velocity_decay: Velocity kept per propagation step (friction)
+        - accel_noise: Std of acceleration noise per particle (m/s^2)
+        - position_noise: Std of position diffusion per sqrt(second) (cells)
+        - resample_threshold: Resample when effective particles < this fraction
+        - stale_after: Seconds without updates after which particles restart
+        - max_dt: Longest single propagation step (seconds)
+        - seed: Optional RNG seed (reproducible runs)
+        """
+        maze_data = maze_data if maze_data is not None else matcher.maze_data
+        if maze_data is None:
+            raise ValueError("ParticleFilterLocalizer requires maze_data")
+        if matcher.match_mode not in LIKELIHOOD_MODES:
+            raise ValueError(f"ParticleFilterLocalizer requires match_mode in {LIKELIHOOD_MODES}")
+
+        self.matcher = matcher
+        self.n_particles = n_particles
+        self.max_speed = max_speed
+        self.velocity_decay = velocity_decay
+        self.accel_noise = accel_noise
+        self.position_noise = position_noise
+        self.resample_threshold = resample_threshold
+        self.stale_after = stale_after
+        self.max_dt = max_dt
+
+        # Passable lookup padded by one wall cell, so off-grid positions are walls
+        grid = maze_data['grid_cartesian']
+        self._passable = np.zeros((grid.shape[0] + 2, grid.shape[1] + 2), dtype=bool)
+        self._passable[1:-1, 1:-1] = grid != 1
+
+        self._rng = np.random.default_rng(seed)
+        self._particles = {}
+        self._lock = threading.Lock()
+        self._spatial_index = None
+
+    def update(self, miner_id, processed_rssi=None, imu_data=None, now=None):
+        """
+        Advance one miner's particles to now and fold in a scan if given.
+        Particles restart after stale_after seconds without updates and after
+        a radio map reload that changed the set of cells.
+
+        Parameters:
+        - miner_id: Miner whose particles are updated
+        - processed_rssi: Optional dict from RSSIPreprocessor; without it the
+          particles are only propagated (position between scans)
+        - imu_data: Optional telemetry dict with accel_x/accel_y/gyro_z
+        - now: Current time (default: time.time())
+
+        Returns:
+        Result dict in FingerprintMatcher format; location x/y is the weighted
+        particle mean (the best cell's coordinates when the mean falls in a
+        wall), metrics add 'spread' and 'effective_particles'.
+        """
+        return self.update_batch([miner_id], [processed_rssi], [imu_data], now=now)[0]
+
+    def update_batch(self, miner_ids, rssi_list=None, imu_list=None, now=None):
+        """
+        update() for several miners (e.g. one scan cycle) with a single
+        likelihood call: every miner's particles are propagated on their own,
+        then the cells occupied by all miners' particles are scored together.
+
+        Parameters:
+        - miner_ids: Miners to update
+        - rssi_list: Optional list of processed RSSI dicts (or None), same order
+        - imu_list: Optional list of IMU dicts (or None), same order
+        - now: Current time shared by the batch (default: time.time())
+
+        Returns:
+        List of result dicts in miner_ids order, as update() returns them.
+        """
+        engine = self.matcher.engine
+        current_time = _to_epoch_seconds(now) if now is not None else time.time()
+        rssi_list = rssi_list or [None] * len(miner_ids)
+        imu_list = imu_list or [None] * len(miner_ids)
+
+        results = [None] * len(miner_ids)
+        updates = []  # (position, miner_id, particles, valid_beacons, processed_rssi)
+        for i, (miner_id, processed_rssi, imu_data) in enumerate(zip(miner_ids, rssi_list, imu_list)):
+            valid_beacons = []
+            if processed_rssi is not None:
+                valid_beacons, error = self.matcher._validate_rssi_input(processed_rssi, engine)
+                if error:
+                    processed_rssi = None
+
+            particles = self._advance(engine, miner_id, imu_data, current_time)
+            if particles is None:
+                results[i] = self.matcher._error_result("No radio map cells in passable maze cells")
+                continue
+            updates.append((i, miner_id, particles, valid_beacons, processed_rssi))
+
+        # One (reading, occupied cell) scoring call for every miner with a scan
+        scans = [update for update in updates if update[4] is not None]
+        if scans:
+            occupied, inverses = [], []
+            for _, _, particles, _, _ in scans:
+                cells, inverse = np.unique(self._nearest_rows(engine, particles['x'], particles['y']),
+                                           return_inverse=True)
+                occupied.append(cells)
+                inverses.append(inverse)
+
+            rssi_matrix = np.array([engine.rssi_array(update[4]) for update in scans])
+            readings = np.repeat(np.arange(len(scans)), [len(cells) for cells in occupied])
+            log_likelihood = self.matcher._pair_log_likelihood(
+                engine, rssi_matrix[readings], np.concatenate(occupied)
+            )
+
+            offsets = np.cumsum([0] + [len(cells) for cells in occupied])
+            for j, (_, _, particles, _, _) in enumerate(scans):
+                self._reweight(particles, inverses[j], log_likelihood[offsets[j]:offsets[j + 1]])
+
+        with self._lock:
+            for _, miner_id, particles, _, _ in updates:
+                self._particles[miner_id] = particles
+
+        for i, miner_id, particles, valid_beacons, _ in updates:
+            rows = self._nearest_rows(engine, particles['x'], particles['y'])
+            results[i] = self._estimate(engine, particles, rows, valid_beacons, miner_id)
+        return results
+
+    def _advance(self, engine, miner_id, imu_data, current_time):
+        """A miner's particles propagated to current_time (restarted if stale or the cells changed)."""
+        with self._lock:
+            particles = self._particles.get(miner_id)
+
+        if (particles is None or current_time - particles['timestamp'] > self.stale_after
+                or (particles['version'] != engine.version and not engine.has_cells(particles['cell_xy']))):
+            return self._initial_particles(engine, current_time)
+
+        dt = min(max(current_time - particles['timestamp'], 0.0), self.max_dt)
+        self._propagate(particles, imu_data or {}, dt)
+        particles['timestamp'] = current_time
+        particles['version'] = engine.version
+        particles['cell_xy'] = engine.cell_xy
+        return particles
+
+    def reset(self, miner_id=None):
+        """Drop one miner's particles (or every miner's if None)."""
+        with self._lock:
+            if miner_id is None:
+                self._particles.clear()
+            else:
+                self._particles.pop(miner_id, None)
+
+    def _initial_particles(self, engine, timestamp):
+        """Particles spread uniformly over radio map cells inside passages."""
+        cell_xy = np.asarray(engine.cell_xy, dtype=float)
+        inside = self._is_passable(cell_xy[:, 0], cell_xy[:, 1])
+        candidates = np.flatnonzero(inside)
+        if len(candidates) == 0:
+            return None
+
+        rows = self._rng.choice(candidates, size=self.n_particles)
+        n = self.n_particles
+        # Jitter within +-0.5 keeps every particle in its starting maze cell
+        return {
+            'x': cell_xy[rows, 0] + self._rng.uniform(-0.5, 0.5, n),
+            'y': cell_xy[rows, 1] + self._rng.uniform(-0.5, 0.5, n),
+            'vx': np.zeros(n),
+            'vy': np.zeros(n),
+            'log_weight': np.full(n, -math.log(n)),
+            'timestamp': timestamp,
+            'version': engine.version,
+            'cell_xy': engine.cell_xy
+        }
+
+    def _is_passable(self, x, y):
+        ix = np.floor(x + 0.5).astype(int) + 1
+        iy = np.floor(y + 0.5).astype(int) + 1
+        H, W = self._passable.shape
+        inside = (ix >= 0) & (ix < W) & (iy >= 0) & (iy < H)
+        passable = np.zeros(len(ix), dtype=bool)
+        passable[inside] = self._passable[iy[inside], ix[inside]]
+        return passable
+
+    def _propagate(self, particles, imu_data, dt):
+        """Dead-reckon every particle by dt seconds, stopping at walls."""
+        if dt <= 0:
+            return
+
+        n = self.n_particles
+        vx, vy = particles['vx'], particles['vy']
+
+        # Turn with the gyro, then integrate the (noisy) acceleration
+        turn = float(imu_data.get('gyro_z', 0.0) or 0.0) * dt
+        if turn:
+            cos_t, sin_t = math.cos(turn), math.sin(turn)
+            vx, vy = vx * cos_t - vy * sin_t, vx * sin_t + vy * cos_t
+
+        ax = float(imu_data.get('accel_x', 0.0) or 0.0)
+        ay = float(imu_data.get('accel_y', 0.0) or 0.0)
+        vx = vx + (ax + self._rng.normal(0.0, self.accel_noise, n)) * dt
+        vy = vy + (ay + self._rng.normal(0.0, self.accel_noise, n)) * dt
+
+        speed = np.hypot(vx, vy)
+        scale = np.minimum(1.0, self.max_speed / np.maximum(speed, 1e-12))
+        vx, vy = vx * scale, vy * scale
+
+        diffusion = self.position_noise * math.sqrt(dt)
+        dx = vx * dt + self._rng.normal(0.0, diffusion, n)
+        dy = vy * dt + self._rng.normal(0.0, diffusion, n)
+
+        # Substeps short enough that no particle skips over a wall cell
+        steps = max(1, int(math.ceil(float(np.max(np.hypot(dx, dy))) / MAX_SUBSTEP)))
+        x, y = particles['x'], particles['y']
+        moving = np.ones(n, dtype=bool)
+        for _ in range(steps):
+            new_x = x + dx / steps
+            new_y = y + dy / steps
+            blocked = ~self._is_passable(new_x, new_y)
+            moving &= ~blocked
+            x = np.where(moving, new_x, x)
+            y = np.where(moving, new_y, y)
+
+        # Particles that hit a wall stop there
+        particles['x'], particles['y'] = x, y
+        particles['vx'] = np.where(moving, vx, 0.0) * self.velocity_decay
+        particles['vy'] = np.where(moving, vy, 0.0) * self.velocity_decay
+
+    def _nearest_rows(self, engine, x, y):
+        """Radio map row nearest to each particle (spatial KD-tree per engine)."""
+        index = self._spatial_index
+        if index is None or index[0] != engine.version:
+            index = (engine.version, cKDTree(np.asarray(engine.cell_xy, dtype=float)))
+            self._spatial_index = index
+        _, rows = index[1].query(np.column_stack((x, y)))
+        return rows
+
+    def _reweight(self, particles, inverse, log_likelihood):
+        """
+        Multiply in the fingerprint likelihood (per occupied cell, inverse maps
+        particles to cells); systematic resample if degenerate.
+        """
+        log_weight = particles['log_weight'] + log_likelihood[inverse]
+        log_weight -= log_weight.max()
+        log_weight -= math.log(np.exp(log_weight).sum())
+        particles['log_weight'] = log_weight
+
+        weights = np.exp(log_weight)
+        effective = 1.0 / float(np.dot(weights, weights))
+        if effective < self.resample_threshold * self.n_particles:
+            self._systematic_resample(particles, weights)
+
+    def _systematic_resample(self, particles, weights):
+        n = self.n_particles
+        positions = (np.arange(n) + self._rng.uniform()) / n
+        cumulative = np.cumsum(weights)
+        cumulative[-1] = 1.0
+        keep = np.searchsorted(cumulative, positions)
+
+        for name in ('x', 'y', 'vx', 'vy'):
+            particles[name] = particles[name][keep]
+        particles['log_weight'] = np.full(n, -math.log(n))
+
+    def _estimate(self, engine, particles, rows, valid_beacons, miner_id):
+        """
+        Weighted mean position plus per-cell particle mass in the standard format.
+        A mean inside a wall (particles split across a wall) keeps the best
+        cell's coordinates instead, so location and cell_id agree.
+        """
+        weights = np.exp(particles['log_weight'])
+        weights /= weights.sum()
+
+        # Probability mass per occupied radio map cell
+        occupied, inverse = np.unique(rows, return_inverse=True)
+        cell_mass = np.bincount(inverse, weights=weights, minlength=len(occupied))
+        order = np.lexsort((occupied, -cell_mass))
+        ranked = occupied[order]
+        top_probs = cell_mass[order]
+
+        nonzero = cell_mass[cell_mass > 0]
+        entropy = float(-(nonzero * np.log2(nonzero)).sum())
+        max_entropy = math.log2(self.n_particles)
+        uncertainty = entropy / max_entropy if max_entropy > 0 else 0.0
+
+        result = self.matcher._format_result(engine, ranked, top_probs, uncertainty, valid_beacons, miner_id)
+
+        mean_x = float(np.dot(weights, particles['x']))
+        mean_y = float(np.dot(weights, particles['y']))
+        variance = np.dot(weights, (particles['x'] - mean_x) ** 2 + (particles['y'] - mean_y) ** 2)
+
+        # Checked after rounding, which can carry a mean on a cell edge over it
+        x, y = round(mean_x, 2), round(mean_y, 2)
+        if self._is_passable(np.array([x]), np.array([y]))[0]:
+            result['location']['x'] = x
+            result['location']['y'] = y
+        result['metrics']['spread'] = round(math.sqrt(float(variance)), 3)
+        result['metrics']['effective_particles'] = round(1.0 / float(np.dot(weights, weights)), 1)
+        result['metrics']['search'] = 'particle_filter'
+        return result
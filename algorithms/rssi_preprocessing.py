@@ -1,9 +1,205 @@
 import numpy as np
 from collections import deque
+from bisect import bisect_left, insort
 import math
+import threading
+
+from algorithms.lazy_result import LazyResult, VERBOSE_DIAGNOSTICS, VERBOSE_MINIMAL
+
+# Beacons of the original three-anchor test site
+DEFAULT_BEACON_IDS = ['B1', 'B2', 'B3']
+
+# Kalman smoothing (dB^2): random-walk drift of a beacon's mean RSSI per cycle,
+# floor on a burst's measurement variance, and the posterior variance at which
+# the variance confidence component reaches 0
+KALMAN_PROCESS_NOISE = 2.0
+KALMAN_MEASUREMENT_NOISE = 1.0
+KALMAN_CONFIDENCE_VARIANCE = 10.0
+SMOOTHING_MODES = ('ema', 'kalman')
+
+# Beacon confidence component weights (count, variance, range, stability)
+CONFIDENCE_WEIGHTS = {'count': 0.3, 'variance': 0.3, 'range': 0.2, 'stability': 0.2}
+
+
+def _sorted_median(ordered, start, length):
+    """
+    Median of ordered[..., start:start + length] along the last axis, where
+    start and length are arrays over the leading axes (0 where length is 0).
+    """
+    length = np.asarray(length)
+    first = np.maximum(start + (length - 1) // 2, 0)
+    second = np.maximum(start + length // 2, 0)
+    if ordered.shape[-1] == 0:
+        return np.zeros(length.shape)
+
+    first = np.minimum(first, ordered.shape[-1] - 1)[..., np.newaxis]
+    second = np.minimum(second, ordered.shape[-1] - 1)[..., np.newaxis]
+    median = (np.take_along_axis(ordered, first, axis=-1) + np.take_along_axis(ordered, second, axis=-1))[..., 0] / 2
+    return np.where(length > 0, median, 0.0)
+
+
+def _round(values, decimals):
+    """Python round() per element; np.round can differ on ties such as -66.45."""
+    values = np.asarray(values, dtype=float)
+    return np.array([round(v, decimals) for v in values.ravel().tolist()]).reshape(values.shape)
+
+
+def _kth_of_two(a, len_a, b, len_b, k):
+    """k-th smallest (0-based) of two ascending sequences given as index functions, O(log n)."""
+    lo, hi = max(0, k + 1 - len_b), min(k + 1, len_a)
+    while lo < hi:
+        i = (lo + hi) // 2
+        j = k + 1 - i
+        if j > 0 and i < len_a and b(j - 1) > a(i):
+            lo = i + 1
+        else:
+            hi = i
+    j = k + 1 - lo
+    return max(a(lo - 1) if lo > 0 else -math.inf, b(j - 1) if j > 0 else -math.inf)
+
+
+class StreamingBeaconWindow:
+    def __init__(self, max_samples):
+        """
+        Sliding window of one miner-beacon pair's most recent RSSI samples.
+
+        Samples are kept in arrival order (for eviction) and in a sorted list
+        (order statistics); mean and variance are updated by Welford's method
+        on insert and evict. Insert and evict find their slot by bisection,
+        O(log n), but shift the list, O(n); windows are small, so that is a
+        short memmove. Median, min and max are O(1), the MAD is a k-th order
+        statistic of two sorted distance sequences, O(log n).
+
+        Parameters:
+        - max_samples: Window length; the oldest sample is evicted beyond it
+        """
+        self.max_samples = max_samples
+        self._arrival = deque()
+        self._sorted = []
+        self._mean = 0.0
+        self._m2 = 0.0
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def add(self, value):
+        value = float(value)
+        if len(self._arrival) >= self.max_samples:
+            oldest = self._arrival.popleft()
+            del self._sorted[bisect_left(self._sorted, oldest)]
+            self._mean, self._m2 = _welford_remove(len(self._sorted) + 1, self._mean, self._m2, oldest)
+
+        self._arrival.append(value)
+        insort(self._sorted, value)
+        n = len(self._sorted)
+        delta = value - self._mean
+        self._mean += delta / n
+        self._m2 += delta * (value - self._mean)
+
+    def clear(self):
+        self._arrival.clear()
+        self._sorted.clear()
+        self._mean = self._m2 = 0.0
+
+    @property
+    def minimum(self):
+        return self._sorted[0] if self._sorted else None
+
+    @property
+    def maximum(self):
+        return self._sorted[-1] if self._sorted else None
+
+    @property
+    def variance(self):
+        n = len(self._sorted)
+        return max(self._m2 / n, 0.0) if n > 1 else 0.0
+
+    def median(self, start=0, stop=None):
+        """Median of the sorted samples [start, stop), O(1)."""
+        stop = len(self._sorted) if stop is None else stop
+        n = stop - start
+        return (self._sorted[start + (n - 1) // 2] + self._sorted[start + n // 2]) / 2
+
+    def mad(self, median=None):
+        """Median absolute deviation from median (default: the window median)."""
+        values = self._sorted
+        n = len(values)
+        median = self.median() if median is None else median
+
+        # Distances below the median read right-to-left, above it left-to-right
+        split = bisect_left(values, median)
+        below = lambda i: median - values[split - 1 - i]
+        above = lambda i: values[split + i] - median
+        first = _kth_of_two(below, split, above, n - split, (n - 1) // 2)
+        second = _kth_of_two(below, split, above, n - split, n // 2)
+        return (first + second) / 2
+
+    def summary(self):
+        """
+        Same statistics as RSSIPreprocessor._summarize_samples on the window,
+        from the running order statistics: the modified Z-score inliers are a
+        contiguous run of the sorted samples, found by binary search.
+        """
+        values = self._sorted
+        n = len(values)
+        start, stop = 0, n
+
+        # Step 1: Remove outliers (same rules as _remove_outliers)
+        if n >= 3:
+            median = self.median()
+            mad = self.mad(median)
+            if mad != 0:
+                inlier = lambda i: abs(0.6745 * (values[i] - median) / mad) < 3.5
+                split = bisect_left(values, median)
+                lo, hi = 0, split
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    lo, hi = (lo, mid) if inlier(mid) else (mid + 1, hi)
+                first = lo
+                lo, hi = split, n
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    lo, hi = (mid + 1, hi) if inlier(mid) else (lo, mid)
+                last = lo
+                if last - first >= n * 0.5:
+                    start, stop = first, last
+
+        # Variance of the cleaned run: evict the trimmed ends from the running moments
+        count, mean, m2 = n, self._mean, self._m2
+        for value in values[:start] + values[stop:]:
+            mean, m2 = _welford_remove(count, mean, m2, value)
+            count -= 1
+
+        # Step 2: Robust median (middle 50% of the cleaned run)
+        cleaned = stop - start
+        lower, upper = cleaned // 4, (3 * cleaned) // 4
+        if upper > lower:
+            current_median = self.median(start + lower, start + upper)
+        else:
+            current_median = self.median(start, stop)
+
+        return {
+            'current_median': current_median,
+            'median': self.median(start, stop),
+            'sample_count': cleaned,
+            'variance': max(m2 / cleaned, 0.0) if cleaned > 1 else 0,
+            'range': values[stop - 1] - values[start] if cleaned > 1 else 0
+        }
+
+
+def _welford_remove(n, mean, m2, value):
+    """Running (mean, M2) over n samples with value taken out."""
+    if n <= 1:
+        return 0.0, 0.0
+    mean_without = (n * mean - value) / (n - 1)
+    return mean_without, m2 - (value - mean) * (value - mean_without)
+
 
 class RSSIPreprocessor:
-    def __init__(self, alpha=0.3, outlier_threshold_db=15, min_samples=5, max_history=10):
+    def __init__(self, alpha=0.3, outlier_threshold_db=15, min_samples=5, max_history=10,
+                 beacon_ids=None, stream_window=30, history_capacity=64, smoothing='ema',
+                 process_noise=KALMAN_PROCESS_NOISE, measurement_noise=KALMAN_MEASUREMENT_NOISE,
+                 verbose=VERBOSE_MINIMAL):
         """
         Production-ready RSSI preprocessor with confidence scoring.
 
@@ -12,56 +208,172 @@ class RSSIPreprocessor:
         - outlier_threshold_db: Threshold for outlier removal (± dB from median)
         - min_samples: Minimum samples required for reliable processing
         - max_history: Maximum history length for trend analysis
+        - beacon_ids: Beacons to process, normally FingerprintMatcher.beacon_ids
+          (derived from the radio map); defaults to B1-B3
+        - stream_window: Samples kept per miner-beacon pair in streaming mode
+          (add_sample / stream_fix)
+        - history_capacity: Miners the smoothed-value history is preallocated
+          for (doubles when exceeded)
+        - smoothing: 'ema' (fixed alpha, caller passes previous_smoothed) or
+          'kalman' (per miner-beacon mean and variance kept here; the
+          posterior variance drives the variance confidence component)
+        - process_noise: Kalman drift variance per cycle (dB^2)
+        - measurement_noise: Floor on a burst's Kalman measurement variance (dB^2)
+        - verbose: VERBOSE_MINIMAL builds beacon_diagnostics only when read;
+          VERBOSE_DIAGNOSTICS builds it with every result
         """
+        if smoothing not in SMOOTHING_MODES:
+            raise ValueError(f"smoothing must be one of {SMOOTHING_MODES}, got {smoothing!r}")
+
         self.alpha = alpha
         self.outlier_threshold = outlier_threshold_db
         self.min_samples = min_samples
         self.max_history = max_history
-
-        # State tracking per miner-beacon pair
-        self.state_history = {}
+        self.verbose = verbose
+        self.beacon_ids = list(beacon_ids) if beacon_ids else list(DEFAULT_BEACON_IDS)
+        self._beacon_cols = {beacon_id: col for col, beacon_id in enumerate(self.beacon_ids)}
+
+        # Smoothed-value history per miner-beacon pair: float32 ring buffers
+        # (miner rows x beacons x max_history) with per-pair cursor and length
+        self._history_rows = {}
+        self._free_history_rows = []
+        self._history = np.zeros((history_capacity, len(self.beacon_ids), max_history), dtype=np.float32)
+        self._history_cursor = np.zeros((history_capacity, len(self.beacon_ids)), dtype=np.int32)
+        self._history_length = np.zeros((history_capacity, len(self.beacon_ids)), dtype=np.int32)
+        # Guards row allocation, growth, eviction and every read-modify-write of
+        # the row arrays (re-entrant: processing allocates rows while holding it)
+        self._history_lock = threading.RLock()
+
+        # Kalman state per miner-beacon on the same rows (NaN: not yet observed)
+        self.smoothing = smoothing
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self._kalman_mean = np.full((history_capacity, len(self.beacon_ids)), np.nan)
+        self._kalman_var = np.full((history_capacity, len(self.beacon_ids)), np.nan)
+
+        # Streaming mode: running window statistics per miner-beacon pair
+        self.stream_window = stream_window
+        self._streams = {}
+        self._stream_lock = threading.Lock()
 
     def _initialize_miner_state(self, miner_id):
-        """Initialize state tracking for new miner."""
-        if miner_id not in self.state_history:
-            self.state_history[miner_id] = {
-                'B1': {'values': deque(maxlen=self.max_history), 'stability': 1.0},
-                'B2': {'values': deque(maxlen=self.max_history), 'stability': 1.0},
-                'B3': {'values': deque(maxlen=self.max_history), 'stability': 1.0}
-            }
+        """Initialize state tracking for new miner. Returns: history row"""
+        with self._history_lock:
+            row = self._history_rows.get(miner_id)
+            if row is None:
+                if self._free_history_rows:
+                    # Reuse a forgotten miner's row (cleared by forget_miner)
+                    self._history_rows[miner_id] = row = self._free_history_rows.pop()
+                    return row
+                row = len(self._history_rows)
+                if row >= len(self._history):
+                    # Grow by doubling, so rows stay contiguous and appends amortized
+                    grow = len(self._history)
+                    self._history = np.concatenate((self._history, np.zeros_like(self._history[:grow])))
+                    self._history_cursor = np.concatenate((self._history_cursor, np.zeros_like(self._history_cursor[:grow])))
+                    self._history_length = np.concatenate((self._history_length, np.zeros_like(self._history_length[:grow])))
+                    self._kalman_mean = np.concatenate((self._kalman_mean, np.full_like(self._kalman_mean[:grow], np.nan)))
+                    self._kalman_var = np.concatenate((self._kalman_var, np.full_like(self._kalman_var[:grow], np.nan)))
+                self._history_rows[miner_id] = row
+            return row
+
+    def _append_history(self, rows, cols, values):
+        """Append smoothed values to the (row, col) ring buffers (arrays of pairs, each pair once)."""
+        cursor = self._history_cursor[rows, cols]
+        self._history[rows, cols, cursor] = values
+        self._history_cursor[rows, cols] = (cursor + 1) % self.max_history
+        self._history_length[rows, cols] = np.minimum(self._history_length[rows, cols] + 1, self.max_history)
+
+    def _recent_history(self, rows, cols, count):
+        """
+        Last count values of each (row, col) pair, newest last: (pairs x count)
+        array plus a mask of the slots that hold history.
+        """
+        offsets = np.arange(count, 0, -1)
+        slots = (self._history_cursor[rows, cols][..., np.newaxis] - offsets) % self.max_history
+        values = self._history[np.asarray(rows)[..., np.newaxis], np.asarray(cols)[..., np.newaxis], slots]
+        filled = offsets <= self._history_length[rows, cols][..., np.newaxis]
+        return values, filled
+
+    def _history_values(self, miner_id, beacon_id):
+        """One pair's history as an array, oldest first (empty if none)."""
+        with self._history_lock:
+            row = self._history_rows.get(miner_id)
+            if row is None:
+                return np.zeros(0, dtype=np.float32)
+            col = self._beacon_cols[beacon_id]
+            values, filled = self._recent_history(row, col, self.max_history)
+            return values[filled]
+
+    def _kalman_update(self, rows, measurement, measurement_var, observed):
+        """
+        One Kalman cycle for whole miner rows: every beacon's variance grows by
+        process_noise, observed beacons are corrected by their burst median.
+
+        Parameters:
+        - rows: Array of history rows (one per miner, no repeats)
+        - measurement: (rows x beacons) burst medians
+        - measurement_var: (rows x beacons) measurement variances
+        - observed: (rows x beacons) mask of beacons with samples this cycle
 
-    def _calculate_beacon_confidence(self, samples, beacon_id, miner_id):
+        Returns: (posterior mean, posterior variance), NaN where never observed
+        """
+        mean = self._kalman_mean[rows]
+        variance = self._kalman_var[rows] + self.process_noise
+        first = observed & np.isnan(variance)
+
+        with np.errstate(invalid='ignore'):
+            gain = variance / (variance + measurement_var)
+            mean = np.where(observed, mean + gain * (measurement - mean), mean)
+            variance = np.where(observed, (1.0 - gain) * variance, variance)
+        mean = np.where(first, measurement, mean)
+        variance = np.where(first, measurement_var, variance)
+
+        self._kalman_mean[rows] = mean
+        self._kalman_var[rows] = variance
+        return mean, variance
+
+    def _measurement_variance(self, variance, sample_count):
+        """Variance of a burst's median as a Kalman measurement (dB^2)."""
+        return np.maximum(np.asarray(variance, dtype=float) / np.maximum(sample_count, 1), self.measurement_noise)
+
+    def _calculate_beacon_confidence(self, summary, beacon_id, miner_id, posterior_variance=None):
         """
         Calculate confidence score for a beacon's RSSI reading.
-        Returns: confidence (0.0-1.0), diagnostics dict
+
+        Parameters:
+        - summary: Dict from _summarize_samples or StreamingBeaconWindow.summary
+          (cleaned sample_count, variance, range and median)
+        - posterior_variance: Kalman posterior variance; replaces the sample
+          variance in the variance component when given
+
+        Returns: confidence (0.0-1.0), diagnostics inputs (arguments of
+        _beacon_diagnostics, empty without samples)
         """
-        if not samples or len(samples) == 0:
-            return 0.0, {'reason': 'no_samples', 'count': 0}
+        sample_count = summary['sample_count']
+        if sample_count == 0:
+            return 0.0, ()
 
         # Count-based confidence
-        sample_count = len(samples)
         count_confidence = min(1.0, sample_count / 20.0)  # 20 samples = max confidence
 
         # Variance-based confidence
-        variance = np.var(samples) if len(samples) > 1 else 0
+        variance = summary['variance']
         # Lower variance = higher confidence
-        var_confidence = max(0.0, 1.0 - (variance / 100.0))  # Normalize
+        if posterior_variance is None:
+            var_confidence = max(0.0, 1.0 - (variance / 100.0))  # Normalize
+        else:
+            var_confidence = max(0.0, 1.0 - (posterior_variance / KALMAN_CONFIDENCE_VARIANCE))
 
         # Range-based confidence (detect clipping or extreme values)
-        rssi_range = max(samples) - min(samples) if len(samples) > 1 else 0
+        rssi_range = summary['range']
         range_confidence = max(0.0, 1.0 - (rssi_range / 40.0))  # >40 dB range suspicious
 
         # Stability confidence (trend over time)
-        stability = self._calculate_stability_confidence(miner_id, beacon_id, np.median(samples))
+        stability = self._calculate_stability_confidence(miner_id, beacon_id, summary['median'])
 
         # Combined confidence with weights
-        weights = {
-            'count': 0.3,
-            'variance': 0.3,
-            'range': 0.2,
-            'stability': 0.2
-        }
-
+        weights = CONFIDENCE_WEIGHTS
         total_confidence = (
             count_confidence * weights['count'] +
             var_confidence * weights['variance'] +
@@ -73,33 +385,61 @@ class RSSIPreprocessor:
         if sample_count < self.min_samples:
             total_confidence *= 0.5
 
-        # Diagnostics for debugging
+        diagnostics_inputs = (sample_count, variance, rssi_range, stability, var_confidence, posterior_variance)
+        return min(1.0, max(0.0, total_confidence)), diagnostics_inputs
+
+    def _beacon_diagnostics(self, sample_count, variance, rssi_range, stability, var_confidence,
+                            posterior_variance=None):
+        """Diagnostics dict for one beacon (built when beacon_diagnostics is read)."""
         diagnostics = {
             'sample_count': sample_count,
             'variance': round(variance, 2),
             'range': rssi_range,
             'stability': round(stability, 2),
             'component_scores': {
-                'count': round(count_confidence, 2),
+                'count': round(min(1.0, sample_count / 20.0), 2),
                 'variance': round(var_confidence, 2),
-                'range': round(range_confidence, 2),
+                'range': round(max(0.0, 1.0 - (rssi_range / 40.0)), 2),
                 'stability': round(stability, 2)
             }
         }
+        if posterior_variance is not None:
+            diagnostics['posterior_variance'] = round(float(posterior_variance), 2)
+        return diagnostics
 
-        return min(1.0, max(0.0, total_confidence)), diagnostics
+    def _diagnostics_factory(self, diagnostics_inputs):
+        """
+        Factory for a lazy beacon_diagnostics field.
+
+        Parameters:
+        - diagnostics_inputs: Dict {beacon_id: _beacon_diagnostics arguments,
+          () if no sample survived cleaning, None for a missing beacon}
+        """
+        def build():
+            beacon_diagnostics = {}
+            for beacon_id, inputs in diagnostics_inputs.items():
+                if inputs is None:
+                    beacon_diagnostics[beacon_id] = {'status': 'missing', 'reason': 'no_samples_detected'}
+                elif not inputs:
+                    beacon_diagnostics[beacon_id] = {'reason': 'no_samples', 'count': 0}
+                else:
+                    beacon_diagnostics[beacon_id] = self._beacon_diagnostics(*inputs)
+            return beacon_diagnostics
+        return build
 
     def _calculate_stability_confidence(self, miner_id, beacon_id, current_median):
         """Calculate stability based on historical consistency."""
-        if miner_id not in self.state_history:
+        row = self._history_rows.get(miner_id)
+        if row is None:
             return 1.0  # No history, assume stable
 
-        history = self.state_history[miner_id][beacon_id]['values']
-        if len(history) < 2:
+        col = self._beacon_cols[beacon_id]
+        if self._history_length[row, col] < 2:
             return 1.0
 
         # Calculate how much current value deviates from historical trend
-        recent_avg = np.mean(list(history)[-3:]) if len(history) >= 3 else np.mean(history)
+        values, filled = self._recent_history(row, col, min(3, self.max_history))
+        recent_avg = float(values[filled].mean(dtype=np.float64))
         deviation = abs(current_median - recent_avg)
 
         # Small deviation = high stability
@@ -139,6 +479,34 @@ class RSSIPreprocessor:
             return current_value
         return self.alpha * current_value + (1 - self.alpha) * previous_value
 
+    def _summarize_samples(self, samples):
+        """
+        Outlier removal and robust median for one beacon's burst of samples.
+        Returns: dict with current_median (middle-50% median), median,
+        sample_count, variance and range of the cleaned samples
+        """
+        # Step 1: Remove outliers
+        cleaned_samples = self._remove_outliers(samples)
+
+        # Step 2: Calculate robust median (middle 50% range)
+        if cleaned_samples:
+            sorted_samples = sorted(cleaned_samples)
+            n = len(sorted_samples)
+            lower_idx = n // 4
+            upper_idx = (3 * n) // 4
+            central_samples = sorted_samples[lower_idx:upper_idx]
+            current_median = np.median(central_samples) if central_samples else np.median(sorted_samples)
+        else:
+            current_median = np.median(samples)
+
+        return {
+            'current_median': current_median,
+            'median': np.median(cleaned_samples),
+            'sample_count': len(cleaned_samples),
+            'variance': np.var(cleaned_samples) if len(cleaned_samples) > 1 else 0,
+            'range': max(cleaned_samples) - min(cleaned_samples) if len(cleaned_samples) > 1 else 0
+        }
+
     def process_miner_rssi(self, miner_id, raw_samples, previous_smoothed=None):
         """
         Main processing function for a single miner.
@@ -147,134 +515,468 @@ class RSSIPreprocessor:
         - miner_id: String identifier (M01-M05)
         - raw_samples: Dict {beacon_id: [rssi_values]}
         - previous_smoothed: Dict {beacon_id: previous_smoothed_value} or None
+          (EMA smoothing only; Kalman state is kept per miner)
 
         Returns:
         Dict with processed RSSI values, confidence scores, and diagnostics.
         """
-        # Initialize state tracking
-        self._initialize_miner_state(miner_id)
+        summaries = {
+            beacon_id: self._summarize_samples(raw_samples[beacon_id])
+            for beacon_id in self.beacon_ids if raw_samples.get(beacon_id)
+        }
+        raw_counts = {beacon_id: len(raw_samples.get(beacon_id, [])) for beacon_id in self.beacon_ids}
+        return self._build_results(miner_id, summaries, raw_counts, previous_smoothed)
 
-        # Default previous values if not provided
-        if previous_smoothed is None:
-            previous_smoothed = {'B1': None, 'B2': None, 'B3': None}
+    def _build_results(self, miner_id, summaries, raw_counts, previous_smoothed=None):
+        """
+        Smoothing, confidence scoring and the result dict from per-beacon summaries.
 
-        # Initialize results structure
-        results = {
-            'miner_id': miner_id,
-            'processed_rssi': {},
-            'beacon_confidence': {},
-            'overall_confidence': 0.0,
-            'beacon_diagnostics': {},
-            'quality_flags': {
-                'sufficient_samples': False,
-                'stable_readings': False,
-                'beacon_coverage': 0
-            },
-            'timestamp': None  # To be set by caller
-        }
+        Parameters:
+        - miner_id: Miner the summaries belong to
+        - summaries: Dict {beacon_id: summary} for beacons with samples
+        - raw_counts: Dict {beacon_id: samples received} (sufficient_samples flag)
+        - previous_smoothed: Dict {beacon_id: previous_smoothed_value} or None
+        """
+        # Row lookup, Kalman update, stability and history append as one step
+        with self._history_lock:
+            # Initialize state tracking
+            row = self._initialize_miner_state(miner_id)
+
+            # Default previous values if not provided
+            if previous_smoothed is None:
+                previous_smoothed = {}
+
+            # Kalman mode: one vectorized update over the miner's beacons
+            if self.smoothing == 'kalman':
+                observed = np.array([beacon_id in summaries for beacon_id in self.beacon_ids])
+                measurement = np.array([
+                    summaries[beacon_id]['current_median'] if beacon_id in summaries else np.nan
+                    for beacon_id in self.beacon_ids
+                ])
+                measurement_var = self._measurement_variance(
+                    [summaries[beacon_id]['variance'] if beacon_id in summaries else 0.0 for beacon_id in self.beacon_ids],
+                    [summaries[beacon_id]['sample_count'] if beacon_id in summaries else 0 for beacon_id in self.beacon_ids]
+                )
+                kalman_mean, kalman_var = self._kalman_update(
+                    np.array([row]), measurement[np.newaxis], measurement_var[np.newaxis], observed[np.newaxis]
+                )
+
+            # Initialize results structure (beacon_diagnostics is built on access)
+            results = LazyResult({
+                'miner_id': miner_id,
+                'processed_rssi': {},
+                'beacon_confidence': {},
+                'overall_confidence': 0.0,
+                'quality_flags': {
+                    'sufficient_samples': False,
+                    'stable_readings': False,
+                    'beacon_coverage': 0
+                },
+                'timestamp': None  # To be set by caller
+            })
+
+            beacon_confidences = []
+            valid_beacon_count = 0
+            diagnostics_inputs = {}
+
+            # Process each beacon
+            for beacon_id in self.beacon_ids:
+                summary = summaries.get(beacon_id)
+
+                # Handle missing beacon
+                if summary is None:
+                    results['processed_rssi'][beacon_id] = -100.0
+                    results['beacon_confidence'][beacon_id] = 0.0
+                    diagnostics_inputs[beacon_id] = None
+                    continue
+
+                # Step 3: Apply exponential or Kalman smoothing
+                col = self._beacon_cols[beacon_id]
+                if self.smoothing == 'kalman':
+                    smoothed_value = kalman_mean[0, col]
+                    posterior_variance = kalman_var[0, col]
+                else:
+                    previous_value = previous_smoothed.get(beacon_id)
+                    smoothed_value = self._exponential_smoothing(summary['current_median'], previous_value)
+                    posterior_variance = None
+
+                # Step 4: Calculate confidence
+                confidence, diagnostics_inputs[beacon_id] = self._calculate_beacon_confidence(
+                    summary, beacon_id, miner_id, posterior_variance
+                )
+
+                # Update state history
+                self._append_history(row, col, smoothed_value)
+
+                # Store results
+                results['processed_rssi'][beacon_id] = round(float(smoothed_value), 1)
+                results['beacon_confidence'][beacon_id] = round(float(confidence), 3)
+
+                # Track for overall confidence
+                if confidence > 0.3:  # Minimum threshold
+                    beacon_confidences.append(confidence)
+                    valid_beacon_count += 1
+
+            # Calculate overall metrics
+            if beacon_confidences:
+                results['overall_confidence'] = round(float(np.mean(beacon_confidences)), 3)
+            else:
+                results['overall_confidence'] = 0.0
 
-        beacon_confidences = []
-        valid_beacon_count = 0
+            # Set quality flags
+            results['quality_flags']['sufficient_samples'] = (
+                all(raw_counts.get(b, 0) >= self.min_samples for b in self.beacon_ids)
+            )
+            results['quality_flags']['stable_readings'] = (
+                results['overall_confidence'] >= 0.7
+            )
+            results['quality_flags']['beacon_coverage'] = valid_beacon_count
+
+            # Determine overall status
+            if valid_beacon_count >= 2 and results['overall_confidence'] >= 0.7:
+                results['status'] = 'HIGH_CONFIDENCE'
+            elif valid_beacon_count >= 2 and results['overall_confidence'] >= 0.5:
+                results['status'] = 'MEDIUM_CONFIDENCE'
+            elif valid_beacon_count >= 1:
+                results['status'] = 'LOW_CONFIDENCE'
+            else:
+                results['status'] = 'NO_VALID_DATA'
 
-        # Process each beacon
-        for beacon_id in ['B1', 'B2', 'B3']:
-            samples = raw_samples.get(beacon_id, [])
+            results.defer('beacon_diagnostics', self._diagnostics_factory(diagnostics_inputs),
+                          VERBOSE_DIAGNOSTICS, self.verbose)
+            return results
 
-            # Handle missing beacon
-            if not samples or len(samples) == 0:
-                results['processed_rssi'][beacon_id] = -100.0
-                results['beacon_confidence'][beacon_id] = 0.0
-                results['beacon_diagnostics'][beacon_id] = {
-                    'status': 'missing',
-                    'reason': 'no_samples_detected'
-                }
-                continue
+    def add_sample(self, miner_id, beacon_id, rssi_value):
+        """
+        Streaming mode: fold one RSSI sample into the miner-beacon window as it
+        arrives (O(log n) search plus an O(n) sorted-list insert/evict, O(1)
+        mean/variance; windows are small).
 
-            # Step 1: Remove outliers
-            cleaned_samples = self._remove_outliers(samples)
-
-            # Step 2: Calculate robust median (middle 50% range)
-            if cleaned_samples:
-                sorted_samples = sorted(cleaned_samples)
-                n = len(sorted_samples)
-                lower_idx = n // 4
-                upper_idx = (3 * n) // 4
-                central_samples = sorted_samples[lower_idx:upper_idx]
-                current_median = np.median(central_samples) if central_samples else np.median(sorted_samples)
-            else:
-                current_median = np.median(samples)
+        Parameters:
+        - miner_id: Miner that heard the beacon
+        - beacon_id: Beacon ID (samples from unknown beacons are ignored)
+        - rssi_value: RSSI in dBm
+        """
+        if beacon_id not in self.beacon_ids:
+            return
+        with self._stream_lock:
+            windows = self._streams.get(miner_id)
+            if windows is None:
+                windows = self._streams[miner_id] = {}
+            window = windows.get(beacon_id)
+            if window is None:
+                window = windows[beacon_id] = StreamingBeaconWindow(self.stream_window)
+            window.add(rssi_value)
+
+    def stream_fix(self, miner_id, previous_smoothed=None, reset=False):
+        """
+        Streaming mode: process_miner_rssi over the samples currently in the
+        miner's windows, read from the running statistics (no re-sorting).
 
-            # Step 3: Apply exponential smoothing
-            previous_value = previous_smoothed.get(beacon_id)
-            smoothed_value = self._exponential_smoothing(current_median, previous_value)
+        Parameters:
+        - miner_id: Miner to produce a fix for
+        - previous_smoothed: Dict {beacon_id: previous_smoothed_value} or None
+        - reset: Empty the miner's windows afterwards (burst-style cycles)
 
-            # Step 4: Calculate confidence
-            confidence, diagnostics = self._calculate_beacon_confidence(
-                cleaned_samples, beacon_id, miner_id
-            )
+        Returns:
+        Dict in the process_miner_rssi format.
+        """
+        with self._stream_lock:
+            windows = self._streams.get(miner_id, {})
+            summaries = {
+                beacon_id: window.summary() for beacon_id, window in windows.items() if len(window)
+            }
+            raw_counts = {beacon_id: len(window) for beacon_id, window in windows.items()}
+            if reset:
+                for window in windows.values():
+                    window.clear()
 
-            # Update state history
-            self.state_history[miner_id][beacon_id]['values'].append(smoothed_value)
+        return self._build_results(miner_id, summaries, raw_counts, previous_smoothed)
 
-            # Store results
-            results['processed_rssi'][beacon_id] = round(float(smoothed_value), 1)
-            results['beacon_confidence'][beacon_id] = round(float(confidence), 3)
-            results['beacon_diagnostics'][beacon_id] = diagnostics
+    def reset_stream(self, miner_id):
+        """Drop a miner's streaming windows."""
+        with self._stream_lock:
+            self._streams.pop(miner_id, None)
 
-            # Track for overall confidence
-            if confidence > 0.3:  # Minimum threshold
-                beacon_confidences.append(confidence)
-                valid_beacon_count += 1
+    def pack_samples(self, raw_samples_by_miner):
+        """
+        Pad per-miner sample lists into the arrays process_batch takes.
 
-        # Calculate overall metrics
-        if beacon_confidences:
-            results['overall_confidence'] = round(float(np.mean(beacon_confidences)), 3)
-        else:
-            results['overall_confidence'] = 0.0
+        Parameters:
+        - raw_samples_by_miner: Dict {miner_id: {beacon_id: [rssi_values]}}
+
+        Returns:
+        (miner_ids, samples, mask): samples is (miners x beacons x max samples)
+        float in self.beacon_ids order, mask marks the real samples.
+        """
+        miner_ids = list(raw_samples_by_miner)
+        lengths = [
+            len(raw_samples_by_miner[miner_id].get(beacon_id) or [])
+            for miner_id in miner_ids for beacon_id in self.beacon_ids
+        ]
+        max_samples = max(lengths, default=0)
+
+        samples = np.zeros((len(miner_ids), len(self.beacon_ids), max_samples))
+        mask = np.zeros(samples.shape, dtype=bool)
+        for row, miner_id in enumerate(miner_ids):
+            raw_samples = raw_samples_by_miner[miner_id]
+            for col, beacon_id in enumerate(self.beacon_ids):
+                values = raw_samples.get(beacon_id) or []
+                samples[row, col, :len(values)] = values
+                mask[row, col, :len(values)] = True
+
+        return miner_ids, samples, mask
+
+    def process_batch(self, miner_ids, samples, mask, previous_smoothed=None):
+        """
+        process_miner_rssi for every miner of a cycle as whole-array operations.
+
+        Outlier removal, the trimmed median, EMA smoothing and confidence
+        scoring run on (miners x beacons x samples) arrays; medians come from
+        one sort per stage with unused slots pushed to the end.
+
+        Parameters:
+        - miner_ids: List of miner IDs, one per row
+        - samples: (miners x beacons x samples) RSSI array, beacons in
+          self.beacon_ids order (see pack_samples)
+        - mask: Boolean array of the same shape, True for real samples
+        - previous_smoothed: Optional (miners x beacons) array of previous
+          smoothed values, NaN where there is none (EMA smoothing only)
 
-        # Set quality flags
-        results['quality_flags']['sufficient_samples'] = (
-            all(len(raw_samples.get(b, [])) >= self.min_samples for b in ['B1', 'B2', 'B3'])
+        Returns:
+        Dict of arrays (rows = miners, columns = beacons): processed_rssi,
+        beacon_confidence, sample_count, variance, range, stability,
+        overall_confidence, beacon_coverage, sufficient_samples, status, plus
+        posterior_variance in Kalman mode. batch_miner_result() turns one row into the process_miner_rssi dict.
+        """
+        samples = np.asarray(samples, dtype=float)
+        mask = np.asarray(mask, dtype=bool)
+        n_raw = mask.sum(axis=-1)
+        present = n_raw > 0
+
+        # Step 1: Remove outliers (modified Z-score on median / MAD)
+        ordered = np.sort(np.where(mask, samples, np.inf), axis=-1)
+        median = _sorted_median(ordered, 0, n_raw)
+        deviation = np.sort(np.where(mask, np.abs(samples - median[..., np.newaxis]), np.inf), axis=-1)
+        mad = _sorted_median(deviation, 0, n_raw)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            modified_z = 0.6745 * (samples - median[..., np.newaxis]) / mad[..., np.newaxis]
+        inlier = mask & (np.abs(modified_z) < 3.5)
+        n_inlier = inlier.sum(axis=-1)
+
+        # Small sets, zero MAD and over-aggressive filtering keep every sample
+        filtered = (n_raw >= 3) & (mad > 0) & (n_inlier >= n_raw * 0.5)
+        cleaned = np.where(filtered[..., np.newaxis], inlier, mask)
+        n = cleaned.sum(axis=-1)
+
+        # Step 2: Robust median of the middle 50% (whole set if that is empty)
+        ordered = np.sort(np.where(cleaned, samples, np.inf), axis=-1)
+        lower, upper = n // 4, (3 * n) // 4
+        central = upper - lower
+        current_median = np.where(
+            central > 0,
+            _sorted_median(ordered, lower, central),
+            _sorted_median(ordered, 0, n)
         )
-        results['quality_flags']['stable_readings'] = (
-            results['overall_confidence'] >= 0.7
+
+        safe_n = np.maximum(n, 1)
+        mean = np.where(cleaned, samples, 0.0).sum(axis=-1) / safe_n
+        variance = np.where(cleaned, (samples - mean[..., np.newaxis]) ** 2, 0.0).sum(axis=-1) / safe_n
+        variance = np.where(n > 1, variance, 0.0)
+
+        # Row allocation, Kalman update, stability and history append as one step
+        with self._history_lock:
+            # Step 3: Apply exponential or Kalman smoothing
+            posterior_variance = None
+            if self.smoothing == 'kalman':
+                rows = np.array([self._initialize_miner_state(miner_id) for miner_id in miner_ids], dtype=int)
+                smoothed, posterior_variance = self._kalman_update(
+                    rows, current_median, self._measurement_variance(variance, n), present
+                )
+            elif previous_smoothed is None:
+                smoothed = current_median
+            else:
+                previous_smoothed = np.asarray(previous_smoothed, dtype=float)
+                smoothed = np.where(
+                    np.isnan(previous_smoothed),
+                    current_median,
+                    self.alpha * current_median + (1 - self.alpha) * previous_smoothed
+                )
+
+            # Step 4: Calculate confidence (same components and weights as
+            # _calculate_beacon_confidence)
+            rssi_range = np.where(
+                n > 1,
+                np.where(cleaned, samples, -np.inf).max(axis=-1) - np.where(cleaned, samples, np.inf).min(axis=-1),
+                0.0
+            )
+            stability = self._stability_batch(miner_ids, _sorted_median(ordered, 0, n), present)
+
+            if posterior_variance is None:
+                var_confidence = np.maximum(0.0, 1.0 - variance / 100.0)
+            else:
+                var_confidence = np.maximum(0.0, 1.0 - posterior_variance / KALMAN_CONFIDENCE_VARIANCE)
+            weights = CONFIDENCE_WEIGHTS
+            confidence = (
+                np.minimum(1.0, n / 20.0) * weights['count'] +
+                var_confidence * weights['variance'] +
+                np.maximum(0.0, 1.0 - rssi_range / 40.0) * weights['range'] +
+                stability * weights['stability']
+            )
+            confidence = np.where(n < self.min_samples, confidence * 0.5, confidence)
+            confidence = np.where(present, np.clip(confidence, 0.0, 1.0), 0.0)
+
+            self._append_history_batch(miner_ids, smoothed, present)
+
+        # Overall metrics over beacons above the minimum threshold
+        counted = present & (confidence > 0.3)
+        coverage = counted.sum(axis=-1)
+        overall = np.where(counted, confidence, 0.0).sum(axis=-1) / np.maximum(coverage, 1)
+        overall = _round(np.where(coverage > 0, overall, 0.0), 3)
+
+        status = np.select(
+            [(coverage >= 2) & (overall >= 0.7), (coverage >= 2) & (overall >= 0.5), coverage >= 1],
+            ['HIGH_CONFIDENCE', 'MEDIUM_CONFIDENCE', 'LOW_CONFIDENCE'],
+            default='NO_VALID_DATA'
         )
-        results['quality_flags']['beacon_coverage'] = valid_beacon_count
-
-        # Determine overall status
-        if valid_beacon_count >= 2 and results['overall_confidence'] >= 0.7:
-            results['status'] = 'HIGH_CONFIDENCE'
-        elif valid_beacon_count >= 2 and results['overall_confidence'] >= 0.5:
-            results['status'] = 'MEDIUM_CONFIDENCE'
-        elif valid_beacon_count >= 1:
-            results['status'] = 'LOW_CONFIDENCE'
-        else:
-            results['status'] = 'NO_VALID_DATA'
 
+        batch = {
+            'miner_ids': list(miner_ids),
+            'beacon_ids': list(self.beacon_ids),
+            'processed_rssi': np.where(present, _round(smoothed, 1), -100.0),
+            'beacon_confidence': _round(confidence, 3),
+            'sample_count': n,
+            'variance': variance,
+            'range': rssi_range,
+            'stability': stability,
+            'overall_confidence': overall,
+            'beacon_coverage': coverage,
+            'sufficient_samples': (n_raw >= self.min_samples).all(axis=-1),
+            'status': status
+        }
+        if posterior_variance is not None:
+            batch['posterior_variance'] = posterior_variance
+        return batch
+
+    def batch_miner_result(self, batch, row):
+        """One miner of a process_batch result in the process_miner_rssi format."""
+        results = LazyResult({
+            'miner_id': batch['miner_ids'][row],
+            'processed_rssi': {},
+            'beacon_confidence': {},
+            'overall_confidence': float(batch['overall_confidence'][row]),
+            'quality_flags': {
+                'sufficient_samples': bool(batch['sufficient_samples'][row]),
+                'stable_readings': bool(batch['overall_confidence'][row] >= 0.7),
+                'beacon_coverage': int(batch['beacon_coverage'][row])
+            },
+            'timestamp': None,  # To be set by caller
+            'status': str(batch['status'][row])
+        })
+
+        processed_rssi = batch['processed_rssi'][row].tolist()
+        beacon_confidence = batch['beacon_confidence'][row].tolist()
+        for col, beacon_id in enumerate(batch['beacon_ids']):
+            results['processed_rssi'][beacon_id] = processed_rssi[col]
+            results['beacon_confidence'][beacon_id] = beacon_confidence[col]
+
+        results.defer('beacon_diagnostics', lambda: self._batch_diagnostics(batch, row),
+                      VERBOSE_DIAGNOSTICS, self.verbose)
         return results
 
+    def _batch_diagnostics(self, batch, row):
+        """beacon_diagnostics of one process_batch row."""
+        diagnostics_inputs = {}
+        for col, beacon_id in enumerate(batch['beacon_ids']):
+            sample_count = int(batch['sample_count'][row, col])
+            if sample_count == 0:
+                diagnostics_inputs[beacon_id] = None
+                continue
+
+            variance = float(batch['variance'][row, col])
+            posterior_variance = None
+            if 'posterior_variance' in batch:
+                posterior_variance = float(batch['posterior_variance'][row, col])
+                var_confidence = max(0.0, 1.0 - posterior_variance / KALMAN_CONFIDENCE_VARIANCE)
+            else:
+                var_confidence = max(0.0, 1.0 - variance / 100.0)
+            diagnostics_inputs[beacon_id] = (
+                sample_count, variance, float(batch['range'][row, col]),
+                float(batch['stability'][row, col]), var_confidence, posterior_variance
+            )
+        return self._diagnostics_factory(diagnostics_inputs)()
+
+    def _stability_batch(self, miner_ids, current_median, present):
+        """_calculate_stability_confidence for every (miner, beacon) at once."""
+        rows = np.array([self._history_rows.get(miner_id, -1) for miner_id in miner_ids], dtype=int)
+        known = rows >= 0
+        cols = np.arange(len(self.beacon_ids))
+
+        recent_avg = np.zeros(current_median.shape)
+        history_length = np.zeros(current_median.shape, dtype=int)
+        if known.any():
+            values, filled = self._recent_history(rows[known][:, np.newaxis], cols, min(3, self.max_history))
+            recent_avg[known] = np.where(filled, values, 0.0).sum(axis=-1) / np.maximum(filled.sum(axis=-1), 1)
+            history_length[known] = self._history_length[rows[known]]
+
+        deviation = np.abs(current_median - recent_avg)
+        stability = np.select([deviation < 5, deviation < 10, deviation < 15], [1.0, 0.7, 0.4], default=0.2)
+        return np.where(present & (history_length >= 2), stability, 1.0)
+
+    def _append_history_batch(self, miner_ids, smoothed, present):
+        """Record each miner's new smoothed values, as process_miner_rssi does."""
+        rows = np.array([self._initialize_miner_state(miner_id) for miner_id in miner_ids], dtype=int)
+        miner_index, cols = np.nonzero(present)
+        self._append_history(rows[miner_index], cols, smoothed[miner_index, cols])
+
     def reset_miner_history(self, miner_id):
         """Reset history for a specific miner."""
-        if miner_id in self.state_history:
-            for beacon_id in ['B1', 'B2', 'B3']:
-                self.state_history[miner_id][beacon_id]['values'].clear()
-                self.state_history[miner_id][beacon_id]['stability'] = 1.0
+        with self._history_lock:
+            row = self._history_rows.get(miner_id)
+            if row is not None:
+                self._history_cursor[row] = 0
+                self._history_length[row] = 0
+                self._kalman_mean[row] = np.nan
+                self._kalman_var[row] = np.nan
+
+    def forget_miner(self, miner_id):
+        """
+        Drop all state of a miner (history row and stream windows), e.g. when
+        MinerStateManager evicts it. The history row is reused by the next new miner.
+        """
+        with self._history_lock:
+            row = self._history_rows.pop(miner_id, None)
+            if row is not None:
+                self._history_cursor[row] = 0
+                self._history_length[row] = 0
+                self._kalman_mean[row] = np.nan
+                self._kalman_var[row] = np.nan
+                self._free_history_rows.append(row)
+        self.reset_stream(miner_id)
+
+    def tracked_miners(self):
+        """Miner IDs the preprocessor currently holds state for."""
+        with self._stream_lock:
+            streamed = list(self._streams)
+        with self._history_lock:
+            return set(self._history_rows).union(streamed)
 
     def get_miner_statistics(self, miner_id):
 
-        if miner_id not in self.state_history:
+        if miner_id not in self._history_rows:
             return None
 
         stats = {}
-        for beacon_id in ['B1', 'B2', 'B3']:
-            values = list(self.state_history[miner_id][beacon_id]['values'])
-            if values:
+        for beacon_id in self.beacon_ids:
+            values = self._history_values(miner_id, beacon_id)
+            if len(values):
                 stats[beacon_id] = {
                     'history_length': len(values),
-                    'mean': round(float(np.mean(values)), 1),
-                    'std': round(float(np.std(values)), 2) if len(values) > 1 else 0.0,
+                    'mean': round(float(np.mean(values, dtype=np.float64)), 1),
+                    'std': round(float(np.std(values, dtype=np.float64)), 2) if len(values) > 1 else 0.0,
                     'trend': self._calculate_trend(values),
-                    'latest': values[-1] if values else None
+                    'latest': round(float(values[-1]), 2)
                 }
             else:
                 stats[beacon_id] = {'history_length': 0, 'mean': None, 'std': None, 'trend': None}
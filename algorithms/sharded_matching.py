@@ -0,0 +1,298 @@
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from algorithms.fingerprint_matching import BATCH_CHUNK_ELEMENTS, RadioMapEngine
+
+# Below this many cells per shard, process hand-off costs more than it saves
+MIN_SHARD_CELLS = 5000
+
+# Engine tables copied into shared memory (everything log_likelihood reads)
+SHARED_ARRAYS = ('mean', 'std', 'valid', 'inv_std', 'log_norm')
+
+# Shared memory offsets are aligned to cache lines
+_ALIGNMENT = 64
+
+# Worker-side state: the attached segment and the shard engines built on it
+_worker_segment = {'name': None, 'shm': None, 'engines': {}}
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _shard_engine(layout, shard_index):
+    """Worker: RadioMapEngine over one shard's shared memory (no copies)."""
+    if _worker_segment['name'] != layout['name']:
+        if _worker_segment['shm'] is not None:
+            _worker_segment['shm'].close()
+        _worker_segment.update(name=None, shm=None, engines={})
+        _worker_segment['shm'] = shared_memory.SharedMemory(name=layout['name'])
+        _worker_segment['name'] = layout['name']
+
+    engine = _worker_segment['engines'].get(shard_index)
+    if engine is None:
+        shard = layout['shards'][shard_index]
+        shape = (shard['stop'] - shard['start'], len(layout['beacon_ids']))
+        arrays = {
+            name: np.ndarray(shape, dtype=dtype, buffer=_worker_segment['shm'].buf, offset=offset, order='F')
+            for name, (offset, dtype) in shard['arrays'].items()
+        }
+        engine = RadioMapEngine(
+            layout['beacon_ids'], None, None, arrays['mean'], arrays['std'], arrays['valid'],
+            inv_std=arrays['inv_std'], log_norm=arrays['log_norm']
+        )
+        _worker_segment['engines'][shard_index] = engine
+    return engine
+
+
+def _shard_candidates(scores, k):
+    """Indices of the k best scores plus any ties at the k-th place (unordered)."""
+    if k >= len(scores):
+        return np.arange(len(scores))
+    kth_score = scores[np.argpartition(-scores, k - 1)[k - 1]]
+    return np.flatnonzero(scores >= kth_score)
+
+
+def _score_shard(layout, shard_index, rssi_matrix, k):
+    """
+    Worker task: score a (miners x beacons) batch against one shard.
+
+    Returns:
+    One partial per miner: (max, sum of exp(ll - max), sum of
+    exp(ll - max) * (ll - max), candidate rows, candidate log-likelihoods),
+    enough for the parent to rebuild normalization, entropy and top-k exactly.
+    """
+    engine = _shard_engine(layout, shard_index)
+    start = layout['shards'][shard_index]['start']
+
+    # Same bound on the (miners x cells x beacons) intermediate as the matcher
+    chunk_size = max(1, BATCH_CHUNK_ELEMENTS // max(1, engine.mean.size))
+
+    partials = []
+    for chunk_start in range(0, len(rssi_matrix), chunk_size):
+        for log_likelihood in engine.log_likelihood(rssi_matrix[chunk_start:chunk_start + chunk_size]):
+            peak = float(log_likelihood.max())
+            shifted = log_likelihood - peak
+            weights = np.exp(shifted)
+            candidates = _shard_candidates(shifted, k)
+            partials.append((
+                peak, float(weights.sum()), float(np.dot(weights, shifted)),
+                candidates + start, log_likelihood[candidates]
+            ))
+    return partials
+
+
+class ShardedMatcher:
+    def __init__(self, matcher, n_workers=None, min_shard_cells=MIN_SHARD_CELLS, mp_context=None):
+        """
+        Multi-core global search for very large radio maps.
+
+        The matcher's scoring tables are copied once into shared memory,
+        partitioned by cell rows into one shard per worker process. Each
+        global search scores all shards in parallel; workers return their
+        partial log-sum-exp, weighted log-likelihood sum and top-k, and the
+        parent reduces them into the same result dict FingerprintMatcher
+        builds. Pruned searches, caching and result formatting are the
+        wrapped matcher's own.
+
+        Parameters:
+        - matcher: FingerprintMatcher in 'naive_bayes' mode
+        - n_workers: Worker processes / shards (default: os.cpu_count())
+        - min_shard_cells: Maps with fewer cells per shard are scored in-process
+        - mp_context: Optional multiprocessing context for the process pool
+        """
+        if matcher.match_mode != 'naive_bayes':
+            raise ValueError("ShardedMatcher requires match_mode 'naive_bayes'")
+
+        self.matcher = matcher
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.min_shard_cells = min_shard_cells
+        self._executor = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=mp_context)
+
+        # Published segments; the previous one stays alive for in-flight tasks
+        self._publish_lock = threading.Lock()
+        self._published = None
+        self._retired = None
+
+    @property
+    def beacon_ids(self):
+        return self.matcher.beacon_ids
+
+    def forget_miner(self, miner_id):
+        """Per-miner state lives in the wrapped matcher."""
+        self.matcher.forget_miner(miner_id)
+
+    def close(self):
+        """Stop the worker processes and release the shared memory."""
+        self._executor.shutdown(wait=True)
+        with self._publish_lock:
+            for published in (self._published, self._retired):
+                if published is not None:
+                    published['shm'].close()
+                    published['shm'].unlink()
+            self._published = self._retired = None
+
+    def _layout(self, engine):
+        """Shared memory layout for engine, publishing it on first use or after a reload."""
+        with self._publish_lock:
+            if self._published is not None and self._published['version'] == engine.version:
+                return self._published['layout']
+
+            bounds = np.linspace(0, engine.n_cells, self.n_workers + 1).astype(int)
+            shards, offset = [], 0
+            for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                arrays = {}
+                for name in SHARED_ARRAYS:
+                    table = getattr(engine, name)
+                    arrays[name] = (offset, table.dtype.str)
+                    offset = _aligned(offset + (stop - start) * table.shape[1] * table.itemsize)
+                shards.append({'start': start, 'stop': stop, 'arrays': arrays})
+
+            shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+            for shard in shards:
+                rows = slice(shard['start'], shard['stop'])
+                for name, (array_offset, dtype) in shard['arrays'].items():
+                    table = getattr(engine, name)
+                    target = np.ndarray((shard['stop'] - shard['start'], table.shape[1]), dtype=dtype,
+                                        buffer=shm.buf, offset=array_offset, order='F')
+                    target[:] = table[rows]
+
+            layout = {'name': shm.name, 'beacon_ids': list(engine.beacon_ids), 'shards': shards}
+
+            if self._retired is not None:
+                self._retired['shm'].close()
+                self._retired['shm'].unlink()
+            self._retired = self._published
+            self._published = {'version': engine.version, 'layout': layout, 'shm': shm}
+            return layout
+
+    def _sharded(self, engine):
+        return engine.n_cells >= self.min_shard_cells * max(2, self.n_workers)
+
+    def locate_miner(self, processed_rssi, miner_id=None, previous_state=None, now=None, deadline=None):
+        """
+        Same contract as FingerprintMatcher.locate_miner; global searches on
+        large maps are spread over the worker processes.
+
+        deadline is accepted for interface compatibility (a sharded scan is
+        not interrupted).
+        """
+        matcher = self.matcher
+        engine = matcher.engine
+        if not self._sharded(engine):
+            return matcher.locate_miner(processed_rssi, miner_id=miner_id, previous_state=previous_state,
+                                        now=now, deadline=deadline)
+
+        valid_beacons, error = matcher._validate_rssi_input(processed_rssi, engine)
+        if error:
+            return error
+
+        rssi_values = engine.rssi_array(processed_rssi)
+        start = matcher._pruning_start(previous_state, now)
+
+        cache_key = matcher._cache_key(engine, rssi_values, start)
+        cached = matcher._cache_get(cache_key, miner_id)
+        if cached is not None:
+            return cached
+
+        # Neighbourhood of the last fix is small, score it in-process
+        rows = matcher._pruned_rows(engine, start)
+        if rows is not None:
+            log_likelihood = matcher._log_likelihood(engine, rssi_values, rows=rows)
+            result = matcher._build_result(engine, log_likelihood, valid_beacons, miner_id, rows=rows)
+            if result['valid'] and result['confidence'] >= matcher.widen_confidence:
+                result['metrics']['search'] = 'pruned'
+                result['metrics']['cells_scored'] = len(rows)
+                matcher._cache_put(cache_key, result)
+                return result
+
+        result = self._locate_global(engine, rssi_values[np.newaxis], [valid_beacons], [miner_id])[0]
+        matcher._cache_put(cache_key, result)
+        return result
+
+    def locate_miners_batch(self, rssi_list, miner_ids=None, deadline=None):
+        """
+        Same contract as FingerprintMatcher.locate_miners_batch; each worker
+        scores the whole batch against its shard.
+        """
+        matcher = self.matcher
+        engine = matcher.engine
+        if not self._sharded(engine):
+            return matcher.locate_miners_batch(rssi_list, miner_ids=miner_ids, deadline=deadline)
+
+        if miner_ids is None:
+            miner_ids = [None] * len(rssi_list)
+
+        results = [None] * len(rssi_list)
+        uncached = []
+        for i, processed_rssi in enumerate(rssi_list):
+            valid_beacons, error = matcher._validate_rssi_input(processed_rssi, engine)
+            if error:
+                results[i] = error
+                continue
+            rssi_values = engine.rssi_array(processed_rssi)
+            cache_key = matcher._cache_key(engine, rssi_values)
+            cached = matcher._cache_get(cache_key, miner_ids[i])
+            if cached is not None:
+                results[i] = cached
+            else:
+                uncached.append((i, valid_beacons, rssi_values, cache_key))
+
+        if uncached:
+            scored = self._locate_global(
+                engine,
+                np.array([rssi_values for _, _, rssi_values, _ in uncached]),
+                [valid_beacons for _, valid_beacons, _, _ in uncached],
+                [miner_ids[i] for i, _, _, _ in uncached]
+            )
+            for (i, _, _, cache_key), result in zip(uncached, scored):
+                results[i] = result
+                matcher._cache_put(cache_key, result)
+        return results
+
+    def _locate_global(self, engine, rssi_matrix, valid_beacons_list, miner_ids):
+        """Score every cell across the shards and reduce into result dicts."""
+        matcher = self.matcher
+        layout = self._layout(engine)
+        k = max(matcher.top_k, 2)
+
+        futures = [
+            self._executor.submit(_score_shard, layout, shard_index, rssi_matrix, k)
+            for shard_index in range(len(layout['shards']))
+        ]
+        partials = [future.result() for future in futures]
+
+        max_entropy = math.log2(engine.n_cells)
+        results = []
+        for m, (valid_beacons, miner_id) in enumerate(zip(valid_beacons_list, miner_ids)):
+            peaks, sums, weighted, rows, scores = zip(*(shard[m] for shard in partials))
+
+            # Rescale every shard's partial sums to the global maximum
+            peak = max(peaks)
+            scale = np.exp(np.array(peaks) - peak)
+            total = float(np.dot(scale, sums))
+            weighted_shifted = float(np.dot(scale, np.array(weighted) + (np.array(peaks) - peak) * np.array(sums)))
+
+            # Merge shard candidates; ties keep map order like _top_k_indices
+            rows = np.concatenate(rows)
+            scores = np.concatenate(scores)
+            order = np.lexsort((rows, -scores))[:k]
+            ranked = rows[order]
+            top_probs = np.exp(scores[order] - peak) / total
+
+            entropy = max((math.log(total) - weighted_shifted / total) / math.log(2), 0.0)
+            uncertainty = entropy / max_entropy if max_entropy > 0 else 0.0
+
+            result = matcher._format_result(engine, ranked, top_probs, uncertainty, valid_beacons, miner_id)
+            if result['location'] is not None:
+                if matcher.maze_data is not None:
+                    result['metrics']['search'] = 'global'
+                    result['metrics']['cells_scored'] = engine.n_cells
+                result['metrics']['shards'] = len(layout['shards'])
+            results.append(result)
+        return results
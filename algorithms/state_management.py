@@ -1,12 +1,38 @@
+import threading
+import time
+from collections import OrderedDict
+
+
 class MinerStateManager:
-    def __init__(self, expected_miner_ids=None):
+    def __init__(self, expected_miner_ids=None, max_tracked=None, idle_ttl=None):
         """
         Initialize state manager.
         expected_miner_ids: Optional list of expected miner IDs (M01-M05)
         If None, miners will be added dynamically as they are discovered.
+        max_tracked: Optional limit on tracked miners; beyond it the least
+        recently updated discovered miner is evicted
+        idle_ttl: Optional seconds without updates after which evict_idle()
+        drops a discovered miner
+        Expected miners are never evicted. Listeners registered with
+        add_eviction_listener(callback) are called as callback(miner_id, reason)
+        so other components can drop their per-miner state too.
         """
+        if max_tracked is not None and max_tracked < 1:
+            raise ValueError(f"max_tracked must be at least 1, got {max_tracked}")
+        if idle_ttl is not None and idle_ttl <= 0:
+            raise ValueError(f"idle_ttl must be positive, got {idle_ttl}")
+
         self.miner_states = {}  # Dict: miner_id -> MinerState
         self.expected_miners = expected_miner_ids or []
+        self.max_tracked = max_tracked
+        self.idle_ttl = idle_ttl
+
+        # Discovered miners by last update, least recently used first
+        self._last_seen = OrderedDict()
+        self._eviction_lock = threading.Lock()
+        self._eviction_listeners = []
+        self.eviction_stats = {'lru': 0, 'idle': 0, 'removed': 0}
+
         self.initialize_expected_miners()
 
     def initialize_expected_miners(self):
@@ -15,25 +41,106 @@ class MinerStateManager:
             self.add_miner(miner_id)
 
     def add_miner(self, miner_id):
-        """Add a new miner with default state."""
-        if miner_id not in self.miner_states:
-            self.miner_states[miner_id] = {
-                'miner_id': miner_id,
-                'current_location': None,  # (x, y)
-                'previous_location': None,  # (x, y)
-                'smoothed_rssi': {},  # beacon_id -> smoothed RSSI value
-                'confidence': 0.0,
-                'last_update_timestamp': None,
-                'movement_history': [],  # List of (x, y, timestamp)
-                'status': 'INACTIVE',  # INACTIVE, ACTIVE, ERROR, OFFLINE
-                'last_confidence': 0.0,
-                'consecutive_low_confidence': 0,
-                'estimated_orientation': 'N',  # Track facing direction
-                'instruction_queue': [],  # Commands to execute
-                'last_instruction_index': 0,
-                'cycle_count': 0,
-                'total_samples': 0
-            }
+        """
+        Add a new miner with default state and mark it as just updated.
+        Lookup, insertion and the LRU update happen under the eviction lock,
+        so evict_idle() can't drop the miner in between.
+        Returns the miner's state dict.
+        """
+        evicted = []
+        with self._eviction_lock:
+            state = self.miner_states.get(miner_id)
+            if state is None:
+                state = self.miner_states[miner_id] = self._default_state(miner_id)
+            if miner_id not in self.expected_miners:
+                evicted = self._touch_locked(miner_id)
+
+        self._notify_evicted(evicted, 'lru')
+        return state
+
+    def _default_state(self, miner_id):
+        """Fresh state dict for a miner."""
+        return {
+            'miner_id': miner_id,
+            'current_location': None,  # (x, y)
+            'previous_location': None,  # (x, y)
+            'smoothed_rssi': {},  # beacon_id -> smoothed RSSI value
+            'confidence': 0.0,
+            'last_update_timestamp': None,
+            'movement_history': [],  # List of (x, y, timestamp)
+            'status': 'INACTIVE',  # INACTIVE, ACTIVE, ERROR, OFFLINE
+            'last_confidence': 0.0,
+            'consecutive_low_confidence': 0,
+            'estimated_orientation': 'N',  # Track facing direction
+            'instruction_queue': [],  # Commands to execute
+            'last_instruction_index': 0,
+            'cycle_count': 0,
+            'total_samples': 0
+        }
+
+    def add_eviction_listener(self, callback):
+        """Call callback(miner_id, reason) whenever a miner is evicted ('lru', 'idle' or 'removed')."""
+        self._eviction_listeners.append(callback)
+
+    def _touch_locked(self, miner_id, now=None):
+        """
+        Mark a discovered miner as just updated and evict LRU miners beyond
+        max_tracked. Caller holds _eviction_lock. Returns evicted miner IDs.
+        """
+        self._last_seen[miner_id] = time.time() if now is None else now
+        self._last_seen.move_to_end(miner_id)
+
+        # The miner being touched is always kept
+        evicted = []
+        if self.max_tracked is not None:
+            while len(self.miner_states) > self.max_tracked and len(self._last_seen) > 1:
+                evicted_id, _ = self._last_seen.popitem(last=False)
+                self.miner_states.pop(evicted_id, None)
+                evicted.append(evicted_id)
+        return evicted
+
+    def _notify_evicted(self, miner_ids, reason):
+        self.eviction_stats[reason] += len(miner_ids)
+        for miner_id in miner_ids:
+            for callback in self._eviction_listeners:
+                callback(miner_id, reason)
+
+    def evict_idle(self, now=None):
+        """
+        Evict discovered miners not updated for idle_ttl seconds.
+        Returns list of evicted miner IDs.
+        """
+        if self.idle_ttl is None:
+            return []
+
+        cutoff = (time.time() if now is None else now) - self.idle_ttl
+        evicted = []
+        with self._eviction_lock:
+            # Oldest first, so stop at the first miner still within the TTL
+            while self._last_seen:
+                miner_id, last_seen = next(iter(self._last_seen.items()))
+                if last_seen > cutoff:
+                    break
+                self._last_seen.popitem(last=False)
+                self.miner_states.pop(miner_id, None)
+                evicted.append(miner_id)
+
+        self._notify_evicted(evicted, 'idle')
+        return evicted
+
+    def remove_miner(self, miner_id):
+        """Drop a miner's state and notify eviction listeners."""
+        with self._eviction_lock:
+            if self.miner_states.pop(miner_id, None) is None:
+                return False
+            self._last_seen.pop(miner_id, None)
+
+        self._notify_evicted([miner_id], 'removed')
+        return True
+
+    def touch_miner(self, miner_id):
+        """Record activity from a miner (adding it if new) without changing its state."""
+        self.add_miner(miner_id)
 
     def update_miner_location(self, miner_id, new_location, confidence, timestamp):
         """
@@ -42,10 +149,7 @@ class MinerStateManager:
         confidence: 0.0-1.0
         timestamp: current time
         """
-        if miner_id not in self.miner_states:
-            self.add_miner(miner_id)
-
-        state = self.miner_states[miner_id]
+        state = self.add_miner(miner_id)
 
         # Store previous location
         state['previous_location'] = state['current_location']
@@ -73,10 +177,7 @@ class MinerStateManager:
 
     def update_smoothed_rssi(self, miner_id, beacon_id, smoothed_value):
         """Update smoothed RSSI value for a specific beacon."""
-        if miner_id not in self.miner_states:
-            self.add_miner(miner_id)
-
-        self.miner_states[miner_id]['smoothed_rssi'][beacon_id] = smoothed_value
+        self.add_miner(miner_id)['smoothed_rssi'][beacon_id] = smoothed_value
 
     def update_orientation(self, miner_id, new_orientation):
         """Update miner's estimated facing direction."""
@@ -110,10 +211,18 @@ class MinerStateManager:
         """Get complete state for a miner."""
         return self.miner_states.get(miner_id)
 
+    def _snapshot(self):
+        """
+        List of (miner_id, state) pairs taken under the eviction lock, so
+        readers can iterate while other threads add or evict miners.
+        """
+        with self._eviction_lock:
+            return list(self.miner_states.items())
+
     def get_active_miners(self):
         """Get list of miners with ACTIVE status."""
         active = []
-        for miner_id, state in self.miner_states.items():
+        for miner_id, state in self._snapshot():
             if state['status'] == 'ACTIVE':
                 active.append(miner_id)
         return active
@@ -121,7 +230,7 @@ class MinerStateManager:
     def get_inactive_miners(self):
         """Get list of miners with INACTIVE status."""
         inactive = []
-        for miner_id, state in self.miner_states.items():
+        for miner_id, state in self._snapshot():
             if state['status'] == 'INACTIVE':
                 inactive.append(miner_id)
         return inactive
@@ -164,7 +273,7 @@ class MinerStateManager:
         Returns list of miner data dictionaries.
         """
         azure_data = []
-        for miner_id, state in self.miner_states.items():
+        for miner_id, state in self._snapshot():
             if state['current_location'] is not None and state['status'] == 'ACTIVE':
                 miner_data = {
                     'id': miner_id,
@@ -194,13 +303,12 @@ class MinerStateManager:
 
     def calculate_average_confidence(self):
         """Calculate average confidence across all active miners."""
-        active = self.get_active_miners()
+        active = [state for _, state in self._snapshot() if state['status'] == 'ACTIVE']
         if not active:
             return 0.0
 
         total = 0.0
-        for miner_id in active:
-            state = self.miner_states[miner_id]
+        for state in active:
             total += state['confidence']
 
         return total / len(active)
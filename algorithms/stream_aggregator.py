@@ -0,0 +1,219 @@
+"""
+Time-windowed aggregation between packet ingest and RSSI preprocessing.
+
+StreamAggregator buffers BLE packets per miner and, once a tumbling or
+sliding window closes, emits one consolidated raw_samples dict per miner,
+ready for RSSIPreprocessor.pack_samples / process_batch. Preprocessing and
+localization then run once per window instead of once per packet.
+
+    aggregator = StreamAggregator(window=3.0)
+    aggregator.add(miner_id, ble_readings, payload=message)   # ingest threads
+    for window in aggregator.windows():                       # worker thread
+        batch = preprocessor.process_batch(*preprocessor.pack_samples(window['raw_samples']))
+"""
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+
+WINDOW_MODES = ('tumbling', 'sliding')
+LATE_POLICIES = ('drop', 'next')
+
+
+class StreamAggregator:
+    def __init__(self, window=3.0, mode='tumbling', slide=None, allowed_lateness=0.0,
+                 late_policy='drop', beacon_ids=None, clock=time.time):
+        """
+        Per-miner packet buffer closed into time windows.
+
+        Windows [start, start + window) start on multiples of the slide and
+        are shared by all miners. A window closes once the clock passes its
+        end plus allowed_lateness. A packet stamped before the oldest open
+        window is late.
+
+        Parameters:
+        - window: Window length in seconds
+        - mode: 'tumbling' (back-to-back windows) or 'sliding' (overlapping
+          windows, a new one every slide seconds)
+        - slide: Seconds between sliding window starts (default: window / 2)
+        - allowed_lateness: Seconds a window stays open past its end for
+          delayed packets
+        - late_policy: 'drop' late packets, or fold them into the 'next' open window
+        - beacon_ids: Beacons kept in raw_samples, all present as keys
+          (default: every beacon heard)
+        - clock: Time source for arrival stamps and window closing
+        """
+        if window <= 0:
+            raise ValueError(f"window must be positive, got {window}")
+        if mode not in WINDOW_MODES:
+            raise ValueError(f"mode must be one of {WINDOW_MODES}, got {mode!r}")
+        if late_policy not in LATE_POLICIES:
+            raise ValueError(f"late_policy must be one of {LATE_POLICIES}, got {late_policy!r}")
+        if mode == 'sliding':
+            slide = window / 2.0 if slide is None else slide
+            if not 0 < slide <= window:
+                raise ValueError(f"slide must be in (0, window], got {slide}")
+        else:
+            slide = window
+        if allowed_lateness < 0:
+            raise ValueError(f"allowed_lateness must be >= 0, got {allowed_lateness}")
+
+        self.window = window
+        self.mode = mode
+        self.slide = slide
+        self.allowed_lateness = allowed_lateness
+        self.late_policy = late_policy
+        self.beacon_ids = list(beacon_ids) if beacon_ids else None
+        self.clock = clock
+
+        # miner_id -> deque of (timestamp, ble_readings, payload), arrival order
+        self._packets = {}
+        # Oldest open window starts at _next_index * slide (None: no packet yet)
+        self._next_index = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.stats = {'packets': 0, 'late_dropped': 0, 'late_reassigned': 0, 'windows': 0}
+
+    def _window_start(self, index):
+        return index * self.slide
+
+    def add(self, miner_id, ble_readings, timestamp=None, payload=None):
+        """
+        Buffer one packet.
+
+        Parameters:
+        - miner_id: Miner that sent the packet
+        - ble_readings: Dict of beacon_id -> rssi_value or beacon_id -> [rssi_values]
+        - timestamp: Packet time in clock units (default: arrival time)
+        - payload: Optional object passed through with the window (e.g. the
+          parsed message, for IMU data); the latest one per miner is kept
+
+        Returns: True if buffered, False if dropped as late
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        with self._lock:
+            self.stats['packets'] += 1
+            if self._next_index is None:
+                self._next_index = math.floor(timestamp / self.slide)
+
+            open_start = self._window_start(self._next_index)
+            if timestamp < open_start:
+                if self.late_policy == 'drop':
+                    self.stats['late_dropped'] += 1
+                    return False
+                self.stats['late_reassigned'] += 1
+                timestamp = open_start
+
+            packets = self._packets.get(miner_id)
+            if packets is None:
+                packets = self._packets[miner_id] = deque()
+            packets.append((timestamp, ble_readings, payload))
+        return True
+
+    def _consolidate(self, packets):
+        """Merge packets into one {beacon_id: [rssi_values]} dict."""
+        raw_samples = {beacon_id: [] for beacon_id in self.beacon_ids} if self.beacon_ids else {}
+        for _, ble_readings, _ in packets:
+            for beacon_id, value in ble_readings.items():
+                if self.beacon_ids and beacon_id not in raw_samples:
+                    continue
+                values = raw_samples.setdefault(beacon_id, [])
+                if isinstance(value, (list, tuple)):
+                    values.extend(value)
+                else:
+                    values.append(value)
+        return raw_samples
+
+    def poll(self, now=None):
+        """
+        Close every window that has ended by now.
+
+        Returns:
+        List of windows, oldest first, each a dict: window_start, window_end,
+        raw_samples {miner_id: {beacon_id: [rssi_values]}}, packets
+        {miner_id: packet count} and payloads {miner_id: latest payload}.
+        Windows without packets are skipped.
+        """
+        now = self.clock() if now is None else now
+        closed = []
+        with self._lock:
+            if self._next_index is None:
+                return closed
+
+            while self._window_start(self._next_index) + self.window + self.allowed_lateness <= now:
+                start = self._window_start(self._next_index)
+                end = start + self.window
+
+                window = {'window_start': start, 'window_end': end, 'raw_samples': {}, 'packets': {}, 'payloads': {}}
+                for miner_id, packets in self._packets.items():
+                    in_window = [packet for packet in packets if start <= packet[0] < end]
+                    if in_window:
+                        window['raw_samples'][miner_id] = self._consolidate(in_window)
+                        window['packets'][miner_id] = len(in_window)
+                        window['payloads'][miner_id] = max(in_window, key=lambda packet: packet[0])[2]
+                if window['raw_samples']:
+                    closed.append(window)
+
+                # Drop packets no open window covers any more
+                self._next_index += 1
+                open_start = self._window_start(self._next_index)
+                for miner_id in list(self._packets):
+                    remaining = deque(packet for packet in self._packets[miner_id] if packet[0] >= open_start)
+                    if remaining:
+                        self._packets[miner_id] = remaining
+                    else:
+                        del self._packets[miner_id]
+
+                if not self._packets:
+                    # Nothing buffered: skip the empty windows up to now
+                    self._next_index = max(
+                        self._next_index,
+                        math.floor((now - self.window - self.allowed_lateness) / self.slide) + 1
+                    )
+
+            self.stats['windows'] += len(closed)
+        return closed
+
+    def flush(self):
+        """Close every window holding buffered packets, regardless of the clock."""
+        with self._lock:
+            stamps = [packet[0] for packets in self._packets.values() for packet in packets]
+        if not stamps:
+            return []
+        return self.poll(now=max(stamps) + self.window + self.allowed_lateness)
+
+    def _wait_time(self):
+        """Seconds until the oldest open window closes (at most one slide)."""
+        with self._lock:
+            if self._next_index is None:
+                return self.slide
+            close_time = self._window_start(self._next_index) + self.window + self.allowed_lateness
+        return min(max(close_time - self.clock(), 0.0), self.slide)
+
+    def close(self):
+        """Stop windows() / stream(); they flush what is buffered and return."""
+        self._stop.set()
+
+    def windows(self):
+        """
+        Blocking generator of closed windows (poll() entries) as they close.
+        Ends after close(), with the remaining packets flushed.
+        """
+        while not self._stop.is_set():
+            closed = self.poll()
+            if not closed:
+                self._stop.wait(self._wait_time())
+            yield from closed
+        yield from self.flush()
+
+    async def stream(self):
+        """windows() as an async generator for asyncio ingest loops."""
+        while not self._stop.is_set():
+            closed = self.poll()
+            if not closed:
+                await asyncio.sleep(self._wait_time())
+            for window in closed:
+                yield window
+        for window in self.flush():
+            yield window
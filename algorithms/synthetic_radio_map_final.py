@@ -92,7 +92,7 @@ def create_radio_map():
         "metadata": {
             "type": "simulated",
             "total_cells": len(cells),
-            "beacon_ids": ["B1", "B2", "B3"]
+            "beacon_ids": list(BEACON_POSITIONS.keys())
         }
     }
     
@@ -101,7 +101,7 @@ def create_radio_map():
     
     print(f"✅ Created radio map: {OUTPUT_FILE}")
     print(f"   Cells: {len(cells)}")
-    print(f"   Beacons: B1, B2, B3")
+    print(f"   Beacons: {', '.join(BEACON_POSITIONS)}")
 
 if __name__ == "__main__":
     create_radio_map()
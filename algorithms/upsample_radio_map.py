@@ -0,0 +1,231 @@
+"""
+Upsamples a surveyed radio map to a finer grid_resolution (0.5 m, 0.25 m, ...).
+Run after convert_radio_map.py:
+    python algorithms/upsample_radio_map.py [radio_map.json] [radio_map_fine.json] [resolution]
+
+Each beacon gets a log-distance path-loss model (the one synthetic_radio_map_final.py
+simulates), fitted by least squares to the surveyed cells:
+    mean_rssi = tx_power - 10 * path_loss * log10(max(d, MIN_DISTANCE))
+Lattice points inside surveyed cells get the model value plus the surveyed
+residuals interpolated by inverse distance weighting, so the field follows the
+survey, and surveyed cell centres (anchors) keep their measured stats exactly.
+
+Compile the result with compile_radio_map.py; FingerprintMatcher groups the
+finer cells by maze cell for pruning and tracking.
+"""
+import json
+import os
+import sys
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+if __name__ == "__main__":
+    # Run as python algorithms/upsample_radio_map.py: put the repo root on the path
+    # (imported as a module, sys.path is left alone)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from algorithms.compile_radio_map import RADIO_MAP_FILE, file_sha256, radio_map_beacon_ids
+
+# Configuration
+OUTPUT_FILE = os.path.join(os.path.dirname(__file__), "radio_map_fine.json")
+DEFAULT_RESOLUTION = 0.5
+
+MIN_DISTANCE = 0.5      # Same near-field clamp as synthetic_radio_map_final.py
+IDW_NEIGHBOURS = 4      # Surveyed cells blended per lattice point
+IDW_POWER = 2.0
+
+
+def _cell_id(x, y):
+    """Cell ID that keeps surveyed IDs ("3,4") and gives fine points "3.25,4.5"."""
+    return f"{x:g},{y:g}"
+
+
+def survey_arrays(radio_map, beacon_ids):
+    """Surveyed cells as arrays: xy (cells x 2), mean/std (cells x beacons) and valid mask."""
+    cells = list(radio_map['cells'].values())
+    xy = np.array([(cell['x'], cell['y']) for cell in cells], dtype=float).reshape(len(cells), 2)
+    mean = np.zeros((len(cells), len(beacon_ids)))
+    std = np.ones((len(cells), len(beacon_ids)))
+    valid = np.zeros((len(cells), len(beacon_ids)), dtype=bool)
+
+    for row, cell in enumerate(cells):
+        beacon_stats = cell.get('beacon_stats', {})
+        for col, beacon_id in enumerate(beacon_ids):
+            stats = beacon_stats.get(beacon_id)
+            if not stats or stats.get('mean') is None or stats.get('std') is None or stats['std'] <= 0:
+                continue
+            mean[row, col] = stats['mean']
+            std[row, col] = stats['std']
+            valid[row, col] = True
+
+    return xy, mean, std, valid
+
+
+def fit_path_loss(radio_map, beacon_ids=None):
+    """
+    Least-squares log-distance path-loss fit per beacon.
+
+    Parameters:
+    - radio_map: Radio map dict with beacon_positions and surveyed cells
+    - beacon_ids: Beacons to fit (default: the map's beacon set)
+
+    Returns:
+    Dict beacon_id -> {'tx_power', 'path_loss', 'rmse', 'cells'}; beacons
+    without a position or with fewer than 2 surveyed cells are left out.
+    """
+    beacon_ids = beacon_ids or radio_map_beacon_ids(radio_map)
+    xy, mean, _, valid = survey_arrays(radio_map, beacon_ids)
+    positions = radio_map.get('beacon_positions', {})
+
+    fits = {}
+    for col, beacon_id in enumerate(beacon_ids):
+        rows = np.flatnonzero(valid[:, col])
+        if beacon_id not in positions or len(rows) < 2:
+            continue
+
+        distance = np.maximum(np.hypot(*(xy[rows] - np.asarray(positions[beacon_id], dtype=float)).T), MIN_DISTANCE)
+        design = np.column_stack((np.ones(len(rows)), -10.0 * np.log10(distance)))
+        (tx_power, path_loss), *_ = np.linalg.lstsq(design, mean[rows, col], rcond=None)
+
+        residual = mean[rows, col] - design @ (tx_power, path_loss)
+        fits[beacon_id] = {
+            'tx_power': round(float(tx_power), 3),
+            'path_loss': round(float(path_loss), 3),
+            'rmse': round(float(np.sqrt(np.mean(residual ** 2))), 3),
+            'cells': int(len(rows))
+        }
+    return fits
+
+
+def _path_loss_rssi(points, beacon_position, fit):
+    distance = np.maximum(np.hypot(*(points - np.asarray(beacon_position, dtype=float)).T), MIN_DISTANCE)
+    return fit['tx_power'] - 10.0 * fit['path_loss'] * np.log10(distance)
+
+
+def upsample_radio_map(radio_map, resolution=DEFAULT_RESOLUTION,
+                       neighbours=IDW_NEIGHBOURS, idw_power=IDW_POWER):
+    """
+    Interpolated radio map on a resolution-spaced lattice inside the surveyed cells.
+
+    Every surveyed cell (x, y) is split into (1 / resolution)^2 points covering
+    [x - 0.5, x + 0.5), one of them its centre. The centre keeps the surveyed
+    stats; other points get path-loss model + IDW residual for the mean and
+    IDW of the surveyed std. A beacon is valid at a point if any blended
+    surveyed neighbour has stats for it.
+
+    Parameters:
+    - radio_map: Surveyed radio map dict (FingerprintMatcher format)
+    - resolution: Lattice spacing in grid units; must divide 1 (0.5, 0.25, ...)
+    - neighbours: Surveyed cells blended per point
+    - idw_power: Inverse distance weighting exponent
+
+    Returns:
+    New radio map dict with grid_resolution = resolution.
+    """
+    steps = int(round(1.0 / resolution))
+    if steps < 1 or not np.isclose(steps * resolution, 1.0):
+        raise ValueError(f"resolution must divide 1 (e.g. 0.5, 0.25), got {resolution}")
+
+    beacon_ids = radio_map_beacon_ids(radio_map)
+    xy, mean, std, valid = survey_arrays(radio_map, beacon_ids)
+    fits = fit_path_loss(radio_map, beacon_ids)
+    positions = radio_map.get('beacon_positions', {})
+    n_cells = len(xy)
+
+    # Lattice: every surveyed cell expanded by the same sub-cell offsets
+    offsets = -0.5 + np.arange(steps) * resolution
+    offset_grid = np.stack(np.meshgrid(offsets, offsets, indexing='ij'), axis=-1).reshape(-1, 2)
+    points = (xy[:, np.newaxis, :] + offset_grid[np.newaxis, :, :]).reshape(-1, 2)
+    parent = np.repeat(np.arange(n_cells), len(offset_grid))
+
+    # Path-loss prediction at surveyed cells and lattice points (NaN: no model)
+    model_cells = np.full((n_cells, len(beacon_ids)), np.nan)
+    model_points = np.full((len(points), len(beacon_ids)), np.nan)
+    for col, beacon_id in enumerate(beacon_ids):
+        if beacon_id in fits:
+            model_cells[:, col] = _path_loss_rssi(xy, positions[beacon_id], fits[beacon_id])
+            model_points[:, col] = _path_loss_rssi(points, positions[beacon_id], fits[beacon_id])
+    has_model = ~np.isnan(model_cells[0]) if n_cells else np.zeros(len(beacon_ids), dtype=bool)
+
+    # IDW over the nearest surveyed cells, per beacon only where they have stats
+    k = min(neighbours, n_cells)
+    distance, neighbour = cKDTree(xy).query(points, k=k)
+    distance = distance.reshape(len(points), k)
+    neighbour = neighbour.reshape(len(points), k)
+    weights = 1.0 / np.maximum(distance, 1e-9) ** idw_power
+    weights = weights[:, :, np.newaxis] * valid[neighbour]
+    weight_sum = weights.sum(axis=1)
+    point_valid = weight_sum > 0
+    weight_sum = np.where(point_valid, weight_sum, 1.0)
+
+    residual = np.where(has_model, mean - np.nan_to_num(model_cells), mean)
+    point_residual = (weights * residual[neighbour]).sum(axis=1) / weight_sum
+    point_mean = np.where(has_model, np.nan_to_num(model_points) + point_residual, point_residual)
+    point_std = (weights * std[neighbour]).sum(axis=1) / weight_sum
+
+    # Anchors: the centre point of each surveyed cell keeps its measured stats
+    anchor = np.all(np.isclose(points, xy[parent]), axis=1)
+    point_mean[anchor] = mean[parent[anchor]]
+    point_std[anchor] = std[parent[anchor]]
+    point_valid[anchor] = valid[parent[anchor]]
+
+    surveyed = list(radio_map['cells'].values())
+    cells = {}
+    for i, (x, y) in enumerate(points.tolist()):
+        beacon_stats = {}
+        for col in np.flatnonzero(point_valid[i]):
+            beacon_stats[beacon_ids[col]] = {
+                'mean': round(float(point_mean[i, col]), 2),
+                'std': round(float(point_std[i, col]), 2),
+                'samples': 0
+            }
+        if anchor[i]:
+            # Keep the surveyed entries (sample counts etc.) verbatim
+            beacon_stats = surveyed[parent[i]].get('beacon_stats', beacon_stats)
+
+        cell = {'x': x, 'y': y, 'beacon_stats': beacon_stats}
+        if not anchor[i]:
+            cell['interpolated'] = True
+        cells[_cell_id(x, y)] = cell
+
+    metadata = dict(radio_map.get('metadata', {}))
+    metadata.update({
+        'total_cells': len(cells),
+        'beacon_ids': beacon_ids,
+        'surveyed_cells': n_cells,
+        'path_loss_fit': fits
+    })
+    return {
+        'cells': cells,
+        'beacon_positions': radio_map['beacon_positions'],
+        'grid_resolution': resolution,
+        'coordinate_system': radio_map['coordinate_system'],
+        'metadata': metadata
+    }
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else RADIO_MAP_FILE
+    target = sys.argv[2] if len(sys.argv) > 2 else OUTPUT_FILE
+    resolution = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_RESOLUTION
+
+    if not os.path.exists(source):
+        print(f"❌ {source} not found")
+        sys.exit(1)
+
+    with open(source, 'r') as f:
+        surveyed_map = json.load(f)
+    if "cells" not in surveyed_map:
+        print("❌ Radio map not in FingerprintMatcher format, run convert_radio_map.py first")
+        sys.exit(1)
+
+    fine_map = upsample_radio_map(surveyed_map, resolution)
+    fine_map['metadata']['upsampled_from_sha256'] = file_sha256(source)
+    with open(target, 'w') as f:
+        json.dump(fine_map, f)
+
+    for beacon_id, fit in fine_map['metadata']['path_loss_fit'].items():
+        print(f"   {beacon_id}: tx_power={fit['tx_power']} dBm, n={fit['path_loss']}, rmse={fit['rmse']} dB")
+    print(f"✅ {len(surveyed_map['cells'])} surveyed cells -> {len(fine_map['cells'])} cells "
+          f"at {resolution} resolution -> {target}")
+    print(f"   Compile for the gateway: python algorithms/compile_radio_map.py {target}")
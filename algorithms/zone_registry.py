@@ -0,0 +1,366 @@
+"""
+Zoned radio maps for mines too large for one in-memory FingerprintMatcher.
+
+split_radio_map() cuts radio_map.json into per-zone compiled artifacts, each
+with its own beacon subset and cell range, plus a zone index (zones.json).
+ZoneRegistry routes each reading to a zone by its strongest beacons and loads
+zone matchers on demand behind a bounded LRU with memory accounting.
+
+Split a map (zones of 8x8 cells by default, or the cells' own "zone" key):
+    python algorithms/zone_registry.py [radio_map.json] [zones_dir] [zone_size]
+"""
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+if __name__ == "__main__":
+    # Run as python algorithms/zone_registry.py: put the repo root on the path
+    # (imported as a module, sys.path is left alone)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from algorithms.compile_radio_map import (
+    ARTIFACT_EXTENSION, RADIO_MAP_FILE, compile_radio_map, file_sha256, radio_map_beacon_ids
+)
+from algorithms.fingerprint_matching import MISSING_RSSI, FingerprintMatcher
+
+# Configuration
+ZONES_DIR = os.path.join(os.path.dirname(__file__), "zones")
+ZONE_INDEX_FILE = "zones.json"
+ZONE_SIZE = 8           # Zone edge in grid cells when cells carry no "zone" key
+ZONE_OVERLAP = 1        # Cells shared with neighbouring zones, for miners on a border
+ROUTE_BEACONS = 5       # Strongest beacons used to pick a zone
+ROUTE_MISSING_PENALTY = 30.0  # dB charged when a zone has no stats for a routing beacon
+
+
+def _usable_stats(stats):
+    return bool(stats) and stats.get('mean') is not None and stats.get('std') is not None and stats['std'] > 0
+
+
+def _home_zone(cell_data, zone_size):
+    """A cell's own "zone" key (e.g. mine level), else its zone_size block."""
+    if 'zone' in cell_data:
+        return str(cell_data['zone'])
+    return f"{int(cell_data['x'] // zone_size)}_{int(cell_data['y'] // zone_size)}"
+
+
+def _overlap_zones(cell_data, zone_size, overlap):
+    """Blocks within overlap cells of a cell (cells with a "zone" key don't overlap)."""
+    if 'zone' in cell_data or overlap <= 0:
+        return []
+
+    x, y = cell_data['x'], cell_data['y']
+    x_blocks = range(int((x - overlap) // zone_size), int((x + overlap) // zone_size) + 1)
+    y_blocks = range(int((y - overlap) // zone_size), int((y + overlap) // zone_size) + 1)
+    return [f"{bx}_{by}" for bx in x_blocks for by in y_blocks]
+
+
+def split_radio_map(radio_map_path=RADIO_MAP_FILE, output_dir=ZONES_DIR,
+                    zone_size=ZONE_SIZE, overlap=ZONE_OVERLAP):
+    """
+    Split a radio map into per-zone compiled artifacts and write the zone index.
+
+    Parameters:
+    - radio_map_path: Source radio_map.json (FingerprintMatcher format)
+    - output_dir: Directory for zone_<id>.rmap files and zones.json
+    - zone_size: Zone edge in grid cells (ignored for cells with a "zone" key,
+      e.g. a mine level)
+    - overlap: Cells within this distance of a zone are copied into it too
+
+    Returns:
+    Zone index dict (also written to output_dir/zones.json)
+    """
+    with open(radio_map_path, 'r') as f:
+        radio_map = json.load(f)
+
+    if "cells" not in radio_map:
+        raise ValueError("Radio map not in FingerprintMatcher format, run convert_radio_map.py first")
+
+    beacon_ids = radio_map_beacon_ids(radio_map)
+    zone_cells = {}
+    for cell_id, cell_data in radio_map['cells'].items():
+        zone_cells.setdefault(_home_zone(cell_data, zone_size), {})[cell_id] = cell_data
+
+    # Border cells are copied into neighbouring zones (never creating new zones)
+    for cell_id, cell_data in radio_map['cells'].items():
+        for zone_id in _overlap_zones(cell_data, zone_size, overlap):
+            if zone_id in zone_cells:
+                zone_cells[zone_id][cell_id] = cell_data
+
+    os.makedirs(output_dir, exist_ok=True)
+    index = {
+        'source_sha256': file_sha256(radio_map_path),
+        'zone_size': zone_size,
+        'overlap': overlap,
+        'beacon_ids': beacon_ids,
+        'zones': {}
+    }
+
+    for zone_id, cells in sorted(zone_cells.items()):
+        # Zone beacons: those with stats somewhere in the zone, in map order,
+        # with the range of mean RSSI they show across the zone (for routing)
+        ranges = {}
+        for cell_data in cells.values():
+            for beacon_id, stats in cell_data.get('beacon_stats', {}).items():
+                if _usable_stats(stats):
+                    low, high = ranges.get(beacon_id, (stats['mean'], stats['mean']))
+                    ranges[beacon_id] = (min(low, stats['mean']), max(high, stats['mean']))
+        zone_beacons = [b for b in beacon_ids if b in ranges]
+
+        zone_map = {
+            'cells': cells,
+            'beacon_positions': {
+                b: pos for b, pos in radio_map['beacon_positions'].items() if b in ranges
+            },
+            'grid_resolution': radio_map['grid_resolution'],
+            'coordinate_system': radio_map['coordinate_system'],
+            'metadata': dict(
+                radio_map.get('metadata', {}),
+                total_cells=len(cells), beacon_ids=zone_beacons, zone_id=zone_id
+            )
+        }
+
+        # Compile through a temporary JSON; only the artifact is kept
+        artifact_name = f"zone_{zone_id}{ARTIFACT_EXTENSION}"
+        zone_json = os.path.join(output_dir, f"zone_{zone_id}.json")
+        with open(zone_json, 'w') as f:
+            json.dump(zone_map, f)
+        try:
+            compile_radio_map(zone_json, os.path.join(output_dir, artifact_name))
+        finally:
+            os.remove(zone_json)
+
+        xs = [cell_data['x'] for cell_data in cells.values()]
+        ys = [cell_data['y'] for cell_data in cells.values()]
+        index['zones'][zone_id] = {
+            'artifact': artifact_name,
+            'beacon_ids': zone_beacons,
+            'beacon_ranges': {b: list(ranges[b]) for b in zone_beacons},
+            'n_cells': len(cells),
+            'bounds': [min(xs), min(ys), max(xs), max(ys)]
+        }
+
+    with open(os.path.join(output_dir, ZONE_INDEX_FILE), 'w') as f:
+        json.dump(index, f, indent=4)
+
+    return index
+
+
+def _engine_nbytes(matcher):
+    """Resident bytes of a matcher's scoring arrays (dense tables, lookup tables)."""
+    return sum(value.nbytes for value in vars(matcher.engine).values() if isinstance(value, np.ndarray))
+
+
+class ZoneRegistry:
+    def __init__(self, index_path, max_zones=4, max_bytes=64 * 2 ** 20,
+                 route_beacons=ROUTE_BEACONS, **matcher_kwargs):
+        """
+        Routes readings to per-zone FingerprintMatchers, loaded on demand.
+
+        Offers the FingerprintMatcher locate API (locate_miner,
+        locate_miners_batch, beacon_ids), so the gateway can use either one.
+
+        Parameters:
+        - index_path: zones.json written by split_radio_map()
+        - max_zones: Most zone matchers kept loaded at once
+        - max_bytes: Budget for their scoring arrays; least recently used zones
+          are evicted beyond it (the zone in use is always kept)
+        - route_beacons: Strongest heard beacons used for routing
+        - matcher_kwargs: Passed to every zone's FingerprintMatcher
+          (confidence_threshold, match_mode, maze_data, cache_size, ...)
+        """
+        with open(index_path, 'r') as f:
+            self.index = json.load(f)
+
+        self.zones_dir = os.path.dirname(os.path.abspath(index_path))
+        self.max_zones = max_zones
+        self.max_bytes = max_bytes
+        self.route_beacons = route_beacons
+        self.matcher_kwargs = matcher_kwargs
+        self.maze_data = matcher_kwargs.get('maze_data')
+        self.beacon_ids = list(self.index['beacon_ids'])
+
+        # Inverted index for routing: beacon -> {zone_id: (min, max) mean RSSI in zone}
+        self._beacon_zones = {}
+        for zone_id, entry in self.index['zones'].items():
+            for beacon_id, (low, high) in entry['beacon_ranges'].items():
+                self._beacon_zones.setdefault(beacon_id, {})[zone_id] = (low, high)
+
+        self._matchers = OrderedDict()  # zone_id -> (matcher, nbytes)
+        self._lock = threading.Lock()
+        self._miner_zones = {}
+        self.stats = {'loads': 0, 'hits': 0, 'evictions': 0, 'resident_bytes': 0}
+
+    def route(self, processed_rssi, miner_id=None):
+        """
+        Zone for a reading, or None if no known beacon was heard.
+
+        Each of the strongest heard beacons charges every candidate zone the
+        distance (dB) from the reading to the range of means that beacon shows
+        in the zone, or ROUTE_MISSING_PENALTY if the zone has no stats for it.
+        The cheapest zone wins; ties keep the miner's previous zone.
+        """
+        heard = sorted(
+            ((rssi, beacon_id) for beacon_id, rssi in processed_rssi.items()
+             if rssi > MISSING_RSSI and beacon_id in self._beacon_zones),
+            reverse=True
+        )[:self.route_beacons]
+        if not heard:
+            return None
+
+        candidates = set()
+        for _, beacon_id in heard:
+            candidates.update(self._beacon_zones[beacon_id])
+
+        costs = {}
+        for zone_id in candidates:
+            cost = 0.0
+            for rssi, beacon_id in heard:
+                zone_range = self._beacon_zones[beacon_id].get(zone_id)
+                if zone_range is None:
+                    cost += ROUTE_MISSING_PENALTY
+                else:
+                    cost += max(zone_range[0] - rssi, rssi - zone_range[1], 0.0)
+            costs[zone_id] = cost
+
+        best = min(sorted(costs), key=costs.get)
+        previous = self._miner_zones.get(miner_id)
+        if previous in costs and costs[previous] == costs[best]:
+            best = previous
+
+        if miner_id is not None:
+            self._miner_zones[miner_id] = best
+        return best
+
+    def matcher(self, zone_id):
+        """FingerprintMatcher for a zone, loading it (and evicting others) if needed."""
+        with self._lock:
+            if zone_id in self._matchers:
+                self._matchers.move_to_end(zone_id)
+                self.stats['hits'] += 1
+                return self._matchers[zone_id][0]
+
+            entry = self.index['zones'][zone_id]
+            matcher = FingerprintMatcher(os.path.join(self.zones_dir, entry['artifact']), **self.matcher_kwargs)
+            nbytes = _engine_nbytes(matcher)
+
+            self._matchers[zone_id] = (matcher, nbytes)
+            self.stats['loads'] += 1
+            self.stats['resident_bytes'] += nbytes
+
+            # Evict least recently used zones beyond the count or memory budget
+            while len(self._matchers) > 1 and (
+                    len(self._matchers) > self.max_zones or self.stats['resident_bytes'] > self.max_bytes):
+                _, (_, evicted_bytes) = self._matchers.popitem(last=False)
+                self.stats['resident_bytes'] -= evicted_bytes
+                self.stats['evictions'] += 1
+
+            return matcher
+
+    def loaded_zones(self):
+        """Zone IDs currently in memory, least recently used first."""
+        with self._lock:
+            return list(self._matchers.keys())
+
+    def forget_miner(self, miner_id):
+        """Drop a miner's routing state and its state in every loaded zone matcher."""
+        self._miner_zones.pop(miner_id, None)
+        with self._lock:
+            matchers = [matcher for matcher, _ in self._matchers.values()]
+        for matcher in matchers:
+            matcher.forget_miner(miner_id)
+
+    def locate_miner(self, processed_rssi, miner_id=None, **locate_kwargs):
+        """
+        Route a reading to its zone and localize it there.
+
+        Parameters:
+        - processed_rssi: Dict from RSSIPreprocessor
+        - miner_id: Optional miner ID (also keeps routing sticky on ties)
+        - locate_kwargs: Passed to FingerprintMatcher.locate_miner
+          (previous_state, now, deadline)
+
+        Returns:
+        FingerprintMatcher result dict with metrics['zone'] set.
+        """
+        if not processed_rssi or not isinstance(processed_rssi, dict):
+            return self._error_result("Invalid RSSI input", miner_id)
+
+        zone_id = self.route(processed_rssi, miner_id)
+        if zone_id is None:
+            return self._error_result("No zone beacons heard", miner_id)
+
+        result = self.matcher(zone_id).locate_miner(processed_rssi, miner_id=miner_id, **locate_kwargs)
+        result['metrics']['zone'] = zone_id
+        return result
+
+    def locate_miners_batch(self, rssi_list, miner_ids=None, deadline=None):
+        """
+        Localize several miners, one locate_miners_batch call per zone.
+
+        Returns:
+        List of result dicts in rssi_list order, each with metrics['zone'].
+        """
+        if miner_ids is None:
+            miner_ids = [None] * len(rssi_list)
+
+        results = [None] * len(rssi_list)
+        by_zone = {}
+        for i, (processed_rssi, miner_id) in enumerate(zip(rssi_list, miner_ids)):
+            if not processed_rssi or not isinstance(processed_rssi, dict):
+                results[i] = self._error_result("Invalid RSSI input", miner_id)
+                continue
+            zone_id = self.route(processed_rssi, miner_id)
+            if zone_id is None:
+                results[i] = self._error_result("No zone beacons heard", miner_id)
+            else:
+                by_zone.setdefault(zone_id, []).append(i)
+
+        for zone_id, positions in by_zone.items():
+            zone_results = self.matcher(zone_id).locate_miners_batch(
+                [rssi_list[i] for i in positions], [miner_ids[i] for i in positions], deadline=deadline
+            )
+            for i, result in zip(positions, zone_results):
+                result['metrics']['zone'] = zone_id
+                results[i] = result
+
+        return results
+
+    def get_stats(self):
+        """Load/hit/eviction counters plus loaded zones and resident bytes."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['loaded_zones'] = list(self._matchers.keys())
+        return stats
+
+    def _error_result(self, error_message, miner_id=None):
+        """Same shape as FingerprintMatcher._error_result."""
+        return {
+            'miner_id': miner_id,
+            'location': None,
+            'confidence': 0.0,
+            'metrics': {
+                'error': error_message,
+                'valid_beacons': 0,
+                'top_candidates': []
+            },
+            'status': 'LOCALIZATION_FAILED',
+            'valid': False
+        }
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else RADIO_MAP_FILE
+    target = sys.argv[2] if len(sys.argv) > 2 else ZONES_DIR
+    zone_size = float(sys.argv[3]) if len(sys.argv) > 3 else ZONE_SIZE
+
+    if not os.path.exists(source):
+        print(f"❌ {source} not found")
+        sys.exit(1)
+
+    index = split_radio_map(source, target, zone_size=zone_size)
+    print(f"✅ Split {source} into {len(index['zones'])} zones -> {target}")
+    for zone_id, entry in index['zones'].items():
+        print(f"   {zone_id}: {entry['n_cells']} cells, {len(entry['beacon_ids'])} beacons")
@@ -23,7 +23,12 @@ sys.path.insert(0, os. path.dirname(os.path. dirname(os.path.abspath(__file__)))
 # Import algorithm modules
 from algorithms.rssi_preprocessing import RSSIPreprocessor
 from algorithms.fingerprint_matching import FingerprintMatcher
+from algorithms.particle_filter import ParticleFilterLocalizer
+from algorithms.sharded_matching import ShardedMatcher
+from algorithms.compile_radio_map import artifact_is_current
+from algorithms.zone_registry import ZoneRegistry
 from algorithms.state_management import MinerStateManager
+from algorithms.stream_aggregator import StreamAggregator
 from algorithms.maze_creation import generate_floor_plan, create_digitized_maze_data_cartesian
 from algorithms. solver_and_orientation import get_navigation_stack
 from algorithms.navigation import convert_coordinate_stack_to_move_sequence
@@ -40,9 +45,38 @@ SAFE_ZONE = (0, 15)
 
 # Algorithm Configuration
 RADIO_MAP_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "algorithms", "radio_map.json")
-BEACON_IDS = ['B1', 'B2', 'B3']
+RADIO_MAP_ARTIFACT = os.path.join(os.path.dirname(__file__), "..", "..", "algorithms", "radio_map.rmap")
+# Zoned map from zone_registry.py; used instead of the single map when present
+RADIO_MAP_ZONE_INDEX = os.path.join(os.path.dirname(__file__), "..", "..", "algorithms", "zones", "zones.json")
+MAX_LOADED_ZONES = 4
+ZONE_MEMORY_BUDGET = 64 * 2 ** 20  # Bytes of zone scoring arrays kept in memory
+BEACON_IDS = ['B1', 'B2', 'B3']  # Replaced by the radio map's beacon set in init_algorithms
 MIN_CONFIDENCE_THRESHOLD = 0.4
+# 'naive_bayes' works at any map size and is the only mode ShardedMatcher
+# spreads over LOCATION_WORKERS; 'lut' (precomputed tables, falls back to
+# 'naive_bayes' past 256 MiB) and 'hierarchical' run in-process only
+MATCH_MODE = 'naive_bayes'
+LOCATION_TIME_BUDGET = 0.05  # Seconds per fix before 'hierarchical' returns its best so far
+LOCATION_CACHE_SIZE = 256  # Results cached per quantized RSSI vector (0 disables)
+RADIO_MAP_RELOAD_INTERVAL = 5.0  # Seconds between radio map change checks
+# 'fix' (independent fixes: sharding, result cache, previous-fix move limit),
+# 'grid_filter' (FingerprintMatcher.track_miner) or 'particle_filter' (IMU
+# dead reckoning + fingerprints). The filters are opt-in, need the maze and
+# replace the 'fix' path for every identified miner.
+LOCALIZATION_MODE = 'fix'
+PARTICLES_PER_MINER = 500
+# Worker processes for global searches on very large 'naive_bayes' maps (1 disables)
+LOCATION_WORKERS = 4
 MOVE_LIMIT_PER_CYCLE = 5
+# Bounded per-miner state: discovered tags beyond the limit, or idle this long, are evicted
+MAX_TRACKED_MINERS = 500
+MINER_IDLE_TTL = 30 * 60  # Seconds
+# Seconds per window when pooling packets per miner and processing once per
+# window (0: every packet is processed on arrival). Windowing holds each TCP
+# reply until the packet's window is processed, up to 2 windows + lateness.
+STREAM_WINDOW = 0
+STREAM_WINDOW_MODE = 'tumbling'  # or 'sliding' (a new window every half window)
+STREAM_ALLOWED_LATENESS = 0.5  # Seconds a window waits for delayed packets
 
 # State Management
 db_lock = threading.Lock()
@@ -51,9 +85,16 @@ iot_client = None
 # Algorithm Components (initialized in init_algorithms)
 rssi_preprocessor = None
 fingerprint_matcher = None
+particle_localizer = None
+sharded_matcher = None
 miner_state_manager = None
+stream_aggregator = None
 maze_data = None
 
+# End of the last window processed, for TCP handlers awaiting their fix
+window_processed = threading.Condition()
+last_processed_window_end = None
+
 # Thread Pool for handling multiple miners
 thread_pool = ThreadPoolExecutor(max_workers=4)
 
@@ -62,23 +103,17 @@ thread_pool = ThreadPoolExecutor(max_workers=4)
 
 def init_algorithms():
     """Initialize all algorithm components."""
-    global rssi_preprocessor, fingerprint_matcher, miner_state_manager, maze_data
+    global rssi_preprocessor, fingerprint_matcher, particle_localizer, sharded_matcher, miner_state_manager, stream_aggregator, maze_data, BEACON_IDS
     
     print("Initializing algorithm components...")
     
-    # Initialize RSSI preprocessor
-    rssi_preprocessor = RSSIPreprocessor(
-        alpha=0.3,
-        outlier_threshold_db=15,
-        min_samples=5,
-        max_history=10
-    )
-    print("  - RSSI Preprocessor initialized")
-    
     # Initialize miner state manager with expected miner IDs
     miner_state_manager = MinerStateManager(
-        expected_miner_ids=['M01', 'M02', 'M03', 'M04', 'M05']
+        expected_miner_ids=['M01', 'M02', 'M03', 'M04', 'M05'],
+        max_tracked=MAX_TRACKED_MINERS,
+        idle_ttl=MINER_IDLE_TTL
     )
+    miner_state_manager.add_eviction_listener(forget_evicted_miner)
     print("  - Miner State Manager initialized")
     
     # Initialize maze data from floor plan
@@ -87,21 +122,118 @@ def init_algorithms():
     print(f"  - Maze data initialized: {maze_data['dimensions']} grid with {len(maze_data['exits'])} exits")
     
     # Initialize fingerprint matcher if radio map exists
-    if os. path.exists(RADIO_MAP_FILE):
+    # A zoned map loads zone matchers on demand (same locate API)
+    if os.path.exists(RADIO_MAP_ZONE_INDEX):
         try:
-            fingerprint_matcher = FingerprintMatcher(RADIO_MAP_FILE)
+            fingerprint_matcher = ZoneRegistry(
+                RADIO_MAP_ZONE_INDEX, max_zones=MAX_LOADED_ZONES, max_bytes=ZONE_MEMORY_BUDGET,
+                maze_data=maze_data, match_mode=MATCH_MODE, cache_size=LOCATION_CACHE_SIZE
+            )
+            print(f"  - Zoned radio map: {len(fingerprint_matcher.index['zones'])} zones from {RADIO_MAP_ZONE_INDEX}")
+        except Exception as e:
+            print(f"  - Warning: Failed to load zone index: {e}")
+            fingerprint_matcher = None
+    
+    # Prefer the compiled artifact (memory-mapped) when it matches the JSON
+    if fingerprint_matcher is None and artifact_is_current(RADIO_MAP_ARTIFACT, RADIO_MAP_FILE):
+        try:
+            fingerprint_matcher = FingerprintMatcher(
+                RADIO_MAP_ARTIFACT, maze_data=maze_data, match_mode=MATCH_MODE,
+                cache_size=LOCATION_CACHE_SIZE
+            )
+            print(f"  - Fingerprint Matcher initialized from {RADIO_MAP_ARTIFACT}")
+        except Exception as e:
+            print(f"  - Warning: Failed to load radio map artifact: {e}")
+            fingerprint_matcher = None
+    
+    if fingerprint_matcher is None and os. path.exists(RADIO_MAP_FILE):
+        try:
+            fingerprint_matcher = FingerprintMatcher(
+                RADIO_MAP_FILE, maze_data=maze_data, match_mode=MATCH_MODE,
+                cache_size=LOCATION_CACHE_SIZE
+            )
             print(f"  - Fingerprint Matcher initialized from {RADIO_MAP_FILE}")
         except Exception as e:
             print(f"  - Warning: Failed to load fingerprint matcher: {e}")
             fingerprint_matcher = None
-    else:
+    elif fingerprint_matcher is None:
         print(f"  - Warning: Radio map not found at {RADIO_MAP_FILE}")
         print("    Position estimation will fall back to simulator data")
         fingerprint_matcher = None
     
+    if isinstance(fingerprint_matcher, FingerprintMatcher) and fingerprint_matcher.mode_fallback:
+        print(f"  - Warning: {fingerprint_matcher.mode_fallback}; matching in '{fingerprint_matcher.match_mode}' mode")
+    
+    # Beacon set comes from the radio map metadata when one is loaded
+    if fingerprint_matcher:
+        BEACON_IDS = list(fingerprint_matcher.beacon_ids)
+        print(f"  - Beacon set from radio map: {len(BEACON_IDS)} beacons")
+    
+    # Hot reload and the tracking filters need a single whole-map matcher
+    if isinstance(fingerprint_matcher, FingerprintMatcher):
+        # Spread full-map scoring over the cores (small maps stay in-process)
+        if fingerprint_matcher.match_mode == 'naive_bayes' and LOCATION_WORKERS > 1:
+            sharded_matcher = ShardedMatcher(fingerprint_matcher, n_workers=LOCATION_WORKERS)
+            print(f"  - Sharded matching across {LOCATION_WORKERS} worker processes")
+        
+        # Pick up recalibrated radio maps without restarting the gateway
+        fingerprint_matcher.start_watching(
+            interval=RADIO_MAP_RELOAD_INTERVAL,
+            radio_map_path=RADIO_MAP_FILE,
+            on_reload=report_radio_map_reload
+        )
+        print(f"  - Watching {RADIO_MAP_FILE} for changes")
+        
+        if LOCALIZATION_MODE == 'particle_filter':
+            particle_localizer = ParticleFilterLocalizer(
+                fingerprint_matcher, maze_data=maze_data, n_particles=PARTICLES_PER_MINER
+            )
+            print(f"  - Particle filter initialized ({PARTICLES_PER_MINER} particles per miner)")
+    
+    # Initialize RSSI preprocessor
+    # Kalman smoothing settles within fewer samples per burst than the EMA
+    rssi_preprocessor = RSSIPreprocessor(
+        outlier_threshold_db=15,
+        min_samples=3,
+        max_history=10,
+        beacon_ids=BEACON_IDS,
+        smoothing='kalman'
+    )
+    print("  - RSSI Preprocessor initialized")
+    
+    if STREAM_WINDOW:
+        stream_aggregator = StreamAggregator(
+            window=STREAM_WINDOW, mode=STREAM_WINDOW_MODE,
+            allowed_lateness=STREAM_ALLOWED_LATENESS, late_policy='next', beacon_ids=BEACON_IDS
+        )
+        print(f"  - Stream aggregator initialized ({STREAM_WINDOW_MODE} {STREAM_WINDOW}s windows)")
+    
     print("Algorithm initialization complete.")
 
 
+def forget_evicted_miner(miner_id, reason):
+    """Drop an evicted miner's state from every per-miner component."""
+    if rssi_preprocessor:
+        rssi_preprocessor.forget_miner(miner_id)
+    if fingerprint_matcher:
+        fingerprint_matcher.forget_miner(miner_id)
+    if particle_localizer:
+        particle_localizer.reset(miner_id)
+    print(f"Evicted miner {miner_id} ({reason})")
+
+
+def report_radio_map_reload(info):
+    """Log the outcome of a radio map hot reload."""
+    if 'error' in info:
+        print(f"Radio map reload failed, keeping previous map: {info['error']}")
+        return
+    
+    print(f"Radio map reloaded: {info['changed_cells']}/{info['total_cells']} cells rebuilt "
+          f"in {info['duration']:.3f}s")
+    if list(fingerprint_matcher.beacon_ids) != BEACON_IDS:
+        print("  - Warning: beacon set changed, restart the gateway to update preprocessing")
+
+
 # 3 - Azure IoT Hub Setup
 
 def init_iot_client():
@@ -206,27 +338,8 @@ def init_database():
 
 # 5 - Position Estimation using Fingerprinting
 
-def estimate_miner_position(ble_readings, miner_id=None):
-    """
-    Estimate miner position using the fingerprint matching algorithm pipeline.
-    
-    Args:
-        ble_readings: Dict of beacon_id -> rssi_value or beacon_id -> [rssi_values]
-        miner_id: Optional miner identifier for state tracking
-    
-    Returns:
-        Tuple of (position, confidence) where position is (x, y) or None
-    """
-    global fingerprint_matcher, rssi_preprocessor, miner_state_manager
-    
-    if not ble_readings:
-        return None, 0.0
-    
-    if not fingerprint_matcher:
-        # No radio map available - cannot estimate position
-        return None, 0.0
-    
-    # Convert ble_readings to format expected by preprocessor
+def raw_samples_from_readings(ble_readings):
+    """Convert ble_readings into the preprocessor's {beacon_id: [rssi_values]} format."""
     # Handle both single values and lists of values
     raw_samples = {}
     for beacon_id, value in ble_readings.items():
@@ -241,36 +354,70 @@ def estimate_miner_position(ble_readings, miner_id=None):
         if beacon_id not in raw_samples:
             raw_samples[beacon_id] = []
     
-    # Get previous smoothed values from state manager if available
-    previous_smoothed = None
+    return raw_samples
+
+
+def record_miner_activity(miner_id):
+    """Keep a miner current in the state manager (eviction order)."""
     if miner_id and miner_state_manager:
-        miner_state = miner_state_manager.get_miner_state(miner_id)
-        if miner_state and miner_state.get('smoothed_rssi'):
-            previous_smoothed = miner_state['smoothed_rssi']
+        miner_state_manager.touch_miner(miner_id)
+
+
+def preprocess_miner_readings(ble_readings, miner_id=None):
+    """
+    Run the RSSI preprocessing stage for one miner.
     
-    # Step 1: Preprocess RSSI data
+    Args:
+        ble_readings: Dict of beacon_id -> rssi_value or beacon_id -> [rssi_values]
+        miner_id: Optional miner identifier for state tracking
+    
+    Returns:
+        Preprocessor result dict
+    """
+    global rssi_preprocessor, miner_state_manager
+    
+    # Preprocess RSSI data (Kalman state is kept per miner by the preprocessor)
     processed = rssi_preprocessor.process_miner_rssi(
         miner_id or "unknown",
-        raw_samples,
-        previous_smoothed=previous_smoothed
+        raw_samples_from_readings(ble_readings)
     )
     
-    # Update smoothed RSSI in state manager
-    if miner_id and miner_state_manager:
-        for beacon_id, value in processed['processed_rssi'].items():
-            miner_state_manager. update_smoothed_rssi(miner_id, beacon_id, value)
+    record_miner_activity(miner_id)
+    if not miner_id:
+        # Anonymous readings share no history; don't keep state for them
+        rssi_preprocessor.forget_miner("unknown")
+    return processed
+
+
+def preprocess_cycle_readings(readings_by_miner):
+    """
+    Run the RSSI preprocessing stage for every miner of a scan cycle in one
+    RSSIPreprocessor.process_batch call.
     
-    # Check if preprocessing confidence is too low
-    if processed['overall_confidence'] < 0.3:
-        print(f"  Low preprocessing confidence for {miner_id}: {processed['overall_confidence']:. 2f}")
-        return None, processed['overall_confidence']
+    Args:
+        readings_by_miner: Dict of miner_id -> ble_readings (non-empty)
     
-    # Step 2: Use fingerprint matcher to estimate location
-    location_result = fingerprint_matcher.locate_miner(
-        processed['processed_rssi'],
-        miner_id=miner_id
-    )
+    Returns:
+        Dict of miner_id -> preprocessor result dict
+    """
+    global rssi_preprocessor, miner_state_manager
     
+    miner_ids, samples, mask = rssi_preprocessor.pack_samples({
+        miner_id: raw_samples_from_readings(ble_readings)
+        for miner_id, ble_readings in readings_by_miner.items()
+    })
+    
+    batch = rssi_preprocessor.process_batch(miner_ids, samples, mask)
+    
+    processed_by_miner = {}
+    for row, miner_id in enumerate(miner_ids):
+        record_miner_activity(miner_id)
+        processed_by_miner[miner_id] = rssi_preprocessor.batch_miner_result(batch, row)
+    return processed_by_miner
+
+
+def interpret_location_result(location_result, miner_id):
+    """Convert a FingerprintMatcher result into a (position, confidence) tuple."""
     if location_result['valid']:
         position = (
             location_result['location']['x'],
@@ -284,6 +431,149 @@ def estimate_miner_position(ble_readings, miner_id=None):
     return None, 0.0
 
 
+def locate_processed_rssi(processed_rssi, miner_id, imu_data=None, previous_state=None):
+    """
+    Run the localizer selected by LOCALIZATION_MODE on one preprocessed reading.
+    
+    Args:
+        processed_rssi: Dict from RSSIPreprocessor (None: IMU-only particle filter update)
+        miner_id: Miner identifier (filters keep per-miner state)
+        imu_data: Optional telemetry IMU dict (particle filter only)
+        previous_state: Optional MinerStateManager state (independent fixes only)
+    
+    Returns:
+        FingerprintMatcher-format result dict
+    """
+    if particle_localizer and miner_id:
+        return particle_localizer.update(miner_id, processed_rssi, imu_data)
+    
+    if (LOCALIZATION_MODE == 'grid_filter' and miner_id and isinstance(fingerprint_matcher, FingerprintMatcher)
+            and fingerprint_matcher.maze_data is not None):
+        return fingerprint_matcher.track_miner(processed_rssi, miner_id)
+    
+    return (sharded_matcher or fingerprint_matcher).locate_miner(
+        processed_rssi,
+        miner_id=miner_id,
+        previous_state=previous_state,
+        deadline=time.time() + LOCATION_TIME_BUDGET
+    )
+
+
+def estimate_miner_position(ble_readings, miner_id=None, imu_data=None):
+    """
+    Estimate miner position using the fingerprint matching algorithm pipeline.
+    
+    Args:
+        ble_readings: Dict of beacon_id -> rssi_value or beacon_id -> [rssi_values]
+        miner_id: Optional miner identifier for state tracking
+        imu_data: Optional IMU dict from the telemetry packet (particle filter)
+    
+    Returns:
+        Tuple of (position, confidence) where position is (x, y) or None
+    """
+    global fingerprint_matcher, miner_state_manager
+    
+    if not ble_readings:
+        return None, 0.0
+    
+    if not fingerprint_matcher:
+        # No radio map available - cannot estimate position
+        return None, 0.0
+    
+    # Last fix lets the matcher search only cells reachable since then
+    previous_state = None
+    if miner_id and miner_state_manager:
+        previous_state = miner_state_manager.get_miner_state(miner_id)
+    
+    # Step 1: Preprocess RSSI data
+    processed = preprocess_miner_readings(ble_readings, miner_id)
+    
+    # Check if preprocessing confidence is too low
+    if processed['overall_confidence'] < 0.3:
+        print(f"  Low preprocessing confidence for {miner_id}: {processed['overall_confidence']:. 2f}")
+        if not (particle_localizer and miner_id):
+            return None, processed['overall_confidence']
+        
+        # The particle filter can still dead-reckon on the IMU alone
+        location_result = locate_processed_rssi(None, miner_id, imu_data)
+        return interpret_location_result(location_result, miner_id)
+    
+    # Step 2: Use fingerprint matcher to estimate location
+    location_result = locate_processed_rssi(
+        processed['processed_rssi'], miner_id, imu_data, previous_state
+    )
+    
+    return interpret_location_result(location_result, miner_id)
+
+
+def estimate_miner_positions_batch(readings_by_miner, imu_by_miner=None):
+    """
+    Estimate positions for every miner that reported in the same scan cycle.
+    
+    Preprocessing runs once for the whole cycle (RSSIPreprocessor.process_batch).
+    Independent fixes are scored against the radio map in one
+    FingerprintMatcher.locate_miners_batch call, the particle filter scores
+    every miner's particles in one ParticleFilterLocalizer.update_batch call,
+    and the grid filter updates each miner's track in turn.
+    
+    Args:
+        readings_by_miner: Dict of miner_id -> ble_readings
+        imu_by_miner: Optional dict of miner_id -> imu_data (particle filter)
+    
+    Returns:
+        Dict of miner_id -> (position, confidence)
+    """
+    global fingerprint_matcher
+    
+    estimates = {}
+    batch_ids = []
+    batch_rssi = []
+    
+    cycle_readings = {}
+    for miner_id, ble_readings in readings_by_miner.items():
+        if not ble_readings or not fingerprint_matcher:
+            estimates[miner_id] = (None, 0.0)
+        else:
+            cycle_readings[miner_id] = ble_readings
+    
+    processed_by_miner = preprocess_cycle_readings(cycle_readings) if cycle_readings else {}
+    
+    for miner_id, processed in processed_by_miner.items():
+        if processed['overall_confidence'] < 0.3:
+            print(f"  Low preprocessing confidence for {miner_id}: {processed['overall_confidence']:.2f}")
+            if particle_localizer:
+                # The particle filter can still dead-reckon on the IMU alone
+                batch_ids.append(miner_id)
+                batch_rssi.append(None)
+            else:
+                estimates[miner_id] = (None, processed['overall_confidence'])
+            continue
+        
+        batch_ids.append(miner_id)
+        batch_rssi.append(processed['processed_rssi'])
+    
+    imu_by_miner = imu_by_miner or {}
+    if batch_ids and particle_localizer:
+        location_results = particle_localizer.update_batch(
+            batch_ids, batch_rssi, [imu_by_miner.get(miner_id) for miner_id in batch_ids]
+        )
+        for miner_id, location_result in zip(batch_ids, location_results):
+            estimates[miner_id] = interpret_location_result(location_result, miner_id)
+    elif batch_ids and LOCALIZATION_MODE == 'grid_filter':
+        for miner_id, processed_rssi in zip(batch_ids, batch_rssi):
+            location_result = locate_processed_rssi(processed_rssi, miner_id, imu_by_miner.get(miner_id))
+            estimates[miner_id] = interpret_location_result(location_result, miner_id)
+    elif batch_ids:
+        location_results = (sharded_matcher or fingerprint_matcher).locate_miners_batch(
+            batch_rssi, miner_ids=batch_ids,
+            deadline=time.time() + LOCATION_TIME_BUDGET * len(batch_ids)
+        )
+        for miner_id, location_result in zip(batch_ids, location_results):
+            estimates[miner_id] = interpret_location_result(location_result, miner_id)
+    
+    return estimates
+
+
 # 6 - Pathfinding and Navigation
 
 def calculate_escape_path(current_position, miner_id):
@@ -448,6 +738,9 @@ def process_miner_message(message_data, db_conn):
     6. Generate move instructions
     7.  Store in database
     8. Send to Azure IoT Hub
+    
+    With STREAM_WINDOW set, the message is only buffered; steps 2-8 run
+    once per closed window in process_stream_window.
     """
     global miner_state_manager
     
@@ -461,83 +754,16 @@ def process_miner_message(message_data, db_conn):
             print("Invalid message: missing device_id")
             return
         
+        if stream_aggregator:
+            # Pooled with the miner's other packets, processed when the window closes
+            stream_aggregator.add(miner_id, ble_readings, payload=message)
+            return
+        
         print(f"\nProcessing message from {miner_id}...")
         
         # Step 1: Estimate position using fingerprinting pipeline
-        position, confidence = estimate_miner_position(ble_readings, miner_id)
-        
-        # Fallback to simulator position if available and fingerprinting failed
-        simulator_position = message.get('position')
-        if not position and simulator_position:
-            position = (simulator_position['x'], simulator_position['y'])
-            confidence = 1.0
-            print(f"  Using simulator position: ({position[0]}, {position[1]})")
-        
-        # Initialize path and move sequence
-        path = []
-        move_sequence = []
-        
-        if position:
-            # Step 2: Check confidence threshold
-            if confidence >= MIN_CONFIDENCE_THRESHOLD:
-                # Step 3: Calculate escape path
-                path = calculate_escape_path(position, miner_id)
-                
-                if path:
-                    # Step 4: Get current orientation from state
-                    current_orientation = 'N'
-                    if miner_state_manager:
-                        miner_state = miner_state_manager.get_miner_state(miner_id)
-                        if miner_state:
-                            current_orientation = miner_state.get('estimated_orientation', 'N')
-                    
-                    # Step 5: Generate move instructions
-                    move_sequence = get_move_instructions(path, position, current_orientation)
-                    
-                    # Limit moves per cycle
-                    moves_to_send = move_sequence[:MOVE_LIMIT_PER_CYCLE]
-                    print(f"  Move sequence: {' '. join(moves_to_send)} ({len(move_sequence)} total)")
-            else:
-                print(f"  Confidence {confidence:.2f} below threshold {MIN_CONFIDENCE_THRESHOLD}")
-            
-            # Step 6: Update state and database
-            update_miner_state(
-                miner_id, position, confidence, imu_data, ble_readings,
-                path, move_sequence, db_conn
-            )
-        else:
-            print(f"  Could not determine position for {miner_id}")
-        
-        # Step 7: Prepare and send Azure payload
-        azure_payload = {
-            "device_id": miner_id,
-            "timestamp": datetime.now().isoformat(),
-            "device_timestamp": message.get("timestamp"),
-            "position": {
-                "x": position[0],
-                "y": position[1]
-            } if position else None,
-            "confidence": confidence,
-            "ble_readings": ble_readings,
-            "imu_data": imu_data,
-            "navigation": {
-                "path_length": len(path),
-                "next_moves": move_sequence[:MOVE_LIMIT_PER_CYCLE] if move_sequence else [],
-                "status": "NAVIGATING" if path else "NO_PATH"
-            } if position else None,
-            "miner_status": miner_state_manager.get_miner_state(miner_id). get('status', 'UNKNOWN') if miner_state_manager and position else 'NO_POSITION'
-        }
-        
-        # Add simulator position for comparison/debugging
-        if simulator_position:
-            azure_payload["simulator_position"] = simulator_position
-        
-        # Add battery level
-        battery_value = message.get("battery", imu_data.get("battery", None))
-        if battery_value is not None:
-            azure_payload["battery"] = battery_value
-        
-        send_to_azure(azure_payload)
+        position, confidence = estimate_miner_position(ble_readings, miner_id, imu_data)
+        apply_miner_fix(message, ble_readings, position, confidence, db_conn)
         
     except json.JSONDecodeError as e:
         print(f"Failed to parse message JSON: {e}")
@@ -547,6 +773,142 @@ def process_miner_message(message_data, db_conn):
         traceback.print_exc()
 
 
+def apply_miner_fix(message, ble_readings, position, confidence, db_conn):
+    """
+    Steps after position estimation: path, instructions, state, database and Azure.
+    
+    Args:
+        message: Parsed miner message (device_id, imu_data, position, battery, ...)
+        ble_readings: Readings as received from the miner (stored and uploaded)
+        position: Estimated (x, y) or None
+        confidence: Fix confidence
+    """
+    global miner_state_manager
+    
+    miner_id = message.get('device_id')
+    imu_data = message.get('imu_data', {})
+    
+    # Fallback to simulator position if available and fingerprinting failed
+    simulator_position = message.get('position')
+    if not position and simulator_position:
+        position = (simulator_position['x'], simulator_position['y'])
+        confidence = 1.0
+        print(f"  Using simulator position: ({position[0]}, {position[1]})")
+    
+    # Initialize path and move sequence
+    path = []
+    move_sequence = []
+    
+    if position:
+        # Step 2: Check confidence threshold
+        if confidence >= MIN_CONFIDENCE_THRESHOLD:
+            # Step 3: Calculate escape path
+            path = calculate_escape_path(position, miner_id)
+            
+            if path:
+                # Step 4: Get current orientation from state
+                current_orientation = 'N'
+                if miner_state_manager:
+                    miner_state = miner_state_manager.get_miner_state(miner_id)
+                    if miner_state:
+                        current_orientation = miner_state.get('estimated_orientation', 'N')
+                
+                # Step 5: Generate move instructions
+                move_sequence = get_move_instructions(path, position, current_orientation)
+                
+                # Limit moves per cycle
+                moves_to_send = move_sequence[:MOVE_LIMIT_PER_CYCLE]
+                print(f"  Move sequence: {' '. join(moves_to_send)} ({len(move_sequence)} total)")
+        else:
+            print(f"  Confidence {confidence:.2f} below threshold {MIN_CONFIDENCE_THRESHOLD}")
+        
+        # Step 6: Update state and database
+        update_miner_state(
+            miner_id, position, confidence, imu_data, ble_readings,
+            path, move_sequence, db_conn
+        )
+    else:
+        print(f"  Could not determine position for {miner_id}")
+    
+    # Step 7: Prepare and send Azure payload
+    azure_payload = {
+        "device_id": miner_id,
+        "timestamp": datetime.now().isoformat(),
+        "device_timestamp": message.get("timestamp"),
+        "position": {
+            "x": position[0],
+            "y": position[1]
+        } if position else None,
+        "confidence": confidence,
+        "ble_readings": ble_readings,
+        "imu_data": imu_data,
+        "navigation": {
+            "path_length": len(path),
+            "next_moves": move_sequence[:MOVE_LIMIT_PER_CYCLE] if move_sequence else [],
+            "status": "NAVIGATING" if path else "NO_PATH"
+        } if position else None,
+        "miner_status": miner_state_manager.get_miner_state(miner_id). get('status', 'UNKNOWN') if miner_state_manager and position else 'NO_POSITION'
+    }
+    
+    # Add simulator position for comparison/debugging
+    if simulator_position:
+        azure_payload["simulator_position"] = simulator_position
+    
+    # Add battery level
+    battery_value = message.get("battery", imu_data.get("battery", None))
+    if battery_value is not None:
+        azure_payload["battery"] = battery_value
+    
+    send_to_azure(azure_payload)
+
+
+def process_stream_window(window, db_conn):
+    """
+    Run the pipeline once for every miner of a closed StreamAggregator window:
+    one batched preprocessing / localization pass, then apply_miner_fix per miner.
+    """
+    global last_processed_window_end
+    
+    messages = window['payloads']
+    print(f"\nProcessing window {window['window_start']:.1f}s: {len(messages)} miners, "
+          f"{sum(window['packets'].values())} packets")
+    
+    imu_by_miner = {miner_id: message.get('imu_data', {}) for miner_id, message in messages.items()}
+    estimates = estimate_miner_positions_batch(window['raw_samples'], imu_by_miner)
+    
+    for miner_id, (position, confidence) in estimates.items():
+        try:
+            # The latest packet's own readings keep the stored/uploaded format
+            message = messages[miner_id]
+            apply_miner_fix(message, message.get('ble_readings', {}), position, confidence, db_conn)
+        except Exception as e:
+            print(f"Error processing window for {miner_id}: {e}")
+    
+    with window_processed:
+        last_processed_window_end = window['window_end']
+        window_processed.notify_all()
+
+
+def stream_window_loop(db_conn):
+    """Process windows from the stream aggregator as they close."""
+    for window in stream_aggregator.windows():
+        try:
+            process_stream_window(window, db_conn)
+        except Exception as e:
+            print(f"Error processing stream window: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+def wait_for_window(received_at, timeout):
+    """Block until the window holding a packet received at received_at is processed."""
+    with window_processed:
+        return window_processed.wait_for(
+            lambda: last_processed_window_end is not None and last_processed_window_end > received_at,
+            timeout=timeout
+        )
+
+
 # 9 - TCP Listener and Handler
 
 TCP_IP = ''
@@ -578,7 +940,10 @@ def tcp_client_handler(conn, addr, db_conn):
             
             if json_data:
                 # Process (calculates full path)
+                received_at = time.time()
                 process_miner_message(json_data.encode('utf-8'), db_conn)
+                if stream_aggregator:
+                    wait_for_window(received_at, timeout=2 * STREAM_WINDOW + STREAM_ALLOWED_LATENESS)
                 
                 # Extract miner_id from JSON (or default to "M01")
                 try:
@@ -643,6 +1008,7 @@ def main_loop(db_conn):
         try:
             # Get status of all miners
             if miner_state_manager:
+                miner_state_manager.evict_idle()
                 active_miners = miner_state_manager. get_active_miners()
                 inactive_miners = miner_state_manager. get_inactive_miners()
                 avg_confidence = miner_state_manager.calculate_average_confidence()
@@ -710,6 +1076,10 @@ if __name__ == "__main__":
     tcp_thread = threading.Thread(target=tcp_listener, args=(db_conn,), daemon=True)
     tcp_thread.start()
     
+    if stream_aggregator:
+        window_thread = threading.Thread(target=stream_window_loop, args=(db_conn,), daemon=True)
+        window_thread.start()
+    
     print("\n" + "=" * 60)
     print("Gateway started successfully!")
     print("=" * 60)
@@ -726,7 +1096,11 @@ if __name__ == "__main__":
                 iot_client.disconnect()
             except Exception:
                 pass
+        if stream_aggregator:
+            stream_aggregator.close()
         db_conn.close()
         thread_pool.shutdown(wait=True)
+        if sharded_matcher:
+            sharded_matcher.close()
         print("Gateway stopped.")
     
\ No newline at end of file